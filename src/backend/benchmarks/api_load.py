@@ -0,0 +1,348 @@
+"""
+End-to-end API benchmark - /fileProcessing throughput by document size and /chat latency under load.
+
+Runs offline: Gemini, Pinecone and MongoDB are replaced by the deterministic fakes in benchmarks/fakes.py
+(with configurable latency), everything else - the ingestion pipeline, the embedding scheduler and
+caches, hybrid retrieval, context assembly and the streaming endpoint - is the real code, driven
+in-process through the ASGI app.
+
+  ingest - uploads synthetic documents of each size one at a time and times them from the upload
+           to the finished job (MB/s, chunks/s, per-stage timings of the job)
+  chat   - fires unique questions at each concurrency level, reports p50 / p95 / p99 latency, the
+           server side time to first token and the throughput
+
+Usage (from src/backend, needs mongomock-motor):
+    python -m benchmarks.api_load [--sizes-kb 16,64,256,1024] [--concurrency 1,8,32] [--requests 64]
+                                  [--json] [--output results.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# the settings object requires these - nothing is called or connected to
+os.environ.setdefault("GEMINI_API_KEY", "unused")
+os.environ.setdefault("MONGO_URL", "mongodb://localhost")
+os.environ.setdefault("DB_NAME", "benchmark")
+WORK_DIR = tempfile.mkdtemp(prefix = "api_load_")
+os.environ["LEXICAL_INDEX_PATH"] = os.path.join(WORK_DIR, "lexical_index.sqlite3")
+os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(WORK_DIR, "embedding_cache.sqlite3")
+os.environ["UPLOAD_SPOOL_DIR"] = os.path.join(WORK_DIR, "uploads")
+
+import httpx
+
+from config import config
+import server
+from benchmarks.fakes import FakeGenaiClient, FakePineconeIndex, fake_mongodb, install_fakes
+from benchmarks.synthetic import SYLLABLES, percentile
+from services.chat_sessions import session_compactor
+from services.embedding_cache import embedding_cache
+from services.executor import start_process_pool, stop_process_pool
+from services.ingestion_jobs import start_ingestion_workers, stop_ingestion_workers
+from services.lexical_index import lexical_index
+from services.mongodb import create_mongodb_indexes, get_mongodb
+
+
+def latency_summary(samples: list) -> dict:
+    """Milliseconds"""
+    return {
+        "p50": round(percentile(samples, 0.50) * 1000, 1),
+        "p95": round(percentile(samples, 0.95) * 1000, 1),
+        "p99": round(percentile(samples, 0.99) * 1000, 1),
+        "mean": round(sum(samples) / len(samples) * 1000, 1),
+        "max": round(max(samples) * 1000, 1),
+    }
+
+
+def make_document(rng: random.Random, size: int) -> bytes:
+    """Synthetic notes of about `size` bytes - made-up words, so documents never share chunks"""
+    vocabulary = ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(3000)]
+    lines = []
+    length = 0
+    while length < size:
+        sentences = [
+            " ".join(rng.choice(vocabulary) for _ in range(rng.randint(8, 20))).capitalize() + "."
+            for _ in range(rng.randint(3, 6))
+        ]
+        line = " ".join(sentences)
+        lines.append(line)
+        length += len(line) + 1
+
+    return "\n".join(lines).encode("utf-8")[:size]
+
+
+async def start_services(genai_client: FakeGenaiClient, index: FakePineconeIndex):
+    """The server lifespan, with the fakes installed instead of the connect_* calls"""
+    install_fakes(genai_client, index, fake_mongodb())
+    await create_mongodb_indexes()
+    await asyncio.to_thread(lexical_index.load)
+    await start_process_pool()
+    await start_ingestion_workers(get_mongodb())
+
+
+async def stop_services():
+    await session_compactor.stop()
+    await stop_ingestion_workers()
+    await stop_process_pool()
+    lexical_index.close()
+    embedding_cache.close()
+
+
+async def ingest(
+    client: httpx.AsyncClient,
+    name: str,
+    content: bytes
+) -> dict:
+    """Upload a file and wait for its job - returns the finished job"""
+    response = await client.post("/fileProcessing", files = {"file": (name, content, "application/pdf")})
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+
+    while True:
+        job = (await client.get(f"/jobs/{job_id}")).json()["job"]
+        if job["status"] in ("done", "failed"):
+            return job
+        await asyncio.sleep(0.01)
+
+
+async def run_ingest(
+    client: httpx.AsyncClient,
+    sizes_kb: list,
+    files_per_size: int,
+    rng: random.Random
+) -> list:
+    results = []
+    for size_kb in sizes_kb:
+        seconds, chunks, failed, stage_timings = [], 0, 0, {}
+        for i in range(files_per_size):
+            content = make_document(rng, size_kb * 1024)
+            started = time.perf_counter()
+            job = await ingest(client, f"doc_{size_kb}kb_{i}.pdf", content)
+            elapsed = time.perf_counter() - started
+
+            if job["status"] != "done":
+                failed += 1
+                print(f"== Benchmark upload failed: {job.get('error')} ==")
+                continue
+            seconds.append(elapsed)
+            chunks += job["progress"].get("chunks_total", 0)
+            for stage, value in job["stage_timings"].items():
+                stage_timings.setdefault(stage, []).append(value)
+
+        total = sum(seconds)
+        results.append({
+            "size_kb": size_kb,
+            "files": files_per_size,
+            "failed": failed,
+            "chunks_per_file": round(chunks / len(seconds), 1) if seconds else 0,
+            "seconds_per_file": latency_summary(seconds) if seconds else None,
+            "mb_per_second": round(size_kb * len(seconds) / 1024 / total, 3) if total else 0.0,
+            "chunks_per_second": round(chunks / total, 1) if total else 0.0,
+            "stage_seconds": {stage: round(sum(values) / len(values), 3) for stage, values in stage_timings.items()},
+        })
+
+    return results
+
+
+async def chat(
+    client: httpx.AsyncClient,
+    query: str
+) -> tuple:
+    """One /chat request (NDJSON) - returns (seconds, server side ttft seconds or None, error)"""
+    started = time.perf_counter()
+    response = await client.post("/chat", json = {"query": query}, headers = {"Accept": "application/x-ndjson"})
+    elapsed = time.perf_counter() - started
+
+    ttft, error = None, None
+    if response.status_code != 200:
+        return elapsed, None, f"HTTP {response.status_code}"
+    for line in response.text.splitlines():
+        event = json.loads(line)
+        if event["type"] == "error":
+            error = event["message"]
+        elif event["type"] == "metadata" and event["ttft_ms"] is not None:
+            ttft = event["ttft_ms"] / 1000
+
+    return elapsed, ttft, error
+
+
+async def run_chat(
+    client: httpx.AsyncClient,
+    concurrency_levels: list,
+    requests: int,
+    rng: random.Random
+) -> list:
+    topics = ["exam pattern", "syllabus", "lab schedule", "grading", "assignments", "reference books"]
+    counter = 0
+
+    def next_query() -> str:
+        # unique questions - the semantic answer cache would otherwise serve the repeats
+        nonlocal counter
+        counter += 1
+        return f"What is the {rng.choice(topics)} of unit {counter} in course CS-{rng.randint(100, 999)}?"
+
+    await chat(client, next_query()) # warm up
+
+    results = []
+    for concurrency in concurrency_levels:
+        latencies, ttfts, errors = [], [], 0
+        remaining = requests
+
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                elapsed, ttft, error = await chat(client, next_query())
+                if error is not None:
+                    errors += 1
+                    continue
+                latencies.append(elapsed)
+                if ttft is not None:
+                    ttfts.append(ttft)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        wall = time.perf_counter() - started
+
+        results.append({
+            "concurrency": concurrency,
+            "requests": requests,
+            "errors": errors,
+            "requests_per_second": round(len(latencies) / wall, 2),
+            "latency_ms": latency_summary(latencies) if latencies else None,
+            "ttft_ms": latency_summary(ttfts) if ttfts else None,
+        })
+
+    return results
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    genai_client = FakeGenaiClient(
+        embed_latency = args.embed_latency_ms / 1000,
+        ttft = args.ttft_ms / 1000,
+        token_interval = args.token_interval_ms / 1000,
+        answer_tokens = args.answer_tokens
+    )
+    index = FakePineconeIndex(latency = args.index_latency_ms / 1000)
+
+    results = {
+        "benchmark": "api_load",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "fakes": {
+            "embed_latency_ms": args.embed_latency_ms,
+            "index_latency_ms": args.index_latency_ms,
+            "ttft_ms": args.ttft_ms,
+            "token_interval_ms": args.token_interval_ms,
+            "answer_tokens": args.answer_tokens,
+        },
+        "settings": {
+            key: getattr(config, key) for key in (
+                "INGESTION_WORKERS", "INGEST_EMBED_CONCURRENCY", "PROCESS_POOL_WORKERS", "CHUNKER",
+                "EMBED_MAX_IN_FLIGHT", "UPSERT_MAX_IN_FLIGHT", "RETRIEVAL_MODE", "CONTEXT_CANDIDATES"
+            )
+        },
+    }
+
+    await start_services(genai_client, index)
+    try:
+        transport = httpx.ASGITransport(app = server.app)
+        async with httpx.AsyncClient(transport = transport, base_url = "http://benchmark", timeout = None) as client:
+            if "ingest" in args.scenarios:
+                results["ingest"] = await run_ingest(client, args.sizes_kb, args.files_per_size, rng)
+            else:
+                # chat needs something to retrieve from
+                await run_ingest(client, [64], 2, rng)
+
+            if "chat" in args.scenarios:
+                results["chat"] = await run_chat(client, args.concurrency, args.requests, rng)
+
+        results["calls"] = {
+            "embed_content": genai_client.embed_calls,
+            "generate_content": genai_client.generate_calls,
+            "vector_index": index.calls,
+        }
+
+    finally:
+        await stop_services()
+
+    return results
+
+
+def print_report(results: dict):
+    if "ingest" in results:
+        print("ingest")
+        print(f"{'size KB':>8} {'files':>6} {'chunks':>7} {'p50 s':>8} {'MB/s':>8} {'chunks/s':>9}")
+        for row in results["ingest"]:
+            p50 = row["seconds_per_file"]["p50"] / 1000 if row["seconds_per_file"] else float("nan")
+            print(
+                f"{row['size_kb']:>8} {row['files']:>6} {row['chunks_per_file']:>7} {p50:>8.3f} "
+                f"{row['mb_per_second']:>8} {row['chunks_per_second']:>9}"
+            )
+
+    if "chat" in results:
+        print("chat")
+        print(f"{'conc':>5} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'ttft p50':>9} {'ttft p99':>9} {'errors':>7}")
+        for row in results["chat"]:
+            latency = row["latency_ms"] or {}
+            ttft = row["ttft_ms"] or {}
+            print(
+                f"{row['concurrency']:>5} {row['requests_per_second']:>7} {latency.get('p50', '-'):>8} "
+                f"{latency.get('p95', '-'):>8} {latency.get('p99', '-'):>8} {ttft.get('p50', '-'):>9} "
+                f"{ttft.get('p99', '-'):>9} {row['errors']:>7}"
+            )
+
+
+def int_list(value: str) -> list:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Offline /fileProcessing and /chat load benchmark")
+    parser.add_argument("--scenarios", type = lambda value: value.split(","), default = ["ingest", "chat"])
+    parser.add_argument("--sizes-kb", type = int_list, default = [16, 64, 256, 1024])
+    parser.add_argument("--files-per-size", type = int, default = 3)
+    parser.add_argument("--concurrency", type = int_list, default = [1, 8, 32])
+    parser.add_argument("--requests", type = int, default = 64, help = "chat requests per concurrency level")
+    parser.add_argument("--embed-latency-ms", type = float, default = 20)
+    parser.add_argument("--index-latency-ms", type = float, default = 15)
+    parser.add_argument("--ttft-ms", type = float, default = 250)
+    parser.add_argument("--token-interval-ms", type = float, default = 10)
+    parser.add_argument("--answer-tokens", type = int, default = 120)
+    parser.add_argument("--seed", type = int, default = 7)
+    parser.add_argument("--json", action = "store_true", help = "print the results as JSON")
+    parser.add_argument("--output", help = "also write the JSON results to this file")
+    parser.add_argument("--quiet", action = "store_true", help = "drop the service logs instead of sending them to stderr")
+    args = parser.parse_args()
+
+    if any(size > config.MAX_UPLOAD_MB * 1024 for size in args.sizes_kb):
+        parser.error(f"uploads are limited to {config.MAX_UPLOAD_MB:g} MB (MAX_UPLOAD_MB)")
+
+    try:
+        # the services log to stdout - keep it for the report
+        with open(os.devnull, "w") if args.quiet else contextlib.nullcontext(sys.stderr) as log:
+            with contextlib.redirect_stdout(log):
+                results = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors = True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
+
+    if args.json:
+        print(json.dumps(results, indent = 2))
+    else:
+        print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Neighbour merging check - consecutive chunks of a file are joined into one context block.
+
+A synthetic document is chunked by both ingestion chunkers (the content defined StableChunkStream
+and the recursive ChunkStream), then every run of consecutive chunks is passed to merge_adjacent the
+way the context assembler sees them (shuffled rank, file_reference / knowledge_base_id / chunk_index
+metadata). Reported per chunker:
+
+  merged        - runs of one owner that came back as a single block holding every chunk
+  kept apart    - runs whose middle chunk is owned by another knowledge base (a shared vector keeps
+                  the index of its owner) that were not merged across it
+  out of scope  - runs of an owner outside the knowledge bases of the query that were not merged
+
+Exits with status 1 when a run is not handled as expected.
+
+Usage (from src/backend):
+    python -m benchmarks.context_merge [--lines 300] [--run 3]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+
+# the settings object requires these - the check never calls Gemini or connects to MongoDB
+os.environ.setdefault("GEMINI_API_KEY", "unused")
+os.environ.setdefault("MONGO_URL", "mongodb://localhost")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+from benchmarks.synthetic import make_words
+from services.content_processing import ChunkStream, StableChunkStream
+from services.context_assembly import merge_adjacent
+
+OWNER = "kb-notes"
+OTHER_OWNER = "kb-other"
+
+
+def make_document(lines: int, seed: int = 7) -> str:
+    rng = random.Random(seed)
+    words = make_words(rng, 400)
+    return "\n".join(
+        f"Unit {line // 10 + 1}, note {line}: " + " ".join(rng.sample(words, rng.randint(6, 14))) + "."
+        for line in range(lines)
+    )
+
+
+async def chunk(stream, text: str) -> list:
+    chunks = []
+    for i in range(0, len(text), 4096):
+        chunks += await stream.feed(text[i:i + 4096])
+    return chunks + await stream.flush()
+
+
+def as_chunks(texts: list, first_index: int, owners: list) -> list:
+    ranks = list(range(len(texts)))
+    random.Random(first_index).shuffle(ranks)
+    return [
+        {
+            "content": text,
+            "source": "notes.pdf",
+            "owner": owner,
+            "chunk_index": first_index + offset,
+            "pages": None,
+            "rank": rank
+        }
+        for offset, (text, owner, rank) in enumerate(zip(texts, owners, ranks))
+    ]
+
+
+def check(texts: list, run: int) -> dict:
+    report = {"chunks": len(texts), "runs": 0, "merged": 0, "kept apart": 0, "out of scope": 0}
+    for start in range(0, len(texts) - run + 1):
+        window = texts[start:start + run]
+        report["runs"] += 1
+
+        blocks = merge_adjacent(as_chunks(window, start, [OWNER] * run), [OWNER])
+        if len(blocks) == 1 and all(text in blocks[0]["content"] for text in window):
+            report["merged"] += 1
+
+        owners = [OWNER] * run
+        owners[run // 2] = OTHER_OWNER
+        blocks = merge_adjacent(as_chunks(window, start, owners))
+        if not any(block["chunks"] > 1 and block["first_index"] <= start + run // 2 <= block["last_index"] for block in blocks):
+            report["kept apart"] += 1
+
+        blocks = merge_adjacent(as_chunks(window, start, [OWNER] * run), [OTHER_OWNER])
+        if len(blocks) == run:
+            report["out of scope"] += 1
+
+    return report
+
+
+async def run(lines: int, run_length: int) -> dict:
+    text = make_document(lines)
+    return {
+        "stable": check(await chunk(StableChunkStream(), text), run_length),
+        "recursive": check(await chunk(ChunkStream(), text), run_length)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Check that consecutive chunks of a file merge into one context block")
+    parser.add_argument("--lines", type = int, default = 300)
+    parser.add_argument("--run", type = int, default = 3, help = "consecutive chunks per merge")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args.lines, max(2, args.run)))
+
+    print(f"{'chunker':<10} {'chunks':>7} {'runs':>6} {'merged':>7} {'kept apart':>11} {'out of scope':>13}")
+    failed = False
+    for chunker, report in results.items():
+        print(
+            f"{chunker:<10} {report['chunks']:>7} {report['runs']:>6} {report['merged']:>7} "
+            f"{report['kept apart']:>11} {report['out of scope']:>13}"
+        )
+        failed = failed or any(report[key] != report["runs"] for key in ("merged", "kept apart", "out of scope"))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
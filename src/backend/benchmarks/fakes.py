@@ -0,0 +1,362 @@
+"""
+Deterministic offline stand-ins for the external services, with configurable latency:
+
+  FakeGenaiClient    - google-genai Client: embed_content, generate_content, generate_content_stream
+                       and files.upload (an uploaded file is "extracted" back as its own text,
+                       a PDF as its PyPDF2 text)
+  FakePineconeIndex  - the Pinecone async index (in-memory, brute force cosine)
+  fake_mongodb       - a MongoDB database on mongomock-motor (pip install mongomock-motor)
+
+install_fakes puts them where the get_* dependency functions (get_genai_client, get_pinecone,
+get_mongodb) read them from, so the API and the services run unchanged.
+"""
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+import asyncio
+import hashlib
+import io
+import itertools
+import random
+
+import numpy as np
+import PyPDF2
+
+import services.ai_init as ai_service
+import services.mongodb as mongodb_service
+import services.pinecone as pinecone_service
+from services.context_assembly import CHARS_PER_TOKEN
+from services.vector_index import VectorIndex, matches_filter
+
+ANSWER_WORDS = ("the", "course", "covers", "unit", "exam", "marks", "students", "topic", "lab", "notes")
+
+
+def fake_embedding(text: str, dimension: int) -> List[float]:
+    """Deterministic unit vector seeded by the text - unrelated texts are close to orthogonal"""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def _chunk(text: str, usage = None) -> SimpleNamespace:
+    """A streamed GenerateContentResponse - the usage metadata comes with the last chunk, like Gemini"""
+    return SimpleNamespace(
+        text = text,
+        candidates = [SimpleNamespace(content = SimpleNamespace(parts = [SimpleNamespace(text = text)]))],
+        usage_metadata = usage
+    )
+
+
+def _usage(prompt: str, output_tokens: int) -> SimpleNamespace:
+    return SimpleNamespace(
+        prompt_token_count = max(1, len(prompt) // CHARS_PER_TOKEN),
+        candidates_token_count = output_tokens
+    )
+
+
+class FakeModels:
+    def __init__(self, client: "FakeGenaiClient"):
+        self.client = client
+
+    async def embed_content(
+        self,
+        model: str,
+        contents: List[str],
+        config = None
+    ):
+        client = self.client
+        client.embed_calls += 1
+        await asyncio.sleep(client.embed_latency + client.embed_latency_per_text * len(contents))
+        return SimpleNamespace(embeddings = [
+            SimpleNamespace(values = fake_embedding(text, client.dimension)) for text in contents
+        ])
+
+    async def generate_content(
+        self,
+        model: str,
+        contents,
+        config = None
+    ):
+        """Non-streamed generation - file extraction returns the file text, anything else a short answer"""
+        client = self.client
+        client.generate_calls += 1
+        text = client.uploaded_text(contents)
+        if text is None:
+            text = client.answer(str(contents))
+            await asyncio.sleep(client.ttft + client.token_interval * client.answer_tokens)
+        else:
+            await asyncio.sleep(client.ttft + len(text) / client.extraction_chars_per_second)
+            if client.rng.random() < client.extraction_failure_rate:
+                client.extraction_failures += 1
+                raise RuntimeError("503 UNAVAILABLE (injected extraction failure)")
+
+        return SimpleNamespace(text = text, usage_metadata = _usage(str(contents), len(text) // CHARS_PER_TOKEN))
+
+    async def generate_content_stream(
+        self,
+        model: str,
+        contents,
+        config = None
+    ):
+        client = self.client
+        client.generate_calls += 1
+        text = client.uploaded_text(contents)
+        prompt = str(contents) + str((config or {}).get("system_instruction", ""))
+
+        async def extraction():
+            await asyncio.sleep(client.ttft)
+            piece_size = client.extraction_piece_chars
+            pieces = [text[i:i + piece_size] for i in range(0, len(text), piece_size)]
+            for i, piece in enumerate(pieces):
+                await asyncio.sleep(len(piece) / client.extraction_chars_per_second)
+                last = i == len(pieces) - 1
+                yield _chunk(piece, _usage(prompt, len(text) // CHARS_PER_TOKEN) if last else None)
+
+        async def answer():
+            await asyncio.sleep(client.ttft)
+            words = client.answer(str(contents)).split(" ")
+            for i, word in enumerate(words):
+                if i:
+                    await asyncio.sleep(client.token_interval)
+                last = i == len(words) - 1
+                yield _chunk(word + ("" if last else " "), _usage(prompt, len(words)) if last else None)
+
+        return extraction() if text is not None else answer()
+
+
+class FakeFiles:
+    def __init__(self, client: "FakeGenaiClient"):
+        self.client = client
+
+    async def upload(self, file, config = None):
+        client = self.client
+        name = f"files/{next(client.file_ids)}"
+        if isinstance(file, str):
+            with open(file, "rb") as f:
+                client.files[name] = f.read()
+        else:
+            client.files[name] = file.read()
+        await asyncio.sleep(client.upload_latency)
+        return SimpleNamespace(name = name, uri = name, mime_type = (config or {}).get("mime_type"))
+
+
+class FakeGenaiClient:
+    """
+    google-genai Client stand-in (only the async `aio` surface the app uses). Latencies are in seconds;
+    answers are `answer_tokens` words streamed `token_interval` apart after `ttft`.
+    """
+
+    def __init__(
+        self,
+        dimension: int = 768,
+        embed_latency: float = 0.02,
+        embed_latency_per_text: float = 0.0002,
+        upload_latency: float = 0.05,
+        ttft: float = 0.25,
+        token_interval: float = 0.01,
+        answer_tokens: int = 120,
+        extraction_chars_per_second: float = 2_000_000,
+        extraction_piece_chars: int = 4096,
+        extraction_failure_rate: float = 0.0,
+        seed: int = 0
+    ):
+        self.dimension = dimension
+        self.embed_latency = embed_latency
+        self.embed_latency_per_text = embed_latency_per_text
+        self.upload_latency = upload_latency
+        self.ttft = ttft
+        self.token_interval = token_interval
+        self.answer_tokens = answer_tokens
+        self.extraction_chars_per_second = extraction_chars_per_second
+        self.extraction_piece_chars = extraction_piece_chars
+        self.extraction_failure_rate = extraction_failure_rate
+        self.rng = random.Random(seed)
+
+        self.files: Dict[str, bytes] = {}
+        self.file_ids = itertools.count()
+        self.embed_calls = 0
+        self.generate_calls = 0
+        self.extraction_failures = 0
+        self.aio = SimpleNamespace(models = FakeModels(self), files = FakeFiles(self))
+
+    def uploaded_text(self, contents) -> Optional[str]:
+        """The text of the uploaded file in `contents`, if any"""
+        if not isinstance(contents, list):
+            return None
+        for item in contents:
+            data = self.files.get(getattr(item, "name", None))
+            if data is not None and data.startswith(b"%PDF"):
+                return "\n".join(page.extract_text() for page in PyPDF2.PdfReader(io.BytesIO(data)).pages)
+            if data is not None:
+                return data.decode("utf-8", errors = "ignore")
+        return None
+
+    def answer(self, prompt: str) -> str:
+        seed = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:4], "little")
+        return " ".join(ANSWER_WORDS[(seed + i * 7) % len(ANSWER_WORDS)] for i in range(self.answer_tokens))
+
+
+class FakePineconeIndex(VectorIndex):
+    """
+    Pinecone async index stand-in - vectors are kept in memory and scored off the event loop
+    (the real index does that work remotely), every call waits `latency` seconds first.
+    """
+
+    def __init__(self, latency: float = 0.015):
+        self.latency = latency
+        self.namespaces: Dict[str, Dict[str, dict]] = {}
+        self.matrices: Dict[str, tuple] = {} # namespace -> (ids, normalised matrix), rebuilt after writes
+        self.calls = 0
+
+    def _matrix(self, namespace: str) -> tuple:
+        if namespace not in self.matrices:
+            records = self.namespaces.get(namespace, {})
+            ids = list(records)
+            matrix = np.asarray([records[vector_id]["values"] for vector_id in ids], dtype = np.float32)
+            if len(ids):
+                norms = np.linalg.norm(matrix, axis = 1, keepdims = True)
+                matrix = np.divide(matrix, norms, out = np.zeros_like(matrix), where = norms > 0)
+            self.matrices[namespace] = (ids, matrix)
+        return self.matrices[namespace]
+
+    def _query(
+        self,
+        vector: list,
+        top_k: int,
+        namespace: str,
+        filter: Optional[dict],
+        include_metadata: bool,
+        include_values: bool
+    ) -> List[dict]:
+        ids, matrix = self._matrix(namespace)
+        if not ids:
+            return []
+
+        records = self.namespaces[namespace]
+        scores = matrix @ np.asarray(vector, dtype = np.float32)
+        matches = []
+        for row in np.argsort(-scores):
+            record = records[ids[row]]
+            if not matches_filter(record["metadata"], filter):
+                continue
+            match = {"id": ids[row], "score": float(scores[row])}
+            if include_metadata:
+                match["metadata"] = record["metadata"]
+            if include_values:
+                match["values"] = record["values"]
+            matches.append(match)
+            if len(matches) == top_k:
+                break
+        return matches
+
+    async def query(
+        self,
+        vector: list,
+        top_k: int,
+        namespace: str = "",
+        filter: Optional[dict] = None,
+        include_metadata: bool = False,
+        include_values: bool = False
+    ) -> dict:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        matches = await asyncio.to_thread(
+            self._query, vector, top_k, namespace, filter, include_metadata, include_values
+        )
+        return {"matches": matches, "namespace": namespace}
+
+    async def upsert(
+        self,
+        vectors: list,
+        namespace: str = ""
+    ) -> dict:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        records = self.namespaces.setdefault(namespace, {})
+        for vector in vectors:
+            records[vector["id"]] = {"values": list(vector["values"]), "metadata": vector.get("metadata") or {}}
+        self.matrices.pop(namespace, None)
+        return {"upserted_count": len(vectors)}
+
+    async def delete(
+        self,
+        ids: Optional[list] = None,
+        delete_all: bool = False,
+        namespace: str = "",
+        filter: Optional[dict] = None
+    ) -> dict:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        records = self.namespaces.get(namespace, {})
+        if delete_all:
+            records.clear()
+        for vector_id in ids or []:
+            records.pop(vector_id, None)
+        if filter:
+            for vector_id in [vector_id for vector_id, record in records.items() if matches_filter(record["metadata"], filter)]:
+                del records[vector_id]
+        self.matrices.pop(namespace, None)
+        return {}
+
+    async def fetch(
+        self,
+        ids: list,
+        namespace: str = ""
+    ) -> dict:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        records = self.namespaces.get(namespace, {})
+        return {
+            "vectors": {
+                vector_id: {"id": vector_id, **records[vector_id]}
+                for vector_id in ids if vector_id in records
+            },
+            "namespace": namespace
+        }
+
+    async def list(
+        self,
+        prefix: Optional[str] = None,
+        limit: int = 100,
+        namespace: str = ""
+    ):
+        ids = sorted(vector_id for vector_id in self.namespaces.get(namespace, {}) if not prefix or vector_id.startswith(prefix))
+        for i in range(0, len(ids), limit):
+            self.calls += 1
+            await asyncio.sleep(self.latency)
+            yield ids[i:i + limit]
+
+    async def describe_index_stats(self) -> dict:
+        return {
+            "namespaces": {name: {"vector_count": len(records)} for name, records in self.namespaces.items()},
+            "total_vector_count": sum(len(records) for records in self.namespaces.values())
+        }
+
+
+def fake_mongodb(db_name: str = "benchmark"):
+    """In-memory MongoDB database (mongomock-motor)"""
+    try:
+        import mongomock.collection
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError as e:
+        raise RuntimeError("The offline benchmarks need mongomock-motor: pip install mongomock-motor") from e
+
+    # recent pymongo passes `sort` to bulk update operations, which mongomock does not know yet
+    add_update = mongomock.collection.BulkOperationBuilder.add_update
+    if not getattr(add_update, "accepts_sort", False):
+        def add_update_without_sort(self, *args, sort = None, **kwargs):
+            return add_update(self, *args, **kwargs)
+        add_update_without_sort.accepts_sort = True
+        mongomock.collection.BulkOperationBuilder.add_update = add_update_without_sort
+
+    return AsyncMongoMockClient()[db_name]
+
+
+def install_fakes(
+    genai_client: FakeGenaiClient,
+    index: VectorIndex,
+    db
+):
+    """Serve the fakes from get_genai_client / get_pinecone / get_mongodb (instead of connect_* at startup)"""
+    ai_service.genai_client = genai_client
+    pinecone_service.pinecone_index = index
+    mongodb_service.mongodb_instance = db
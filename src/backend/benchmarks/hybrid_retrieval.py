@@ -0,0 +1,184 @@
+"""
+Dense-only vs hybrid (dense + BM25, RRF) retrieval - recall@k, MRR and latency.
+
+Runs offline: a synthetic course-notes corpus is indexed into the local vector index and the lexical
+index, and embedded with a stand-in embedding (hashed bag of concepts) instead of Gemini. Like a real
+embedding model, the stand-in maps synonyms close together but blurs identifiers - digits are
+collapsed, so "EE-3107" and "EE-3114" embed alike. Two query sets are measured:
+
+  code    - "exam pattern for EE-3107 unit 4" (the relevant chunk is the one with that code and unit)
+  concept - paraphrases of a chunk using synonyms only (no exact token overlap with the chunk)
+
+Usage (from src/backend):
+    python -m benchmarks.hybrid_retrieval [--courses 40] [--units 8] [--top-k 5] [--json]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# the settings object requires these - the benchmark never calls Gemini or connects to MongoDB
+os.environ.setdefault("GEMINI_API_KEY", "unused")
+os.environ.setdefault("MONGO_URL", "mongodb://localhost")
+os.environ.setdefault("DB_NAME", "benchmark")
+WORK_DIR = tempfile.mkdtemp(prefix = "hybrid_retrieval_")
+os.environ["LEXICAL_INDEX_PATH"] = os.path.join(WORK_DIR, "lexical_index.sqlite3")
+
+from benchmarks.synthetic import DEPARTMENTS, make_words, percentile, standin_embedding
+from config import config
+import services.pinecone as pinecone_service
+from services.lexical_index import lexical_index
+from services.retrieval import lexical_search, reciprocal_rank_fusion
+from services.vector_index import LocalVectorIndex
+
+DIMENSION = 256
+NAMESPACE = "benchmark"
+
+
+def build_corpus(courses: int, units: int, seed: int = 7):
+    """Chunks of course notes, and the two query sets with their relevant chunk id"""
+    rng = random.Random(seed)
+
+    # every concept has a term used in the notes and a synonym used in the paraphrased questions
+    words = make_words(rng, courses * 80)
+    concepts = list(zip(words[0::2], words[1::2]))
+    synonyms = {}
+    for index, (term, synonym) in enumerate(concepts):
+        synonyms[term] = synonyms[synonym] = f"c{index}"
+
+    chunks, code_queries, concept_queries = [], [], []
+    for course in range(courses):
+        code = f"{DEPARTMENTS[course % len(DEPARTMENTS)]}-{3100 + course * 7}"
+        course_concepts = concepts[course * 40:(course + 1) * 40]
+        for unit in range(1, units + 1):
+            picked = rng.sample(course_concepts, 12)
+            chunk_id = f"{code}:{unit}"
+            text = f"{code} unit {unit} notes. " + " ".join(term for term, _ in picked) + "."
+            chunks.append((chunk_id, text))
+            code_queries.append((f"exam pattern for {code} unit {unit}", chunk_id))
+            concept_queries.append(("explain " + " ".join(synonym for _, synonym in picked[:4]), chunk_id))
+
+    return chunks, {"code": code_queries, "concept": concept_queries}, synonyms
+
+
+async def run(courses: int, units: int, top_k: int) -> dict:
+    chunks, query_sets, synonyms = build_corpus(courses, units)
+
+    index = LocalVectorIndex(path = os.path.join(WORK_DIR, "vectors"), dimension = DIMENSION)
+    pinecone_service.pinecone_index = index
+    lexical_index.load()
+
+    for i in range(0, len(chunks), 500):
+        batch = chunks[i:i + 500]
+        await index.upsert(
+            vectors = [
+                {"id": chunk_id, "values": standin_embedding(text, synonyms, DIMENSION), "metadata": {"content": text}}
+                for chunk_id, text in batch
+            ],
+            namespace = NAMESPACE
+        )
+        lexical_index.add(batch)
+
+    candidates = max(top_k, config.RETRIEVAL_CANDIDATES)
+
+    async def dense(query: str, depth: int) -> list:
+        return await pinecone_service.query_matches(
+            vector = standin_embedding(query, synonyms, DIMENSION),
+            top_k = depth,
+            namespace = NAMESPACE
+        )
+
+    async def hybrid(query: str) -> list:
+        # same shape as services.retrieval.retrieve - both retrievers concurrently, then RRF
+        dense_matches, lexical_matches = await asyncio.gather(
+            dense(query, candidates),
+            lexical_search(query, candidates)
+        )
+        return reciprocal_rank_fusion([dense_matches, lexical_matches], top_k, k = config.RRF_K)
+
+    modes = {
+        "dense": lambda query: dense(query, top_k),
+        "hybrid": hybrid
+    }
+
+    results = {
+        "chunks": len(chunks),
+        "top_k": top_k,
+        "candidates_per_retriever": candidates,
+        "modes": {}
+    }
+    for mode, search in modes.items():
+        report = {}
+        latencies_all = []
+        for query_set, queries in query_sets.items():
+            hits, reciprocal_ranks, latencies = 0, 0.0, []
+            for query, relevant in queries:
+                started = time.perf_counter()
+                matches = await search(query)
+                latencies.append((time.perf_counter() - started) * 1000)
+
+                ids = [match["id"] for match in matches[:top_k]]
+                if relevant in ids:
+                    hits += 1
+                    reciprocal_ranks += 1 / (ids.index(relevant) + 1)
+
+            latencies_all.extend(latencies)
+            report[query_set] = {
+                "queries": len(queries),
+                f"recall@{top_k}": round(hits / len(queries), 3),
+                "mrr": round(reciprocal_ranks / len(queries), 3),
+            }
+
+        report["latency_ms"] = {
+            "p50": round(percentile(latencies_all, 0.50), 2),
+            "p95": round(percentile(latencies_all, 0.95), 2),
+            "mean": round(sum(latencies_all) / len(latencies_all), 2),
+        }
+        results["modes"][mode] = report
+
+    await index.close()
+    lexical_index.close()
+    return results
+
+
+def print_report(results: dict):
+    top_k = results["top_k"]
+    print(f"{results['chunks']} chunks, top_k={top_k}, {results['candidates_per_retriever']} candidates per retriever")
+    print(f"{'mode':<8} {'code R@k':>9} {'code MRR':>9} {'concept R@k':>12} {'concept MRR':>12} {'p50 ms':>8} {'p95 ms':>8}")
+    for mode, report in results["modes"].items():
+        print(
+            f"{mode:<8} {report['code'][f'recall@{top_k}']:>9} {report['code']['mrr']:>9} "
+            f"{report['concept'][f'recall@{top_k}']:>12} {report['concept']['mrr']:>12} "
+            f"{report['latency_ms']['p50']:>8} {report['latency_ms']['p95']:>8}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Dense-only vs hybrid retrieval benchmark")
+    parser.add_argument("--courses", type = int, default = 40)
+    parser.add_argument("--units", type = int, default = 8)
+    parser.add_argument("--top-k", type = int, default = 5)
+    parser.add_argument("--json", action = "store_true", help = "print the results as JSON")
+    args = parser.parse_args()
+
+    try:
+        # the services log to stdout - keep it for the report
+        with contextlib.redirect_stdout(sys.stderr):
+            results = asyncio.run(run(args.courses, args.units, args.top_k))
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors = True)
+
+    if args.json:
+        print(json.dumps(results, indent = 2))
+    else:
+        print_report(results)
+
+
+if __name__ == "__main__":
+    main()
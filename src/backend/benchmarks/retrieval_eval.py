@@ -0,0 +1,333 @@
+"""
+Retrieval quality vs cost sweep - chunk size, chunk overlap, top_k and retrieval mode.
+
+For every chunking configuration the corpus is chunked (getChunks - the recursive 800 / 80 splitter -
+or the content defined stableChunks used by ingestion), embedded and indexed into a fresh local vector
+index and lexical index, then every labelled query is run through services.retrieval for each mode
+and top_k. Reported per configuration:
+
+  recall@k       - share of the relevant passages contained, whole, in one of the top k chunks
+  mrr            - 1 / rank of the first chunk containing a relevant passage (0 when not in the top k)
+  prompt_tokens  - estimated tokens of the top k chunks, what they would add to the prompt
+  latency        - retrieval time per query (the query embedding is computed beforehand)
+
+The labelled corpus is generated (course notes with one fact per unit, asked about by course code
+and by a synonym paraphrase) or loaded from JSON:
+
+  {"documents": [{"id": "...", "text": "..."}],
+   "queries": [{"query": "...", "set": "code", "passages": ["relevant passage text", ...]}],
+   "synonyms": {"word": "concept"}}   (optional, only used by the stand-in embedding)
+
+Embeddings are the stand-in (hashed bag of concepts, see benchmarks/synthetic.py) by default, so a sweep
+is offline and repeatable; --embeddings gemini uses the real model through the embedding cache
+(EMBEDDING_CACHE_PATH), so only texts never seen before cost an API call.
+
+Usage (from src/backend):
+    python -m benchmarks.retrieval_eval [--chunk-sizes 200,400,800,1200] [--overlaps 0,80,160]
+                                        [--top-k 3,5,10] [--modes dense,lexical,hybrid] [--json]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# the settings object requires these - the stand-in embeddings never call Gemini or connect to MongoDB
+os.environ.setdefault("GEMINI_API_KEY", "unused")
+os.environ.setdefault("MONGO_URL", "mongodb://localhost")
+os.environ.setdefault("DB_NAME", "benchmark")
+WORK_DIR = tempfile.mkdtemp(prefix = "retrieval_eval_")
+os.environ["LEXICAL_INDEX_PATH"] = os.path.join(WORK_DIR, "lexical_index.sqlite3")
+
+from benchmarks.synthetic import DEPARTMENTS, make_words, percentile, standin_embedding
+from config import config
+import services.pinecone as pinecone_service
+import services.retrieval as retrieval_service
+from services.content_processing import getChunks, stableChunks
+from services.context_assembly import estimate_tokens
+from services.lexical_index import LexicalIndex
+from services.vector_index import LocalVectorIndex
+
+STANDIN_DIMENSION = 256
+NAMESPACE = "diploma_studies_project" # the namespace services.retrieval queries
+INDEX_BATCH_SIZE = 500
+
+
+def generate_corpus(courses: int, units: int, seed: int = 7) -> dict:
+    """
+    One document per course, a section per unit: filler sentences around a fact sentence, which is
+    the relevant passage of a "code" query (by course code and unit) and of a "concept" query
+    (the fact paraphrased with synonyms only)
+    """
+    rng = random.Random(seed)
+    words = make_words(rng, courses * 160)
+    concepts = list(zip(words[0:courses * 80:2], words[1:courses * 80:2]))
+    filler = words[courses * 80:]
+    synonyms = {}
+    for index, (term, synonym) in enumerate(concepts):
+        synonyms[term] = synonyms[synonym] = f"c{index}"
+
+    documents, queries = [], []
+    for course in range(courses):
+        code = f"{DEPARTMENTS[course % len(DEPARTMENTS)]}-{3100 + course * 7}"
+        course_concepts = concepts[course * 40:(course + 1) * 40]
+        sections = []
+        for unit in range(1, units + 1):
+            picked = rng.sample(course_concepts, 5)
+            fact = (
+                f"The {picked[0][0]} {picked[1][0]} {picked[2][0]} of {code} unit {unit} "
+                f"is assessed through {picked[3][0]} {picked[4][0]}."
+            )
+            sentences = [
+                " ".join(rng.choice(filler) for _ in range(rng.randint(10, 16))).capitalize() + "."
+                for _ in range(rng.randint(5, 9))
+            ]
+            sentences.insert(rng.randint(0, len(sentences)), fact)
+            sections.append(f"{code} unit {unit} notes. " + " ".join(sentences))
+
+            queries.append({"query": f"How is {code} unit {unit} assessed?", "set": "code", "passages": [fact]})
+            queries.append({
+                "query": f"How is the {picked[0][1]} {picked[1][1]} {picked[2][1]} assessed?",
+                "set": "concept",
+                "passages": [fact]
+            })
+
+        documents.append({"id": code, "text": "\n".join(sections)})
+
+    return {"documents": documents, "queries": queries, "synonyms": synonyms}
+
+
+def normalise(text: str) -> str:
+    return " ".join(text.split())
+
+
+def chunk_configurations(chunkers: list, sizes: list, overlaps: list) -> list:
+    configurations = []
+    if "recursive" in chunkers:
+        configurations += [
+            {"chunker": "recursive", "chunk_size": size, "overlap": overlap}
+            for size in sizes for overlap in overlaps if overlap < size
+        ]
+    if "stable" in chunkers:
+        # content defined chunks have no overlap, the size is the maximum (minimum a third of it, as in ingestion)
+        configurations += [{"chunker": "stable", "chunk_size": size, "overlap": 0} for size in sizes]
+    return configurations
+
+
+def chunk_document(text: str, configuration: dict) -> list:
+    if configuration["chunker"] == "recursive":
+        return getChunks(text, configuration["chunk_size"], configuration["overlap"])
+
+    chunks, _ = stableChunks(text, configuration["chunk_size"] // 3, configuration["chunk_size"], 4, True)
+    return chunks
+
+
+async def embed(texts: list, embeddings: str, synonyms: dict) -> list:
+    if embeddings == "gemini":
+        from services.content_processing import generateEmbeddings
+        return await generateEmbeddings(texts)
+
+    return [standin_embedding(text, synonyms, STANDIN_DIMENSION) for text in texts]
+
+
+async def search(
+    mode: str,
+    query: str,
+    vector: list,
+    top_k: int
+) -> list:
+    if mode == "lexical":
+        return await retrieval_service.lexical_search(query, top_k)
+    return await retrieval_service.retrieve(query = query, top_k = top_k, mode = mode, vector = vector)
+
+
+async def evaluate_configuration(
+    corpus: dict,
+    configuration: dict,
+    query_vectors: list,
+    modes: list,
+    top_ks: list,
+    embeddings: str,
+    number: int
+) -> list:
+    chunks = []
+    for document in corpus["documents"]:
+        for position, chunk in enumerate(chunk_document(document["text"], configuration)):
+            chunks.append((f"{document['id']}:{position}", chunk, position))
+    normalised = {chunk_id: normalise(chunk) for chunk_id, chunk, _ in chunks}
+
+    # a fresh vector index and lexical index per configuration, served to services.retrieval
+    vectors = await embed([chunk for _, chunk, _ in chunks], embeddings, corpus.get("synonyms", {}))
+    index = LocalVectorIndex(path = os.path.join(WORK_DIR, f"vectors_{number}"), dimension = len(vectors[0]))
+    lexical = LexicalIndex(db_path = os.path.join(WORK_DIR, f"lexical_{number}.sqlite3"))
+    lexical.load()
+    pinecone_service.pinecone_index = index
+    retrieval_service.lexical_index = lexical
+
+    for i in range(0, len(chunks), INDEX_BATCH_SIZE):
+        batch = chunks[i:i + INDEX_BATCH_SIZE]
+        await index.upsert(
+            vectors = [
+                {"id": chunk_id, "values": vector, "metadata": {"content": chunk, "chunk_index": position}}
+                for (chunk_id, chunk, position), vector in zip(batch, vectors[i:i + INDEX_BATCH_SIZE])
+            ],
+            namespace = NAMESPACE
+        )
+        lexical.add([(chunk_id, chunk) for chunk_id, chunk, _ in batch])
+
+    query_sets = sorted({query.get("set", "all") for query in corpus["queries"]})
+    rows = []
+    for mode in modes:
+        for top_k in top_ks:
+            per_set = {name: {"queries": 0, "recall": 0.0, "mrr": 0.0} for name in query_sets}
+            latencies, prompt_tokens = [], []
+            for query, vector in zip(corpus["queries"], query_vectors):
+                started = time.perf_counter()
+                matches = (await search(mode, query["query"], vector, top_k))[:top_k]
+                latencies.append(time.perf_counter() - started)
+
+                passages = [normalise(passage) for passage in query["passages"]]
+                found = set()
+                first_rank = None
+                for rank, match in enumerate(matches, start = 1):
+                    contained = {i for i, passage in enumerate(passages) if passage in normalised[match["id"]]}
+                    if contained and first_rank is None:
+                        first_rank = rank
+                    found |= contained
+
+                stats = per_set[query.get("set", "all")]
+                stats["queries"] += 1
+                stats["recall"] += len(found) / len(passages)
+                stats["mrr"] += 1 / first_rank if first_rank else 0.0
+                prompt_tokens.append(sum(estimate_tokens(normalised[match["id"]]) for match in matches))
+
+            total = len(corpus["queries"])
+            rows.append({
+                **configuration,
+                "chunks": len(chunks),
+                "mode": mode,
+                "top_k": top_k,
+                "recall": round(sum(stats["recall"] for stats in per_set.values()) / total, 3),
+                "mrr": round(sum(stats["mrr"] for stats in per_set.values()) / total, 3),
+                "sets": {
+                    name: {
+                        "queries": stats["queries"],
+                        "recall": round(stats["recall"] / stats["queries"], 3),
+                        "mrr": round(stats["mrr"] / stats["queries"], 3),
+                    }
+                    for name, stats in per_set.items()
+                },
+                "prompt_tokens": round(sum(prompt_tokens) / total, 1),
+                "latency_ms": {
+                    "p50": round(percentile(latencies, 0.50) * 1000, 2),
+                    "p95": round(percentile(latencies, 0.95) * 1000, 2),
+                },
+            })
+
+    await index.close()
+    lexical.close()
+    return rows
+
+
+async def run(args) -> dict:
+    if args.corpus:
+        with open(args.corpus) as f:
+            corpus = json.load(f)
+    else:
+        corpus = generate_corpus(args.courses, args.units, args.seed)
+    if args.save_corpus:
+        with open(args.save_corpus, "w") as f:
+            json.dump(corpus, f, indent = 2)
+
+    if args.embeddings == "gemini":
+        from services.ai_init import init_genai
+        await init_genai()
+
+    query_vectors = await embed([query["query"] for query in corpus["queries"]], args.embeddings, corpus.get("synonyms", {}))
+
+    results = {
+        "benchmark": "retrieval_eval",
+        "embeddings": args.embeddings,
+        "documents": len(corpus["documents"]),
+        "queries": len(corpus["queries"]),
+        "candidates_per_retriever": config.RETRIEVAL_CANDIDATES,
+        "rrf_k": config.RRF_K,
+        "configurations": []
+    }
+    configurations = chunk_configurations(args.chunkers, args.chunk_sizes, args.overlaps)
+    for number, configuration in enumerate(configurations):
+        print(f"== Evaluating {configuration} ==")
+        results["configurations"] += await evaluate_configuration(
+            corpus, configuration, query_vectors, args.modes, args.top_k, args.embeddings, number
+        )
+
+    return results
+
+
+def print_report(results: dict):
+    rows = results["configurations"]
+    sets = sorted({name for row in rows for name in row["sets"]})
+    print(f"{results['documents']} documents, {results['queries']} queries, {results['embeddings']} embeddings")
+    print(
+        f"{'chunker':<10} {'size':>5} {'overlap':>7} {'chunks':>6} {'mode':<8} {'k':>3} {'recall':>7} {'mrr':>6} "
+        + "".join(f"{name + ' R':>11}" for name in sets)
+        + f" {'tokens':>7} {'p50 ms':>7} {'p95 ms':>7}"
+    )
+    for row in rows:
+        print(
+            f"{row['chunker']:<10} {row['chunk_size']:>5} {row['overlap']:>7} {row['chunks']:>6} {row['mode']:<8} "
+            f"{row['top_k']:>3} {row['recall']:>7} {row['mrr']:>6} "
+            + "".join(f"{row['sets'][name]['recall']:>11}" for name in sets)
+            + f" {row['prompt_tokens']:>7} {row['latency_ms']['p50']:>7} {row['latency_ms']['p95']:>7}"
+        )
+
+
+def int_list(value: str) -> list:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def str_list(value: str) -> list:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Retrieval quality vs cost sweep over chunking, top_k and mode")
+    parser.add_argument("--corpus", help = "labelled corpus JSON (generated when omitted)")
+    parser.add_argument("--save-corpus", help = "write the corpus used to this file")
+    parser.add_argument("--courses", type = int, default = 20)
+    parser.add_argument("--units", type = int, default = 6)
+    parser.add_argument("--seed", type = int, default = 7)
+    parser.add_argument("--chunkers", type = str_list, default = ["recursive", "stable"])
+    parser.add_argument("--chunk-sizes", type = int_list, default = [200, 400, 800, 1200])
+    parser.add_argument("--overlaps", type = int_list, default = [0, 80, 160])
+    parser.add_argument("--top-k", type = int_list, default = [3, 5, 10])
+    parser.add_argument("--modes", type = str_list, default = ["dense", "lexical", "hybrid"])
+    parser.add_argument("--embeddings", choices = ["standin", "gemini"], default = "standin")
+    parser.add_argument("--json", action = "store_true", help = "print the results as JSON")
+    parser.add_argument("--output", help = "also write the JSON results to this file")
+    args = parser.parse_args()
+
+    try:
+        # the services log to stdout - keep it for the report
+        with contextlib.redirect_stdout(sys.stderr):
+            results = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(WORK_DIR, ignore_errors = True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
+
+    if args.json:
+        print(json.dumps(results, indent = 2))
+    else:
+        print_report(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Helpers shared by the offline benchmarks - made-up vocabulary, the stand-in embedding and percentiles"""
+import hashlib
+import random
+import re
+
+import numpy as np
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "xe", "zu", "pra", "dho", "gri", "ste"]
+DEPARTMENTS = ["CS", "EE", "ME", "CE", "IT"]
+
+
+def make_words(rng: random.Random, count: int) -> list:
+    """Distinct made-up words - the notes should not share vocabulary by accident"""
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(3, 5))))
+
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+
+def standin_embedding(text: str, synonyms: dict, dimension: int) -> list:
+    """
+    Hashed bag of concepts instead of Gemini - like a real embedding model it maps synonyms close
+    together (they share a feature) but blurs identifiers (digits are collapsed, so "EE-3107" and
+    "EE-3114" embed alike)
+    """
+    vector = np.zeros(dimension, dtype = np.float32)
+    for token in re.findall(r"\w+", text.lower()):
+        feature = synonyms.get(token, re.sub(r"\d", "#", token))
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size = 8).digest()
+        vector[int.from_bytes(digest[:4], "little") % dimension] += 1.0 if digest[4] & 1 else -1.0
+
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+def percentile(samples: list, p: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(p * len(samples)))]
@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings
 
@@ -7,10 +8,67 @@ load_dotenv()
 class settings(BaseSettings):
     GEMINI_API_KEY: str = os.environ.get("GEMINI_API_KEY")
 
-    PINECONE_API_KEY: str = os.environ.get("PINECONE_API_KEY")
-    PINECONE_HOST: str = os.environ.get("PINECONE_HOST")
+    # "pinecone" (hosted) or "local" (in-process index under LOCAL_INDEX_PATH)
+    VECTOR_BACKEND: str = os.environ.get("VECTOR_BACKEND", "pinecone")
+
+    PINECONE_API_KEY: Optional[str] = os.environ.get("PINECONE_API_KEY")
+    PINECONE_HOST: Optional[str] = os.environ.get("PINECONE_HOST")
+    PINECONE_NAMESPACE: str = os.environ.get("PINECONE_NAMESPACE", "diploma_studies_project") # default tenant / course namespace
+
+    LOCAL_INDEX_PATH: str = os.environ.get("LOCAL_INDEX_PATH", "data/local_index")
+    LOCAL_INDEX_DIMENSION: int = os.environ.get("LOCAL_INDEX_DIMENSION", 768)
+    LOCAL_INDEX_IVF_LISTS: int = os.environ.get("LOCAL_INDEX_IVF_LISTS", 0) # 0 = exact search
+    LOCAL_INDEX_IVF_PROBES: int = os.environ.get("LOCAL_INDEX_IVF_PROBES", 8)
 
     MONGO_URL: str = os.environ.get("MONGO_URL") 
     DB_NAME: str = os.environ.get("DB_NAME")
 
+    MAX_UPLOAD_MB: float = os.environ.get("MAX_UPLOAD_MB", 200)
+    MAX_BATCH_UPLOAD_MB: float = os.environ.get("MAX_BATCH_UPLOAD_MB", 1000) # whole body of a batch upload
+    MAX_BATCH_FILES: int = os.environ.get("MAX_BATCH_FILES", 100)
+    BATCH_FILE_CONCURRENCY: int = os.environ.get("BATCH_FILE_CONCURRENCY", 4) # files of a batch extracted at once
+    UPLOAD_SPOOL_DIR: str = os.environ.get("UPLOAD_SPOOL_DIR", "data/uploads") # uploads wait here for their ingestion job
+
+    INGESTION_WORKERS: int = os.environ.get("INGESTION_WORKERS", 2)
+    INGESTION_QUEUE_SIZE: int = os.environ.get("INGESTION_QUEUE_SIZE", 100)
+    INGEST_QUEUE_DEPTH: int = os.environ.get("INGEST_QUEUE_DEPTH", 4) # items buffered between pipeline stages
+    INGEST_EMBED_CONCURRENCY: int = os.environ.get("INGEST_EMBED_CONCURRENCY", 2)
+    INGEST_JOURNAL_TTL_SECONDS: int = os.environ.get("INGEST_JOURNAL_TTL_SECONDS", 3 * 24 * 3600) # checkpoints of a failed ingest are kept this long for a retry
+
+    PROCESS_POOL_WORKERS: int = os.environ.get("PROCESS_POOL_WORKERS", 2) # 0 = worker threads instead of processes
+    PDF_PARSER: str = os.environ.get("PDF_PARSER", "llm") # "llm" (Gemini), "llm_sharded" (Gemini per page range) or "basic" (PyPDF2)
+    PDF_SHARD_PAGES: int = os.environ.get("PDF_SHARD_PAGES", 10) # pages per Gemini extraction call in "llm_sharded"
+    PDF_SHARD_CONCURRENCY: int = os.environ.get("PDF_SHARD_CONCURRENCY", 4)
+    PDF_SHARD_RETRIES: int = os.environ.get("PDF_SHARD_RETRIES", 2) # retries of a failed shard, the other shards are kept
+    CHUNKER: str = os.environ.get("CHUNKER", "stable") # "stable" (content defined, diffable) or "recursive" (800 / 80)
+
+    UPSERT_MAX_BATCH_BYTES: int = os.environ.get("UPSERT_MAX_BATCH_BYTES", 1_900_000) # Pinecone limit is 2 MB per request
+    UPSERT_MAX_IN_FLIGHT: int = os.environ.get("UPSERT_MAX_IN_FLIGHT", 4)
+    UPSERT_REQUESTS_PER_SECOND: float = os.environ.get("UPSERT_REQUESTS_PER_SECOND", 20) # 0 = unlimited
+    UPSERT_MAX_RETRIES: int = os.environ.get("UPSERT_MAX_RETRIES", 5)
+    VECTOR_DELETE_CONCURRENCY: int = os.environ.get("VECTOR_DELETE_CONCURRENCY", 4) # delete requests in flight per release
+    VECTOR_GC_INTERVAL_SECONDS: int = os.environ.get("VECTOR_GC_INTERVAL_SECONDS", 6 * 3600) # 0 = no orphan garbage collection
+
+    EMBED_MAX_IN_FLIGHT: int = os.environ.get("EMBED_MAX_IN_FLIGHT", 8) # embed_content calls across all requests
+    EMBED_BATCH_WINDOW_MS: float = os.environ.get("EMBED_BATCH_WINDOW_MS", 5)
+
+    EMBEDDING_CACHE_SIZE: int = os.environ.get("EMBEDDING_CACHE_SIZE", 10000)
+    EMBEDDING_CACHE_PATH: str = os.environ.get("EMBEDDING_CACHE_PATH", "data/embedding_cache.sqlite3")
+
+    RETRIEVAL_MODE: str = os.environ.get("RETRIEVAL_MODE", "hybrid") # "hybrid" (dense + BM25, fused with RRF) or "dense"
+    RETRIEVAL_CANDIDATES: int = os.environ.get("RETRIEVAL_CANDIDATES", 10) # matches fetched from each retriever before fusion (see benchmarks/hybrid_retrieval.py)
+    RRF_K: int = os.environ.get("RRF_K", 60)
+    CONTEXT_CANDIDATES: int = os.environ.get("CONTEXT_CANDIDATES", 20) # matches over-fetched for MMR
+    CONTEXT_MAX_CHUNKS: int = os.environ.get("CONTEXT_MAX_CHUNKS", 6)
+    CONTEXT_TOKEN_BUDGET: int = os.environ.get("CONTEXT_TOKEN_BUDGET", 1500) # estimated tokens of RAG context in the prompt
+    MMR_LAMBDA: float = os.environ.get("MMR_LAMBDA", 0.7) # 1 = relevance only, 0 = diversity only
+    ANSWER_CACHE_SIZE: int = os.environ.get("ANSWER_CACHE_SIZE", 1000) # 0 = disabled
+    ANSWER_CACHE_TTL_SECONDS: float = os.environ.get("ANSWER_CACHE_TTL_SECONDS", 86400)
+    ANSWER_CACHE_THRESHOLD: float = os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95) # cosine similarity of the queries
+    CHAT_HISTORY_TOKEN_BUDGET: int = os.environ.get("CHAT_HISTORY_TOKEN_BUDGET", 600) # recent messages in the prompt
+    CHAT_SUMMARY_TOKEN_BUDGET: int = os.environ.get("CHAT_SUMMARY_TOKEN_BUDGET", 300) # rolling summary of the older ones
+    CHAT_SESSION_TTL_SECONDS: int = os.environ.get("CHAT_SESSION_TTL_SECONDS", 7 * 24 * 3600)
+    LEXICAL_INDEX_PATH: str = os.environ.get("LEXICAL_INDEX_PATH", "data/lexical_index.sqlite3")
+    SNAPSHOT_ENCODING: str = os.environ.get("SNAPSHOT_ENCODING", "float16") # embeddings in exported snapshots: float16 | int8
+
 config = settings()
\ No newline at end of file
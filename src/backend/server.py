@@ -1,29 +1,64 @@
-from fastapi import FastAPI, Body, Depends, File, UploadFile, HTTPException
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, Body, Depends, File, Form, UploadFile, HTTPException, Query, Header, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse, JSONResponse, Response
 from contextlib import asynccontextmanager
-from datetime import datetime, timezone
+from datetime import datetime
+from typing import List, Optional
 import os
-import uuid
 import json
+import base64
 import asyncio
+import time
 
-from services.content_extraction import file_parser
-from services.content_processing import getChunks, generateEmbeddings
-from services.mongodb import connect_to_mongodb, get_mongodb, close_mongodb_connection
+from config import config
+from services.content_processing import generateEmbeddings, embedding_scheduler, PRIORITY_INTERACTIVE
+from services.mongodb import connect_to_mongodb, create_mongodb_indexes, get_mongodb, close_mongodb_connection
 from services.ai_init import init_genai, get_genai_client
-from services.pinecone import connect_to_pinecone, upsert_records, get_pinecone, query_records, delete_pinecone_vectors
+from services.pinecone import connect_to_pinecone, close_pinecone_connection, get_pinecone, resolve_namespace, list_namespaces, delete_namespace
+from services.lexical_index import lexical_index
+from services.retrieval import RetrievalScope, build_context, resolve_scope
+from services.answer_cache import answer_cache
+from services.chat_sessions import create_session, get_session, get_prompt_history, append_turn, session_compactor
+from services.streaming import DisconnectAwareStreamingResponse, stream_format, stream_text, stream_events, close_upstream
+from services.vector_refs import release_knowledge_base_vectors, drop_namespace_refs
+from services.vector_gc import vector_gc
+from services.ingestion import SUPPORTED_EXTENSIONS, namespace_filter
+from services.ingestion_journal import discard_namespace_journals
+from services.ingestion_jobs import JOB_FINAL_STATES, start_ingestion_workers, get_ingestion_queue, stop_ingestion_workers
+from services.embedding_cache import embedding_cache
+from services.executor import start_process_pool, stop_process_pool, remove_file
+from services.uploads import UploadLimitMiddleware, SpooledUpload, UploadTooLarge, spool_upload, max_upload_bytes
+from services.loop_monitor import loop_lag_monitor
+from services.metrics import (
+    MetricsMiddleware, render_metrics, timed_stream, record_llm_usage, CHAT_STREAMS_IN_FLIGHT, QUERY_EMBEDDING_SECONDS
+)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print(f"== Initializing services ==")
     await connect_to_mongodb()
+    await create_mongodb_indexes()
     await connect_to_pinecone()
+    await asyncio.to_thread(lexical_index.load)
     await init_genai()
+    await start_process_pool()
+    await start_ingestion_workers(get_mongodb())
+    loop_lag_monitor.start()
+    vector_gc.start(get_mongodb())
     
     print(f"== All of the services initialized successfuly ==")
 
     yield
+    await loop_lag_monitor.stop()
+    await vector_gc.stop()
+    await session_compactor.stop()
+    await stop_ingestion_workers()
+    await embedding_scheduler.stop()
+    await stop_process_pool()
     await close_mongodb_connection()
+    await close_pinecone_connection()
+    lexical_index.close()
+    embedding_cache.close()
     print(f"== Services closed ==")
 
 app = FastAPI(
@@ -31,26 +66,141 @@ app = FastAPI(
     version = "1.0.0",
     lifespan = lifespan
 )
+app.add_middleware(UploadLimitMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 @app.get("/")
 async def hello():
     return {"message": "Hello from Diploma Project API!"}
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics - per-stage latency histograms, token / chunk / vector counters, in-flight gauges"""
+    content, content_type = render_metrics()
+    return Response(content = content, media_type = content_type)
+
+
+@app.get("/embedding_cache/stats")
+async def get_embedding_cache_stats():
+    """Return the embedding cache hit / miss counters and the embedding scheduler batching stats"""
+    return {
+        "success": True,
+        "stats": embedding_cache.stats(),
+        "scheduler": embedding_scheduler.stats()
+    }
+
+
+@app.get("/lexical_index/stats")
+async def get_lexical_index_stats():
+    """Return the size of the BM25 index used by hybrid retrieval"""
+    return {
+        "success": True,
+        "stats": lexical_index.stats()
+    }
+
+
+@app.get("/vector_gc/stats")
+async def get_vector_gc_stats():
+    """Return how many vectors the orphan garbage collector scanned and purged"""
+    return {
+        "success": True,
+        "stats": vector_gc.stats()
+    }
+
+
+@app.get("/answer_cache/stats")
+async def get_answer_cache_stats():
+    """Return the semantic answer cache hit rate and the response time it saved"""
+    return {
+        "success": True,
+        "stats": answer_cache.stats()
+    }
+
+
+@app.get("/loop_lag/stats")
+async def get_loop_lag_stats():
+    """Return the event loop lag - stays low while ingestion work runs in the process pool"""
+    return {
+        "success": True,
+        "stats": loop_lag_monitor.stats()
+    }
+
+
+KNOWLEDGE_BASE_SUMMARY = {
+    "_id": 0,
+    "knowledge_base_id": 1,
+    "knowledge_base_name": 1,
+    # knowledge bases stored before namespaces are in the default one
+    "namespace": {"$ifNull": ["$namespace", config.PINECONE_NAMESPACE]},
+    "created_at": 1,
+    "updated_at": 1,
+    # knowledge bases stored before content segments carry the content (and no sizes) in the record
+    "content_size": {"$ifNull": ["$content_size", {"$strLenBytes": {"$ifNull": ["$content", ""]}}]},
+    "chunk_count": {"$ifNull": ["$chunk_count", {"$size": {"$ifNull": ["$pinecone_id_list", []]}}]},
+}
+
+
+def encode_cursor(knowledge_base: dict) -> str:
+    """Opaque pagination cursor - position of the last listed knowledge base"""
+    position = json.dumps({
+        "created_at": knowledge_base["created_at"].isoformat(),
+        "knowledge_base_id": knowledge_base["knowledge_base_id"]
+    })
+    return base64.urlsafe_b64encode(position.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> dict:
+    position = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    return {
+        "created_at": datetime.fromisoformat(position["created_at"]),
+        "knowledge_base_id": position["knowledge_base_id"]
+    }
+
+
 @app.get("/knowledge_base")
 async def get_knowledge_base(
+    limit: int = Query(20, ge = 1, le = 100),
+    cursor: Optional[str] = None,
+    namespace: Optional[str] = None,
     db = Depends(get_mongodb)
 ):
-    """Return all the knowledge base uploaded"""
+    """Return a page of knowledge base summaries (newest first, optionally of one namespace) - content is served separately"""
     try:
-        knowledge_base_list = await db.knowledge_base.find({}, {
-            "_id": 0,
-            "pinecone_id_list": 0
-        }).to_list(length = None)
+        match_stage = namespace_filter(namespace) if namespace else {}
+        if cursor:
+            try:
+                position = decode_cursor(cursor)
+            except Exception:
+                return JSONResponse(
+                    status_code = 400,
+                    content = {
+                        "success": False,
+                        "message": "Invalid cursor"
+                    }
+                )
+            match_stage["$or"] = [
+                {"created_at": {"$lt": position["created_at"]}},
+                {"created_at": position["created_at"], "knowledge_base_id": {"$lt": position["knowledge_base_id"]}}
+            ]
+
+        # one extra document tells whether there is a next page
+        knowledge_base_list = await db.knowledge_base.aggregate([
+            {"$match": match_stage},
+            {"$sort": {"created_at": -1, "knowledge_base_id": -1}},
+            {"$limit": limit + 1},
+            {"$project": KNOWLEDGE_BASE_SUMMARY}
+        ]).to_list(length = None)
+
+        next_cursor = None
+        if len(knowledge_base_list) > limit:
+            knowledge_base_list = knowledge_base_list[:limit]
+            next_cursor = encode_cursor(knowledge_base_list[-1])
 
         return {
             "success": True,
-            "knowledge_base_list": knowledge_base_list
+            "knowledge_base_list": jsonable_encoder(knowledge_base_list),
+            "next_cursor": next_cursor
         }
 
     except Exception as e:
@@ -65,132 +215,379 @@ async def get_knowledge_base(
         )
 
 
-@app.post("/fileProcessing")
-async def file_processing(
-    file: UploadFile = File(...),
+def parse_byte_range(range_header: Optional[str], total: int):
+    """Parse a single `bytes=start-end` range, returns (start, end) inclusive or None for the whole content"""
+    if not range_header or not range_header.startswith("bytes=") or "," in range_header:
+        return None
+
+    start, _, end = range_header[len("bytes="):].strip().partition("-")
+    if start == "":
+        # suffix range - the last N bytes
+        length = int(end)
+        return max(0, total - length), total - 1
+    end = int(end) if end else total - 1
+    return int(start), min(end, total - 1)
+
+
+@app.get("/knowledge_base/{knowledge_base_id}/content")
+async def get_knowledge_base_content(
+    knowledge_base_id: str,
+    range: Optional[str] = Header(None),
     db = Depends(get_mongodb)
 ):
-    """Process the uploaded file and store vectors in Pinecone DB."""
+    """Stream the extracted content of one knowledge base, supports single byte ranges (Range header)"""
     try:
-        content = await file.read()
+        knowledge_base = await db.knowledge_base.find_one(
+            { "knowledge_base_id": knowledge_base_id },
+            {"_id": 0, "content": 1, "content_size": 1}
+        )
+        if not knowledge_base:
+            error_message = f"Specified knowledge base not found: {knowledge_base_id}"
+            print(error_message)
+            return JSONResponse(
+                status_code = 404,
+                content = {
+                    "success": False,
+                    "message": error_message
+                }
+            )
 
-        file_size_mb = len(content) / (1024 * 1024)
-        if file_size_mb > 3:
-            raise HTTPException(
-                status_code = 400,
-                detail = f"File too large ({file_size_mb:.2f} MB). Max allowed is 3 MB.",
+        legacy_content = None
+        if "content" in knowledge_base:
+            legacy_content = knowledge_base["content"].encode("utf-8")
+            total = len(legacy_content)
+        else:
+            total = knowledge_base.get("content_size", 0)
+
+        try:
+            byte_range = parse_byte_range(range, total)
+        except ValueError:
+            byte_range = None
+        if byte_range is not None and (byte_range[0] >= total or byte_range[0] > byte_range[1]):
+            return Response(status_code = 416, headers = {"Content-Range": f"bytes */{total}"})
+        start, end = byte_range or (0, total - 1)
+
+        async def stream_content():
+            if legacy_content is not None:
+                yield legacy_content[start:end + 1]
+                return
+
+            # only the segments overlapping the range are read - starting at the one holding `start`
+            first = await db.knowledge_base_content.find_one(
+                {"knowledge_base_id": knowledge_base_id, "offset": {"$lte": start}},
+                {"_id": 0, "offset": 1},
+                sort = [("offset", -1)]
             )
+            async for segment in db.knowledge_base_content.find(
+                {
+                    "knowledge_base_id": knowledge_base_id,
+                    "offset": {"$gte": first["offset"] if first else 0, "$lte": end},
+                },
+                {"_id": 0, "offset": 1, "text": 1}
+            ).sort("offset", 1):
+                data = segment["text"].encode("utf-8")
+                yield data[max(0, start - segment["offset"]):end + 1 - segment["offset"]]
+
+        headers = {
+            "Accept-Ranges": "bytes",
+            "Content-Length": str(max(0, end - start + 1))
+        }
+        if byte_range is not None:
+            headers["Content-Range"] = f"bytes {start}-{end}/{total}"
+
+        return StreamingResponse(
+            stream_content(),
+            status_code = 206 if byte_range is not None else 200,
+            media_type = "text/plain; charset=utf-8",
+            headers = headers
+        )
 
-        # Detect file extension
-        file_name = file.filename
-        file_extension = os.path.splitext(file.filename)[1].lower()
-        print(f"== file extension is: {file_extension} ==")
-
-        # File parsing
-        match file_extension:
-            case ".pdf":
-                extracted_content = await file_parser.using_llm(content, "pdf")
-            case ".csv":
-                extracted_content = await file_parser.using_llm(content, "csv")
-            case ".docx":
-                extracted_content = await file_parser.basic_docx(content)
-            case _:
-                raise HTTPException(
-                    status_code = 400,
-                    detail = f"Unsupported file type '{file_extension}'. Only PDF, CSV, and DOCX are supported.",
-                )
+    except Exception as e:
+        error_message = f"Error while fetching the knowledge base content: {e}"
+        print(error_message)
+        return JSONResponse(
+            status_code = 500,
+            content = {
+                "success": False,
+                "message": error_message
+            }
+        )
+
+
+async def read_upload(file: UploadFile) -> SpooledUpload:
+    """
+    Spool the uploaded file to disk piece by piece, rejecting oversized and unsupported files -
+    memory per upload stays flat whatever the file size
+    """
+    # Detect file extension
+    file_extension = os.path.splitext(file.filename)[1].lower()
+    if file_extension not in SUPPORTED_EXTENSIONS:
+        raise HTTPException(
+            status_code = 400,
+            detail = f"Unsupported file type '{file_extension}'. Only PDF, CSV, and DOCX are supported.",
+        )
+
+    max_bytes = max_upload_bytes()
+    if file.size is not None and file.size > max_bytes:
+        raise HTTPException(
+            status_code = 413,
+            detail = f"File too large ({file.size / (1024 * 1024):.2f} MB). Max allowed is {max_bytes / (1024 * 1024):g} MB.",
+        )
+
+    try:
+        return await spool_upload(file, file_extension, max_bytes)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code = 413, detail = str(e))
 
-        # Generate chunks and embeddings
-        print("== Calculating chunks and embeddings ==")
-        chunks = getChunks(extracted_content)
 
-        batch_size = 25
-        tasks = []
+def invalid_namespace(namespace: Optional[str]) -> Optional[JSONResponse]:
+    """400 response for a namespace name Pinecone / the vector keys cannot take, None when it is fine"""
+    try:
+        resolve_namespace(namespace)
+    except ValueError as e:
+        return JSONResponse(
+            status_code = 400,
+            content = {
+                "success": False,
+                "message": str(e)
+            }
+        )
+    return None
 
-        for i in range(0, len(chunks), batch_size):
-            batch = chunks[i:i + batch_size]  
-            tasks.append(generateEmbeddings(batch))
 
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+@app.post("/fileProcessing", status_code = 202)
+async def file_processing(
+    file: UploadFile = File(...),
+    namespace: Optional[str] = Form(None),
+    ingestion_queue = Depends(get_ingestion_queue)
+):
+    """Validate the uploaded file and queue it for background ingestion into `namespace` (default PINECONE_NAMESPACE) - returns the job id"""
+    error_response = invalid_namespace(namespace)
+    if error_response:
+        return error_response
+
+    try:
+        upload = await read_upload(file)
+        try:
+            job_id = await ingestion_queue.submit(file.filename, upload, namespace = namespace)
+        except BaseException:
+            remove_file(upload.path)
+            raise
+        print(f"== File queued for processing, job id: {job_id} ==")
 
-        embeddings = []
+        return {"success": True, "job_id": job_id, "message": "File queued for processing."}
+
+    except HTTPException as e:
+        raise e
+    except asyncio.QueueFull:
+        return JSONResponse(
+            content = {
+                "success": False,
+                "message": "Too many files are being processed, please try again later.",
+            },
+            status_code = 503,
+        )
+    except Exception as e:
+        print(f"== Unexpected error: {e} ==")
+        return JSONResponse(
+            content = {
+                "success": False,
+                "message": f"Unexpected error while processing file: {str(e)}",
+            },
+            status_code = 500,
+        )
+
+
+@app.post("/fileProcessing/batch", status_code = 202)
+async def batch_file_processing(
+    files: List[UploadFile] = File(...),
+    namespace: Optional[str] = Form(None),
+    ingestion_queue = Depends(get_ingestion_queue)
+):
+    """
+    Validate many uploaded files and queue the accepted ones as one batch - they are extracted
+    concurrently and share full embedding / upsert batches. A rejected file does not reject the rest,
+    the response lists the outcome (and job id) of every file.
+    """
+    if len(files) > config.MAX_BATCH_FILES:
+        return JSONResponse(
+            status_code = 400,
+            content = {
+                "success": False,
+                "message": f"Too many files ({len(files)}). Max allowed is {config.MAX_BATCH_FILES} per batch.",
+            }
+        )
+    error_response = invalid_namespace(namespace)
+    if error_response:
+        return error_response
+
+    accepted = []
+    results = []
+    queued = False
+    try:
+        for file in files:
+            try:
+                upload = await read_upload(file)
+            except HTTPException as e:
+                results.append({"file_name": file.filename, "status": "rejected", "error": e.detail})
+                continue
+            accepted.append((file.filename, upload))
+            results.append({"file_name": file.filename, "status": "queued"})
+
+        if not accepted:
+            return JSONResponse(
+                status_code = 400,
+                content = {
+                    "success": False,
+                    "message": "None of the files can be processed.",
+                    "files": results
+                }
+            )
+
+        batch_id, job_ids = await ingestion_queue.submit_batch(accepted, namespace = namespace)
+        queued = True
+        job_ids = iter(job_ids)
         for result in results:
-            if isinstance(result, Exception):
-                print(f"== Error generating embeddings: {result} ==")
-                raise HTTPException(
-                    status_code = 500,
-                    detail = "Error occurred during embedding generation.",
-                )
-            for embedding in result:
-                embeddings.append(embedding)
+            if result["status"] == "queued":
+                result["job_id"] = next(job_ids)
+        print(f"== {len(accepted)} files queued for processing, batch id: {batch_id} ==")
+
+        return {
+            "success": True,
+            "batch_id": batch_id,
+            "files": results,
+            "message": f"{len(accepted)} of {len(files)} files queued for processing."
+        }
 
-        if len(chunks) != len(embeddings):
-            raise HTTPException(
-                status_code = 500,
-                detail = "Size mismatch between chunks and embeddings.",
+    except asyncio.QueueFull:
+        return JSONResponse(
+            content = {
+                "success": False,
+                "message": "Too many files are being processed, please try again later.",
+            },
+            status_code = 503,
+        )
+    except Exception as e:
+        print(f"== Unexpected error: {e} ==")
+        return JSONResponse(
+            content = {
+                "success": False,
+                "message": f"Unexpected error while processing files: {str(e)}",
+            },
+            status_code = 500,
+        )
+    finally:
+        # once queued the spooled files belong to the ingestion queue
+        if not queued:
+            for _, upload in accepted:
+                remove_file(upload.path)
+
+
+@app.put("/knowledge_base/{knowledge_base_id}", status_code = 202)
+async def update_knowledge_base(
+    knowledge_base_id: str,
+    file: UploadFile = File(...),
+    db = Depends(get_mongodb),
+    ingestion_queue = Depends(get_ingestion_queue)
+):
+    """Queue a new version of an existing knowledge base (into its namespace) - only the changed chunks are re-embedded"""
+    try:
+        knowledge_base = await db.knowledge_base.find_one(
+            { "knowledge_base_id": knowledge_base_id },
+            {"_id": 0, "knowledge_base_id": 1}
+        )
+        if not knowledge_base:
+            error_message = f"Specified knowledge base not found: {knowledge_base_id}"
+            print(error_message)
+            return JSONResponse(
+                status_code = 404,
+                content = {
+                    "success": False,
+                    "message": error_message
+                }
             )
 
-        # Prepare and upload vectors
-        print("== Uploading vectors to Pinecone ==")
-        upsert_batch_size = 25
-        vectors = []
-        pinecone_ids = []
-        for chunk, embedding in zip(chunks, embeddings):
-            uid = str(uuid.uuid4())
-            pinecone_ids.append(uid)
-            vector = {
-                "id": uid,
-                "values": embedding,
-                "metadata": {
-                    "content": chunk,
-                    "file_reference": file.filename,
-                },
-            }
-            vectors.append(vector)
-
-            if len(vectors) == upsert_batch_size:
-                result = await upsert_records(vectors)
-                if not result:
-                    raise HTTPException(
-                        status_code=500,
-                        detail="Error uploading records to PineconeDB.",
-                    )
-                vectors = []
-                await asyncio.sleep(0.5)
-
-        # Upload remaining
-        if vectors:
-            result = await upsert_records(vectors)
-            if not result:
-                raise HTTPException(
-                    status_code = 500,
-                    detail = "Error uploading final records to PineconeDB.",
-                )
-        # save the data to DB
-        await db.knowledge_base.insert_one({
-            "knowledge_base_id": str(uuid.uuid4()),
-            "knowledge_base_name": file_name,
-            "content": extracted_content,
-            "pinecone_id_list": pinecone_ids,
-            "created_at": datetime.now(timezone.utc)
-        })
-
-        print("== File processing successful! ==")
-        return {"success": True, "message": "File processed successfully!"}
+        upload = await read_upload(file)
+        try:
+            job_id = await ingestion_queue.submit(file.filename, upload, knowledge_base_id)
+        except BaseException:
+            remove_file(upload.path)
+            raise
+        print(f"== New version queued for processing, job id: {job_id} ==")
+
+        return {"success": True, "job_id": job_id, "message": "New version queued for processing."}
 
     except HTTPException as e:
         raise e
+    except asyncio.QueueFull:
+        return JSONResponse(
+            content = {
+                "success": False,
+                "message": "Too many files are being processed, please try again later.",
+            },
+            status_code = 503,
+        )
     except Exception as e:
         print(f"== Unexpected error: {e} ==")
         return JSONResponse(
             content = {
                 "success": False,
-                "message": f"Unexpected error while processing file: {str(e)}",
+                "message": f"Unexpected error while updating knowledge base: {str(e)}",
             },
             status_code = 500,
         )
 
 
+@app.get("/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    ingestion_queue = Depends(get_ingestion_queue)
+):
+    """Return the status, progress and per-stage timings of an ingestion job"""
+    job = await ingestion_queue.get(job_id)
+    if not job:
+        return JSONResponse(
+            status_code = 404,
+            content = {
+                "success": False,
+                "message": f"Specified job not found: {job_id}"
+            }
+        )
+
+    return {
+        "success": True,
+        "job": job
+    }
+
+
+@app.get("/batches/{batch_id}")
+async def get_batch(
+    batch_id: str,
+    ingestion_queue = Depends(get_ingestion_queue)
+):
+    """Return the ingestion job of every file of a batch upload, with a count per status"""
+    jobs = await ingestion_queue.get_batch(batch_id)
+    if not jobs:
+        return JSONResponse(
+            status_code = 404,
+            content = {
+                "success": False,
+                "message": f"Specified batch not found: {batch_id}"
+            }
+        )
+
+    counts = {}
+    for job in jobs:
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+
+    return {
+        "success": True,
+        "batch_id": batch_id,
+        "counts": counts,
+        "jobs": jobs
+    }
+
+
 @app.delete("/knowledge_base/{knowledge_base_id}")
 async def delete_knowledge_base(
     knowledge_base_id: str,
@@ -214,11 +611,11 @@ async def delete_knowledge_base(
                 }
             )
         
-        await delete_pinecone_vectors(
-            pinecone_ids = knowledge_base.get("pinecone_id_list")
-        )
+        # vectors still referenced by other knowledge bases are kept
+        await release_knowledge_base_vectors(db, knowledge_base)
         print("== pinecone vectors deleted successfuly ==")
         await db.knowledge_base.delete_one({ "knowledge_base_id": knowledge_base_id })
+        await db.knowledge_base_content.delete_many({ "knowledge_base_id": knowledge_base_id })
         print("== Knowledge Base deleted successfuly ==")
 
         return {
@@ -238,18 +635,150 @@ async def delete_knowledge_base(
         )
 
 
+@app.get("/namespaces")
+async def get_namespaces(
+    db = Depends(get_mongodb)
+):
+    """Namespaces of the vector index with their vector and knowledge base counts"""
+    try:
+        vector_counts = await list_namespaces()
+        knowledge_base_counts = {
+            item["_id"]: item["count"] async for item in db.knowledge_base.aggregate([
+                {"$group": {"_id": {"$ifNull": ["$namespace", config.PINECONE_NAMESPACE]}, "count": {"$sum": 1}}}
+            ])
+        }
+        namespaces = [
+            {
+                "namespace": namespace,
+                "vector_count": vector_counts.get(namespace, 0),
+                "knowledge_base_count": knowledge_base_counts.get(namespace, 0),
+                "default": namespace == config.PINECONE_NAMESPACE
+            }
+            for namespace in sorted(set(vector_counts) | set(knowledge_base_counts))
+        ]
+
+        return {
+            "success": True,
+            "namespaces": namespaces
+        }
+
+    except Exception as e:
+        error_message = f"Error while listing namespaces: {e}"
+        print(error_message)
+        return JSONResponse(
+            status_code = 500,
+            content = {
+                "success": False,
+                "message": error_message
+            }
+        )
+
+
+@app.delete("/namespaces/{namespace}")
+async def drop_namespace(
+    namespace: str,
+    db = Depends(get_mongodb)
+):
+    """
+    Bulk reset - drops every vector of the namespace with one delete-all request (instead of deleting
+    the knowledge bases one id batch at a time) along with its knowledge bases, references and journals
+    """
+    error_response = invalid_namespace(namespace)
+    if error_response:
+        return error_response
+
+    try:
+        # an ingest still writing into the namespace would leave vectors nothing refers to
+        in_flight = await db.ingestion_jobs.count_documents(
+            {**namespace_filter(namespace), "status": {"$nin": list(JOB_FINAL_STATES)}},
+            limit = 1
+        )
+        if in_flight:
+            return JSONResponse(
+                status_code = 409,
+                content = {
+                    "success": False,
+                    "message": f"Files are still being processed into namespace '{namespace}', please try again later."
+                }
+            )
+
+        await delete_namespace(namespace)
+        print(f"== pinecone namespace {namespace} deleted successfuly ==")
+
+        knowledge_base_ids = await db.knowledge_base.distinct("knowledge_base_id", namespace_filter(namespace))
+        for i in range(0, len(knowledge_base_ids), 1000):
+            await db.knowledge_base_content.delete_many({"knowledge_base_id": {"$in": knowledge_base_ids[i:i + 1000]}})
+        await db.knowledge_base.delete_many(namespace_filter(namespace))
+        await drop_namespace_refs(db, namespace)
+        await discard_namespace_journals(db, namespace)
+        await asyncio.to_thread(lexical_index.remove_namespace, namespace)
+        answer_cache.clear()
+        print(f"== Namespace {namespace} dropped: {len(knowledge_base_ids)} knowledge bases ==")
+
+        return {
+            "success": True,
+            "knowledge_bases_deleted": len(knowledge_base_ids),
+            "message": f"Namespace '{namespace}' dropped"
+        }
+
+    except Exception as e:
+        error_message = f"Error while dropping namespace: {e}"
+        print(error_message)
+        return JSONResponse(
+            status_code = 500,
+            content = {
+                "success": False,
+                "message": error_message
+            }
+        )
+
+
 async def generate_response(
     query: str,
     message_history,
-    genai_client
+    genai_client,
+    scope: Optional[RetrievalScope] = None,
+    session_id: Optional[str] = None,
+    db = None,
+    stats: Optional[dict] = None
 ):
+    """
+    Stream the answer pieces. `stats` is filled with what the stream formats report (cached, context
+    and output tokens, the error if generation failed).
+    """
+    stats = stats if stats is not None else {}
+    scope = scope or RetrievalScope(namespace = config.PINECONE_NAMESPACE)
+    response = None
+    CHAT_STREAMS_IN_FLIGHT.inc()
     try:
-        # fetch context from pinecone
-        embedding = await generateEmbeddings([query])
-        pinecone_context = await query_records(
-            vector = embedding,
-            top_k = 5
-        )
+        # server side session - the rolling summary plus the recent messages that fit the history budget
+        if session_id is not None:
+            session = await get_session(db, session_id)
+            message_history = await get_prompt_history(db, session)
+
+        started = time.perf_counter()
+        embedding = await generateEmbeddings([query], priority = PRIORITY_INTERACTIVE)
+        query_vector = embedding[0]
+        QUERY_EMBEDDING_SECONDS.observe(time.perf_counter() - started)
+
+        # a paraphrase of an already answered question gets the stored answer replayed
+        cached = answer_cache.lookup(query_vector, message_history, scope.cache_key())
+        if cached is not None:
+            print(f"== Answer cache hit, replaying the answer to: {cached['query']} ==")
+            stats["cached"] = True
+            for piece in cached["pieces"]:
+                yield piece
+            answer_cache.record_hit(cached, time.perf_counter() - started)
+            if session_id is not None:
+                await append_turn(db, session_id, query, "".join(cached["pieces"]))
+                session_compactor.schedule(db, genai_client, session_id)
+            return
+        cache_generation = answer_cache.generation
+
+        # fetch context - dense (pinecone) and lexical (BM25) retrieval, de-duplicated and packed into the token budget
+        pinecone_context, context_stats = await build_context(query, query_vector, scope)
+        print(f"== RAG context: {len(context_stats['vector_ids'])} chunks, {context_stats['tokens']} tokens ==")
+        stats["context_tokens"] = context_stats["tokens"]
 
         prompt = f"""
         You are a Specialized Diploma Study Bot designed to help students with academic and general Q&A.
@@ -264,6 +793,7 @@ async def generate_response(
         - Keep the tone natural, friendly, and helpful — like a knowledgeable tutor.
         - Maintain the same language as the input (English, Hindi, etc.).
         - Organize the response logically using headings, bullet points, or steps when appropriate.
+        - The RAG context is a list of numbered excerpts, each labelled with its source file.
 
         Note: RAG context will be provided - irrespective of the nature of the query
 
@@ -273,6 +803,7 @@ async def generate_response(
         RAG Context:
         {pinecone_context}
         """
+        generation_started = time.perf_counter()
         response = await genai_client.aio.models.generate_content_stream(
             model = "gemini-2.0-flash",
             contents = query,
@@ -281,25 +812,120 @@ async def generate_response(
             }
         )
 
-        async for res in response:
-            if res.candidates[0].content.parts[0].text:
+        pieces = []
+        usage_metadata = None
+        async for res in timed_stream(response, "chat", generation_started):
+            if res.usage_metadata is not None:
+                usage_metadata = res.usage_metadata
+                if usage_metadata.candidates_token_count:
+                    stats["output_tokens"] = usage_metadata.candidates_token_count
+            if res.candidates and res.candidates[0].content.parts[0].text:
+                pieces.append(res.candidates[0].content.parts[0].text)
                 yield res.candidates[0].content.parts[0].text
-                await asyncio.sleep(0.125)
+
+        record_llm_usage("chat", usage_metadata)
+
+        answer_cache.put(
+            query = query,
+            vector = query_vector,
+            message_history = message_history,
+            pieces = pieces,
+            vector_ids = context_stats["vector_ids"],
+            min_similarity = context_stats["min_similarity"],
+            response_seconds = time.perf_counter() - started,
+            generation = cache_generation,
+            scope = scope.cache_key()
+        )
+
+        if session_id is not None:
+            await append_turn(db, session_id, query, "".join(pieces))
+            session_compactor.schedule(db, genai_client, session_id)
 
     except Exception as e:
-        yield f"There was an error while generating response: {e}"
+        print(f"== Error while generating response: {e} ==")
+        stats["error"] = str(e)
+
+    finally:
+        CHAT_STREAMS_IN_FLIGHT.dec()
+        # also reached when the client disconnected - stop reading the Gemini stream
+        if response is not None:
+            await close_upstream(response)
+
+
+@app.post("/chat_sessions", status_code = 201)
+async def create_chat_session(
+    db = Depends(get_mongodb)
+):
+    """Start a conversation - /chat requests carry the returned session id instead of the message history"""
+    session_id = await create_session(db)
+    return {"success": True, "session_id": session_id}
 
 
 @app.post("/chat")
 async def send_llm_response(
+    request: Request,
     request_data = Body(...),
     genai_client = Depends(get_genai_client),
+    db = Depends(get_mongodb)
 ):
-    return StreamingResponse(generate_response(
+    """
+    Stream the answer - plain text by default, NDJSON (Accept: application/x-ndjson) or SSE
+    (Accept: text/event-stream) events with a final metadata event (time to first token, tokens/s).
+    Retrieval searches `namespace` (default PINECONE_NAMESPACE), or only the `knowledge_base_ids` given.
+    """
+    started = time.perf_counter()
+    session_id = request_data.get("session_id")
+    if session_id is not None and await get_session(db, session_id) is None:
+        return JSONResponse(
+            status_code = 404,
+            content = {
+                "success": False,
+                "message": f"Chat session not found: {session_id}"
+            }
+        )
+
+    knowledge_base_ids = request_data.get("knowledge_base_ids")
+    if knowledge_base_ids is not None and (
+        not isinstance(knowledge_base_ids, list) or not all(isinstance(item, str) for item in knowledge_base_ids)
+    ):
+        return JSONResponse(
+            status_code = 400,
+            content = {
+                "success": False,
+                "message": "knowledge_base_ids must be a list of knowledge base ids"
+            }
+        )
+    try:
+        scope = await resolve_scope(db, request_data.get("namespace"), knowledge_base_ids)
+    except ValueError as e:
+        return JSONResponse(
+            status_code = 400,
+            content = {
+                "success": False,
+                "message": str(e)
+            }
+        )
+
+    stats = {}
+    pieces = generate_response(
         query = request_data.get("query"),
         message_history = request_data.get("message_history", None),
-        genai_client = genai_client
-    ) , media_type="text/plain")
+        genai_client = genai_client,
+        scope = scope,
+        session_id = session_id,
+        db = db,
+        stats = stats
+    )
+
+    format = stream_format(request.headers.get("accept"))
+    if format == "text":
+        return DisconnectAwareStreamingResponse(stream_text(pieces, stats), media_type = "text/plain")
+
+    return DisconnectAwareStreamingResponse(
+        stream_events(pieces, format, stats, started),
+        media_type = "text/event-stream" if format == "sse" else "application/x-ndjson",
+        headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,240 @@
+from collections import OrderedDict
+from typing import Iterable, List, Optional
+import hashlib
+import json
+import time
+
+import numpy as np
+
+from config import config
+from services.lexical_index import tokenize
+
+
+def history_fingerprint(
+    message_history,
+    scope: str = ""
+) -> str:
+    """
+    Answers depend on the conversation and on what was searched (the retrieval scope) too -
+    only entries with the same history and scope are reused
+    """
+    return hashlib.sha256(
+        (json.dumps(message_history or [], sort_keys = True) + scope).encode("utf-8")
+    ).hexdigest()
+
+
+class AnswerCache:
+    """
+    Semantic answer cache - a new query whose embedding is within `threshold` cosine similarity of a
+    cached query (with the same message history) gets the stored answer replayed.
+
+    Entries live in fixed slots of one normalised query matrix, so a lookup is a single mat-vec.
+    Eviction is LRU once `max_items` are cached, entries expire after `ttl` seconds. An entry is
+    invalidated when a chunk it was answered from is deleted, or when a new chunk would have been
+    retrieved for its query (embedding at least as close as the weakest chunk it used, or containing
+    one of its identifier-like tokens such as "CS-101").
+    """
+
+    def __init__(
+        self,
+        max_items: int,
+        ttl: float,
+        threshold: float
+    ):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.threshold = threshold
+
+        self.vectors: Optional[np.ndarray] = None # slot -> normalised query embedding
+        self.min_similarity = np.zeros(max(max_items, 0), dtype = np.float32)
+        self.entries: List[Optional[dict]] = [None] * max(max_items, 0)
+        self.lru: OrderedDict = OrderedDict() # live slots, least recently used first
+        self.free = list(range(max(max_items, 0) - 1, -1, -1))
+        self.slots_by_vector = {} # vector id -> slots of the entries answered from it
+        self.generation = 0 # bumped by every invalidation - answers generated across one are not cached
+
+        self.lookups = 0
+        self.hits = 0
+        self.latency_saved = 0.0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_items > 0
+
+    @staticmethod
+    def _normalise(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype = np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(
+        self,
+        vector: list,
+        message_history,
+        scope: str = ""
+    ) -> Optional[dict]:
+        """The cached entry closest to the query, if it is within the threshold - {query, pieces, ...}"""
+        if not self.enabled:
+            return None
+
+        self.lookups += 1
+        if not self.lru or self.vectors is None:
+            return None
+
+        query = self._normalise(vector)
+        if query.shape[0] != self.vectors.shape[1]:
+            return None
+
+        fingerprint = history_fingerprint(message_history, scope)
+        similarities = self.vectors @ query
+        now = time.monotonic()
+        for slot in np.argsort(-similarities):
+            slot = int(slot)
+            if similarities[slot] < self.threshold:
+                break
+
+            entry = self.entries[slot]
+            if entry is None or entry["history"] != fingerprint:
+                continue
+            if now - entry["created_at"] > self.ttl:
+                self._drop(slot)
+                self.expirations += 1
+                continue
+
+            self.lru.move_to_end(slot)
+            self.hits += 1
+            entry["hits"] += 1
+            return entry
+
+        return None
+
+    def record_hit(self, entry: dict, served_seconds: float):
+        """Latency saved - what the original answer took minus what serving it from the cache took"""
+        self.latency_saved += max(0.0, entry["response_seconds"] - served_seconds)
+
+    def put(
+        self,
+        query: str,
+        vector: list,
+        message_history,
+        pieces: List[str],
+        vector_ids: Iterable[str],
+        min_similarity: float,
+        response_seconds: float,
+        generation: int,
+        scope: str = ""
+    ):
+        """Cache an answer (the streamed pieces) with the chunks it was generated from"""
+        if not self.enabled or not pieces or generation != self.generation:
+            return
+
+        query_vector = self._normalise(vector)
+        if self.vectors is None or self.vectors.shape[1] != query_vector.shape[0]:
+            self.clear()
+            self.vectors = np.zeros((self.max_items, query_vector.shape[0]), dtype = np.float32)
+
+        if not self.free:
+            slot, _ = self.lru.popitem(last = False)
+            self._drop(slot)
+            self.evictions += 1
+        slot = self.free.pop()
+
+        vector_ids = list(dict.fromkeys(vector_ids))
+        self.vectors[slot] = query_vector
+        self.min_similarity[slot] = min_similarity
+        self.entries[slot] = {
+            "query": query,
+            "history": history_fingerprint(message_history, scope),
+            "pieces": pieces,
+            "vector_ids": vector_ids,
+            "identifiers": {token for token in tokenize(query) if any(char.isdigit() for char in token)},
+            "response_seconds": response_seconds,
+            "created_at": time.monotonic(),
+            "hits": 0
+        }
+        self.lru[slot] = None
+        for vector_id in vector_ids:
+            self.slots_by_vector.setdefault(vector_id, set()).add(slot)
+
+    def _drop(self, slot: int):
+        entry = self.entries[slot]
+        if entry is None:
+            return
+
+        for vector_id in entry["vector_ids"]:
+            slots = self.slots_by_vector.get(vector_id)
+            if slots is not None:
+                slots.discard(slot)
+                if not slots:
+                    del self.slots_by_vector[vector_id]
+
+        self.entries[slot] = None
+        self.vectors[slot] = 0
+        self.lru.pop(slot, None)
+        self.free.append(slot)
+
+    def invalidate_removed(self, vector_ids: Iterable[str]):
+        """Chunks were deleted - drop the entries answered from any of them"""
+        self.generation += 1
+        slots = set()
+        for vector_id in vector_ids:
+            slots |= self.slots_by_vector.get(vector_id, set())
+
+        for slot in slots:
+            self._drop(slot)
+        self.invalidations += len(slots)
+
+    def invalidate_added(self, chunks: List[tuple]):
+        """New (vector id, text, embedding) chunks - drop the entries they would have been retrieved for"""
+        if not chunks:
+            return
+        self.generation += 1
+        if not self.lru:
+            return
+
+        slots = np.fromiter(self.lru.keys(), dtype = np.int64)
+        embeddings = np.asarray([embedding for _, _, embedding in chunks], dtype = np.float32)
+        affected = np.zeros(len(slots), dtype = bool)
+        if embeddings.shape[1] == self.vectors.shape[1]:
+            norms = np.linalg.norm(embeddings, axis = 1, keepdims = True)
+            embeddings = np.divide(embeddings, norms, out = np.zeros_like(embeddings), where = norms > 0)
+            closest = (self.vectors[slots] @ embeddings.T).max(axis = 1)
+            affected = closest >= self.min_similarity[slots]
+
+        tokens = set()
+        for _, text, _ in chunks:
+            tokens.update(tokenize(text))
+        for i, slot in enumerate(slots):
+            if not affected[i] and self.entries[slot]["identifiers"] & tokens:
+                affected[i] = True
+
+        for slot in slots[affected]:
+            self._drop(int(slot))
+        self.invalidations += int(affected.sum())
+
+    def clear(self):
+        for slot in list(self.lru):
+            self._drop(slot)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self.lru),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "latency_saved_seconds": round(self.latency_saved, 3),
+            "average_latency_saved_seconds": round(self.latency_saved / self.hits, 3) if self.hits else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+answer_cache = AnswerCache(
+    max_items = config.ANSWER_CACHE_SIZE,
+    ttl = config.ANSWER_CACHE_TTL_SECONDS,
+    threshold = config.ANSWER_CACHE_THRESHOLD
+)
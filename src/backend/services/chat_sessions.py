@@ -0,0 +1,192 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import asyncio
+import uuid
+
+from pymongo import ReturnDocument
+
+from config import config
+from services.context_assembly import estimate_tokens, truncate_to_tokens
+from services.metrics import record_llm_usage
+
+# conversations are kept server side: chat_sessions holds the rolling summary of the older turns,
+# chat_messages every message. A prompt gets the summary plus the recent messages that fit the
+# history budget - its size stays the same however long the conversation gets.
+# Messages expire with their session: the ones not folded into the summary yet have their
+# `session_updated_at` refreshed on every turn, the TTL index of both collections uses the same time.
+
+SUMMARY_MODEL = "gemini-2.0-flash"
+
+
+async def create_session(db) -> str:
+    session_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    await db.chat_sessions.insert_one({
+        "session_id": session_id,
+        "summary": "",
+        "summarized_until": 0, # messages with seq <= summarized_until are folded into the summary
+        "message_count": 0,
+        "created_at": now,
+        "updated_at": now
+    })
+
+    return session_id
+
+
+async def get_session(db, session_id: str) -> Optional[dict]:
+    return await db.chat_sessions.find_one({"session_id": session_id}, {"_id": 0})
+
+
+async def get_prompt_history(db, session: dict) -> dict:
+    """The summary and the most recent messages (newest kept first) within CHAT_HISTORY_TOKEN_BUDGET"""
+    messages = []
+    budget = config.CHAT_HISTORY_TOKEN_BUDGET
+    async for message in db.chat_messages.find(
+        {"session_id": session["session_id"], "seq": {"$gt": session["summarized_until"]}},
+        {"_id": 0, "role": 1, "content": 1}
+    ).sort("seq", -1):
+        tokens = estimate_tokens(message["content"])
+        if tokens > budget:
+            # long answers are cut rather than dropped, the rest is waiting to be summarized
+            if budget >= 32:
+                messages.append({"role": message["role"], "content": truncate_to_tokens(message["content"], budget)})
+            break
+        messages.append(message)
+        budget -= tokens
+
+    messages.reverse()
+    return {
+        "summary": session["summary"],
+        "messages": messages
+    }
+
+
+async def append_turn(
+    db,
+    session_id: str,
+    query: str,
+    answer: str
+) -> dict:
+    """Store the query and the answer, returns the updated session"""
+    now = datetime.now(timezone.utc)
+    session = await db.chat_sessions.find_one_and_update(
+        {"session_id": session_id},
+        {"$inc": {"message_count": 2}, "$set": {"updated_at": now}},
+        projection = {"_id": 0},
+        return_document = ReturnDocument.AFTER
+    )
+    if session is None:
+        raise Exception(f"Chat session not found: {session_id}")
+
+    seq = session["message_count"] - 1
+    await db.chat_messages.update_many(
+        {"session_id": session_id, "seq": {"$gt": session["summarized_until"]}},
+        {"$set": {"session_updated_at": now}}
+    )
+    await db.chat_messages.insert_many([
+        {"session_id": session_id, "seq": seq, "role": "user", "content": query, "created_at": now, "session_updated_at": now},
+        {"session_id": session_id, "seq": seq + 1, "role": "ai", "content": answer, "created_at": now, "session_updated_at": now},
+    ])
+
+    return session
+
+
+class SessionCompactor:
+    """
+    Folds the older messages of a session into its summary in the background, once the messages that
+    are not summarized yet exceed the history budget. One compaction per session at a time.
+    """
+
+    def __init__(self):
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    def schedule(
+        self,
+        db,
+        genai_client,
+        session_id: str
+    ):
+        if session_id in self.tasks:
+            return
+
+        task = asyncio.create_task(self._compact(db, genai_client, session_id))
+        self.tasks[session_id] = task
+        task.add_done_callback(lambda _: self.tasks.pop(session_id, None))
+
+    async def _compact(
+        self,
+        db,
+        genai_client,
+        session_id: str
+    ):
+        try:
+            session = await get_session(db, session_id)
+            if session is None:
+                return
+
+            messages = await db.chat_messages.find(
+                {"session_id": session_id, "seq": {"$gt": session["summarized_until"]}},
+                {"_id": 0, "seq": 1, "role": 1, "content": 1}
+            ).sort("seq", 1).to_list(length = None)
+
+            # fold the oldest messages until the rest fits half of the budget (so this does not run every turn)
+            pending = sum(estimate_tokens(message["content"]) for message in messages)
+            if pending <= config.CHAT_HISTORY_TOKEN_BUDGET:
+                return
+
+            folded: List[dict] = []
+            while messages and pending > config.CHAT_HISTORY_TOKEN_BUDGET // 2:
+                message = messages.pop(0)
+                folded.append(message)
+                pending -= estimate_tokens(message["content"])
+
+            summary = await summarize(genai_client, session["summary"], folded)
+
+            # only the compaction that started from this state may move it forward
+            await db.chat_sessions.update_one(
+                {"session_id": session_id, "summarized_until": session["summarized_until"]},
+                {"$set": {"summary": summary, "summarized_until": folded[-1]["seq"]}}
+            )
+            print(f"== Session {session_id}: {len(folded)} messages folded into the summary ==")
+
+        except Exception as e:
+            print(f"== Failed to compact chat session {session_id}: {e} ==")
+
+    async def stop(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+        if self.tasks:
+            await asyncio.gather(*self.tasks.values(), return_exceptions = True)
+
+
+async def summarize(
+    genai_client,
+    summary: str,
+    messages: List[dict]
+) -> str:
+    """Extend the running summary with the given messages, bounded to CHAT_SUMMARY_TOKEN_BUDGET"""
+    words = int(config.CHAT_SUMMARY_TOKEN_BUDGET * 0.75)
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    response = await genai_client.aio.models.generate_content(
+        model = SUMMARY_MODEL,
+        contents = f"""
+        Summary of the conversation so far:
+        {summary or "(empty)"}
+
+        New messages:
+        {transcript}
+        """,
+        config = {
+            "system_instruction": (
+                "You maintain the running summary of a conversation between a student and a study bot. "
+                "Rewrite the summary so it also covers the new messages: the topics asked about, facts the "
+                f"student shared and the key points of the answers. At most {words} words, plain text."
+            )
+        }
+    )
+
+    record_llm_usage("summary", response.usage_metadata)
+    return truncate_to_tokens((response.text or "").strip(), config.CHAT_SUMMARY_TOKEN_BUDGET)
+
+
+session_compactor = SessionCompactor()
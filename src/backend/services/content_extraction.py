@@ -1,8 +1,17 @@
+from collections import deque
+from dataclasses import dataclass
 from docx import Document
+from typing import AsyncIterator, List
 import PyPDF2
-import io
+import asyncio
+import os
+import tempfile
+import time
 
+from config import config
 from services.ai_init import get_genai_client
+from services.executor import run_cpu_bound, remove_file
+from services.metrics import record_llm_usage, timed_stream, EXTRACTION_SHARD_SECONDS, EXTRACTION_SHARD_RETRIES
 
 #raw string -> process
 def preProcessDocument(rawContent: str) -> str:
@@ -23,6 +32,65 @@ class FileProcessingError(Exception):
     pass
 
 
+@dataclass
+class PageText:
+    """Extracted text of the PDF pages page_start..page_end (1-based, inclusive)"""
+    text: str
+    page_start: int
+    page_end: int
+
+
+# ---- CPU-bound parsing - module level functions so they can run in the process pool ----
+
+PDF_PAGES_PER_TASK = 8
+
+def pdf_page_count(path: str) -> int:
+    return len(PyPDF2.PdfReader(path).pages)
+
+def extract_pdf_pages(
+    path: str,
+    start: int,
+    end: int
+) -> List[str]:
+    """Cleaned text of the pages [start, end)"""
+    document = PyPDF2.PdfReader(path)
+    return [
+        preProcessDocument(document.pages[i].extract_text())
+        for i in range(start, end)
+    ]
+
+def write_pdf_pages(
+    path: str,
+    start: int,
+    end: int
+) -> str:
+    """Copy the pages [start, end) into a temp PDF next to `path`, returns its path"""
+    document = PyPDF2.PdfReader(path)
+    writer = PyPDF2.PdfWriter()
+    for i in range(start, end):
+        writer.add_page(document.pages[i])
+
+    with tempfile.NamedTemporaryFile(dir = os.path.dirname(path) or None, suffix = ".pdf", delete = False) as f:
+        writer.write(f)
+        return f.name
+
+def extract_docx_text(path: str) -> str:
+    doc_file = Document(path)
+
+    full_text = []
+    # paragraph content
+    for paragraph in doc_file.paragraphs:
+        full_text.append(paragraph.text + '\n')
+
+    # table content
+    for table in doc_file.tables:
+        for row in table.rows:
+            row_text = [cell.text for cell in row.cells]
+            full_text.append("\t".join(row_text))
+
+    return preProcessDocument(''.join(full_text))
+
+
 class getFileContents:
     def __init__(self):
         self.mime_type_dict = {
@@ -57,65 +125,94 @@ class getFileContents:
         - Do not omit or summarize; include everything, even if approximate (e.g., estimated words in handwritten text).  
         """
 
-    async def basic_pdf(
+    async def basic_docx(
         self,
-        file_content: bytes,
+        path: str,
         # file_name: str
     ) -> str:
-        """Extract text content from PDF using library"""
+        """Extract text content from the spooled DOCX using library (parsed in the process pool)"""
         try:
-            pdf_file = io.BytesIO(file_content)
-            document = PyPDF2.PdfReader(pdf_file)
+            return await run_cpu_bound(extract_docx_text, path)
 
-            docContents = ''
-            for page in document.pages:
-                docContents += page.extract_text()
-            
-            finalContents = preProcessDocument(docContents)
-            return finalContents
+        except Exception as e:
+            print(f'Error Processing the DOCX (basic): {e}')
+            raise FileProcessingError(
+                f'Error Processing the DOCX (basic): {e}'
+            ) from e
+        
+
+    # ---- streaming variants - yield the text piece by piece instead of one big string ----
+
+    async def iter_pdf(
+        self,
+        path: str
+    ) -> AsyncIterator[str]:
+        """Yield the cleaned text of the spooled PDF page by page - page ranges are parsed in the process pool"""
+        pending = None
+        try:
+            page_count = await run_cpu_bound(pdf_page_count, path)
+            ranges = [
+                (start, min(start + PDF_PAGES_PER_TASK, page_count))
+                for start in range(0, page_count, PDF_PAGES_PER_TASK)
+            ]
+
+            # parse the next range while the current one is consumed
+            for i, (start, end) in enumerate(ranges):
+                current = pending or asyncio.ensure_future(run_cpu_bound(extract_pdf_pages, path, start, end))
+                pending = None
+                if i + 1 < len(ranges):
+                    pending = asyncio.ensure_future(run_cpu_bound(extract_pdf_pages, path, *ranges[i + 1]))
+
+                # a page break is a chunking boundary
+                for page_text in await current:
+                    yield page_text + "\n"
 
         except Exception as e:
             print(f'Error Processing the PDF (basic): {e}')
             raise FileProcessingError(
                 f'Error Processing the PDF (basic): {e}'
             ) from e
+        finally:
+            if pending is not None:
+                pending.cancel()
 
 
-    async def using_llm(
+    async def iter_using_llm(
         self,
-        file_content: bytes,
-        # file_name: str,
+        path: str,
         content_type: str
-    ) -> str:
-        """Extract text content from PDF using Gemini (LLM)"""
+    ) -> AsyncIterator[str]:
+        """Stream the Gemini (LLM) extraction - text is yielded as the model produces it"""
         try:
             genai_client = get_genai_client()
-            pdf_file = io.BytesIO(file_content)
 
-            # upload the file
-            mime_type = self.mime_type_dict[content_type]
             upload_file = await genai_client.aio.files.upload(
-                file = pdf_file,
+                file = path,
                 config = dict (
-                    mime_type = mime_type
+                    mime_type = self.mime_type_dict[content_type]
                 )
             )
 
-            prompt = self.upload_file_prompt
-            response = await genai_client.aio.models.generate_content(
+            started = time.perf_counter()
+            response = await genai_client.aio.models.generate_content_stream(
                 model = "gemini-2.0-flash",
                 contents = [upload_file],
                 config = {
-                    'system_instruction': prompt
+                    'system_instruction': self.upload_file_prompt
                 }
             )
 
-            print("\nLLM file processing input tokens: ", response.usage_metadata.prompt_token_count)
-            print("LLM file processing output tokens: ", response.usage_metadata.candidates_token_count, "\n")
-
-            estimated_tokens = response.usage_metadata.prompt_token_count + response.usage_metadata.candidates_token_count
+            usage_metadata = None
+            async for res in timed_stream(response, "extraction", started):
+                if res.usage_metadata:
+                    usage_metadata = res.usage_metadata
+                if res.text:
+                    yield res.text
 
-            return response.text
+            if usage_metadata:
+                print("\nLLM file processing input tokens: ", usage_metadata.prompt_token_count)
+                print("LLM file processing output tokens: ", usage_metadata.candidates_token_count, "\n")
+                record_llm_usage("extraction", usage_metadata)
 
         except Exception as e:
             print(f'Error Processing the PDF (advanced): {e}')
@@ -123,37 +220,107 @@ class getFileContents:
                 f'Error Processing the PDF (advanced): {e}'
             ) from e
 
-        
-    async def basic_docx(
+
+    async def extract_pdf_shard(
         self,
-        file_content: bytes,
-        # file_name: str
-    ) -> str:
-        """Extract text content from DOCX using library"""
-        
+        path: str,
+        start: int,
+        end: int,
+        whole_file: bool
+    ) -> PageText:
+        """
+        Gemini extraction of the pages [start, end) - the pages are copied into their own PDF
+        (unless they are the whole file) and only this shard is retried when a call fails
+        """
+        genai_client = get_genai_client()
+        started = time.perf_counter()
+        shard_path = path if whole_file else await run_cpu_bound(write_pdf_pages, path, start, end)
         try:
-            file = io.BytesIO(file_content)
-            doc_file = Document(file)
-
-            full_text = ''
-            # paragraph content
-            for paragraph in doc_file.paragraphs:
-                full_text = full_text + paragraph.text + '\n'
-            
-            # table content
-            for table in doc_file.tables:
-                for row in table.rows:
-                    row_text = [cell.text for cell in row.cells]
-                    full_text = full_text + ("\t".join(row_text))
-
-            finalContents = preProcessDocument(full_text)
-            return finalContents
+            for attempt in range(config.PDF_SHARD_RETRIES + 1):
+                try:
+                    upload_file = await genai_client.aio.files.upload(
+                        file = shard_path,
+                        config = dict (
+                            mime_type = self.mime_type_dict["pdf"]
+                        )
+                    )
+                    response = await genai_client.aio.models.generate_content(
+                        model = "gemini-2.0-flash",
+                        contents = [upload_file],
+                        config = {
+                            'system_instruction': self.upload_file_prompt
+                        }
+                    )
+                    record_llm_usage("extraction", response.usage_metadata)
+                    return PageText(response.text or "", start + 1, end)
+
+                except Exception as e:
+                    if attempt == config.PDF_SHARD_RETRIES:
+                        raise FileProcessingError(
+                            f'Error Processing the PDF pages {start + 1}-{end} (advanced): {e}'
+                        ) from e
+                    print(f"== Extraction of pages {start + 1}-{end} failed ({e}), retrying ==")
+                    EXTRACTION_SHARD_RETRIES.inc()
+                    await asyncio.sleep(min(2 ** attempt, 10))
+
+        finally:
+            if not whole_file:
+                remove_file(shard_path)
+            EXTRACTION_SHARD_SECONDS.observe(time.perf_counter() - started)
+
 
+    async def iter_using_llm_sharded(
+        self,
+        path: str
+    ) -> AsyncIterator[PageText]:
+        """
+        Gemini extraction of the PDF split into PDF_SHARD_PAGES page ranges - up to PDF_SHARD_CONCURRENCY
+        shards are extracted at once, the text is yielded in page order as the ranges complete, so long
+        documents neither hit the output token limit nor lose all the work on one failed call
+        """
+        pending = deque()
+        try:
+            page_count = await run_cpu_bound(pdf_page_count, path)
+            shard_pages = max(1, config.PDF_SHARD_PAGES)
+            shards = deque(
+                (start, min(start + shard_pages, page_count))
+                for start in range(0, page_count, shard_pages)
+            )
+            whole_file = len(shards) == 1
+            fan_out = asyncio.Semaphore(max(1, config.PDF_SHARD_CONCURRENCY))
+
+            async def extract(start: int, end: int) -> PageText:
+                async with fan_out:
+                    return await self.extract_pdf_shard(path, start, end, whole_file)
+
+            # finished shards wait for the ones before them - at most twice the fan-out is held
+            window = 2 * max(1, config.PDF_SHARD_CONCURRENCY)
+            while shards or pending:
+                while shards and len(pending) < window:
+                    pending.append(asyncio.ensure_future(extract(*shards.popleft())))
+                yield await pending.popleft()
+
+        except FileProcessingError as e:
+            print(f'Error Processing the PDF (advanced): {e}')
+            raise
         except Exception as e:
-            print(f'Error Processing the DOCX (basic): {e}')
+            print(f'Error Processing the PDF (advanced): {e}')
             raise FileProcessingError(
-                f'Error Processing the DOCX (basic): {e}'
+                f'Error Processing the PDF (advanced): {e}'
             ) from e
+        finally:
+            # cancelled shards remove their page files on the way out
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions = True)
+
+
+    async def iter_docx(
+        self,
+        path: str
+    ) -> AsyncIterator[str]:
+        """Yield the cleaned DOCX text - python-docx loads the whole document, so it comes in one piece"""
+        yield await self.basic_docx(path)
         
 
 file_parser = getFileContents()
@@ -1,8 +1,21 @@
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from typing import List
+from collections import deque
+from functools import lru_cache
+from typing import List, Tuple
+import asyncio
+import re
+import time
+import zlib
 
 from google.genai import types
+from config import config
 from services.ai_init import get_genai_client
+from services.embedding_cache import embedding_cache, embedding_key
+from services.executor import run_cpu_bound
+from services.metrics import (
+    CHUNKING_SECONDS, EMBEDDING_SECONDS_BULK, EMBEDDING_SECONDS_INTERACTIVE, EMBEDDING_REQUESTS_IN_FLIGHT,
+    EMBEDDING_TEXTS_API, EMBEDDING_TEXTS_CACHED
+)
 
 def getChunks(
     content: str, 
@@ -26,27 +39,409 @@ def getChunks(
         return []
     
 
-async def generateEmbeddings(chunks: List[str]) -> List[List[float]]:
-    """Find embeddings for all the text chunks"""
+@lru_cache(maxsize = 8)
+def _splitter(
+    chunkSize: int,
+    chunkOverlap: int
+) -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size = chunkSize,
+        chunk_overlap = chunkOverlap,
+    )
+
+
+def splitText(
+    content: str,
+    chunkSize: int,
+    chunkOverlap: int
+) -> List[str]:
+    """Module level split - runs in the process pool"""
+    return _splitter(chunkSize, chunkOverlap).split_text(content)
+
+
+async def runSplit(func, *args):
+    """Run a chunking function in the process pool, timed"""
+    started = time.perf_counter()
     try:
-        print("== generate embedding called ==")
-        genai_client = get_genai_client()
-        
-        result = await genai_client.aio.models.embed_content(
-            model = "text-embedding-004",
-            contents = chunks,
-            config = types.EmbedContentConfig(
-                task_type = "SEMANTIC_SIMILARITY",
+        return await run_cpu_bound(func, *args)
+    finally:
+        CHUNKING_SECONDS.observe(time.perf_counter() - started)
+
+
+class ChunkStream:
+    """
+    Incremental version of getChunks - text is fed piece by piece and chunks are
+    emitted as soon as they are final, so the whole document is never held in memory.
+    The splitting itself runs in the process pool.
+    """
+
+    def __init__(
+        self,
+        chunkSize: int = 800,
+        chunkOverlap: int = 80
+    ):
+        self.chunkSize = chunkSize
+        self.chunkOverlap = chunkOverlap
+        # split only once the buffer holds several chunks worth of text
+        self.window = chunkSize * 8
+        self.buffer = ""
+
+    async def feed(self, text: str) -> List[str]:
+        """Add text, return the chunks that can no longer change"""
+        self.buffer += text
+        if len(self.buffer) < self.window:
+            return []
+
+        chunks = await runSplit(splitText, self.buffer, self.chunkSize, self.chunkOverlap)
+        if len(chunks) < 2:
+            return []
+
+        # the last chunk may still grow with the next piece of text - keep it buffered
+        self.buffer = chunks[-1]
+        return chunks[:-1]
+
+    async def flush(self) -> List[str]:
+        """Return the remaining chunks at the end of the document"""
+        chunks = []
+        if self.buffer:
+            chunks = await runSplit(splitText, self.buffer, self.chunkSize, self.chunkOverlap)
+        self.buffer = ""
+        return chunks
+
+
+# units for content defined chunking - sentence ends (preProcessDocument may glue sentences
+# together without a space) and line breaks
+UNIT_SEPARATOR = re.compile(r"(?<=[.!?])\s+|(?<=[a-z][.!?])(?=[A-Z])|\n+")
+WORD = re.compile(r"\S+")
+
+
+def stableChunks(
+    text: str,
+    minSize: int,
+    maxSize: int,
+    divisor: int,
+    final: bool
+) -> Tuple[List[str], str]:
+    """
+    Content defined chunking - a chunk ends after a sentence whose hash hits the divisor (once the
+    chunk is at least minSize long) or before it would exceed maxSize. Sentences longer than a chunk
+    are cut the same way on words. Boundaries depend only on the nearby text, so an edit only changes
+    the chunks around it. Module level, runs in the process pool.
+    Returns the finished chunks and the text still waiting for a boundary.
+    """
+    spans = []
+    pos = 0
+    for separator in UNIT_SEPARATOR.finditer(text):
+        if separator.start() > pos:
+            spans.append((pos, separator.start()))
+        pos = separator.end()
+
+    # the trailing unit may continue in the next piece of text - it is only chunked once complete,
+    # so the boundaries never depend on where the stream was cut
+    if final:
+        spans.append((pos, len(text)))
+        pos = len(text)
+
+    chunks = []
+    current = []
+    size = 0
+    start = None # offset of the first unit of the current chunk
+
+    def cut():
+        nonlocal current, size, start
+        if current:
+            chunks.append(" ".join(current))
+        current, size, start = [], 0, None
+
+    def add(unit: str, offset: int, boundary: bool):
+        nonlocal size, start
+        if current and size + len(unit) + 1 > maxSize:
+            cut()
+        if start is None:
+            start = offset
+        current.append(unit)
+        size += len(unit) + 1
+        if size >= minSize and boundary:
+            cut()
+
+    for unit_start, unit_end in spans:
+        unit = text[unit_start:unit_end].strip()
+        if not unit:
+            continue
+
+        if len(unit) <= maxSize:
+            offset = unit_start + text[unit_start:unit_end].index(unit[0])
+            add(unit, offset, zlib.crc32(unit.encode("utf-8")) % divisor == 0)
+            continue
+
+        # a unit longer than a chunk - same scheme on words, a word boundary is rarer than a sentence one
+        cut()
+        for word in WORD.finditer(text, unit_start, unit_end):
+            add(word.group(), word.start(), zlib.crc32(word.group().encode("utf-8")) % (divisor * 16) == 0)
+        cut()
+
+    if final:
+        cut()
+        return chunks, ""
+
+    remainder = text[start:] if start is not None else text[pos:]
+    return chunks, remainder
+
+
+class StableChunkStream:
+    """Incremental content defined chunking (see stableChunks) - same interface as ChunkStream"""
+
+    def __init__(
+        self,
+        minSize: int = 400,
+        maxSize: int = 1200,
+        divisor: int = 4
+    ):
+        self.minSize = minSize
+        self.maxSize = maxSize
+        self.divisor = divisor
+        self.window = maxSize * 8
+        self.buffer = ""
+
+    async def feed(self, text: str) -> List[str]:
+        self.buffer += text
+        if len(self.buffer) < self.window:
+            return []
+
+        chunks, self.buffer = await runSplit(
+            stableChunks, self.buffer, self.minSize, self.maxSize, self.divisor, False
+        )
+        return chunks
+
+    async def flush(self) -> List[str]:
+        chunks = []
+        if self.buffer:
+            chunks, _ = await runSplit(
+                stableChunks, self.buffer, self.minSize, self.maxSize, self.divisor, True
             )
+        self.buffer = ""
+        return chunks
+
+
+def getChunkStream():
+    """Chunker used by the ingestion pipeline (CHUNKER setting)"""
+    if config.CHUNKER == "recursive":
+        return ChunkStream()
+    return StableChunkStream()
+
+
+EMBEDDING_MODEL = "text-embedding-004"
+EMBEDDING_TASK_TYPE = "SEMANTIC_SIMILARITY"
+EMBEDDING_BATCH_SIZE = 100 # max contents per embed_content request
+
+
+async def embedBatch(chunks: List[str]) -> List[List[float]]:
+    """Single embed_content call for a batch of texts"""
+    genai_client = get_genai_client()
+
+    result = await genai_client.aio.models.embed_content(
+        model = EMBEDDING_MODEL,
+        contents = chunks,
+        config = types.EmbedContentConfig(
+            task_type = EMBEDDING_TASK_TYPE,
         )
-        
-        # extract the embeddings
-        embeddings = []
-        for em in result.embeddings:
-            embeddings.append(em.values)
+    )
+
+    # extract the embeddings
+    embeddings = []
+    for em in result.embeddings:
+        embeddings.append(em.values)
+
+    return embeddings
+
+
+PRIORITY_INTERACTIVE = 0 # chat queries
+PRIORITY_BULK = 1 # ingestion batches
+
+
+class EmbeddingScheduler:
+    """
+    Shared scheduler for all embed_content calls.
+    - concurrent interactive (query) embeddings are coalesced into micro-batches over a short window
+    - the total number of in-flight API calls is capped
+    - interactive work is always dispatched first, and bulk work never takes the last free slot
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        batch_window: float,
+        max_batch_size: int = EMBEDDING_BATCH_SIZE
+    ):
+        self.max_in_flight = max(1, max_in_flight)
+        self.bulk_limit = max(1, self.max_in_flight - 1)
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+
+        self.loop = None
+        self.tasks = set() # embed_content calls in flight
+        self.calls = 0
+        self.items = 0
+
+    def _start(self):
+        """Bind the scheduler to the running loop (lazily, on first use)"""
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.pending = (deque(), deque()) # interactive, bulk
+            self.changed = asyncio.Event()
+            self.in_flight = 0
+            self.bulk_in_flight = 0
+            self.task = loop.create_task(self._run())
+
+    async def embed(
+        self,
+        texts: List[str],
+        priority: int = PRIORITY_BULK
+    ) -> List[List[float]]:
+        self._start()
+        futures = []
+        for text in texts:
+            future = self.loop.create_future()
+            self.pending[priority].append((text, future))
+            futures.append(future)
+
+        self.changed.set()
+        return list(await asyncio.gather(*futures))
+
+    def _take(self, queue: deque, limit: int) -> list:
+        items = []
+        while queue and len(items) < limit:
+            text, future = queue.popleft()
+            if not future.done(): # caller went away
+                items.append((text, future))
+        return items
+
+    async def _run(self):
+        interactive, bulk = self.pending
+        while True:
+            self.changed.clear()
+
+            if interactive and self.in_flight < self.max_in_flight:
+                # give concurrent queries a moment to join the same request
+                if len(interactive) < self.max_batch_size:
+                    await asyncio.sleep(self.batch_window)
+                items = self._take(interactive, self.max_batch_size)
+                # top the request up with bulk work, it costs nothing extra
+                items += self._take(bulk, self.max_batch_size - len(items))
+                if items:
+                    self._dispatch(items, is_bulk = False)
+                continue
+
+            if bulk and self.in_flight < self.max_in_flight and self.bulk_in_flight < self.bulk_limit:
+                items = self._take(bulk, self.max_batch_size)
+                if items:
+                    self._dispatch(items, is_bulk = True)
+                continue
+
+            await self.changed.wait()
+
+    def _dispatch(
+        self,
+        items: list,
+        is_bulk: bool
+    ):
+        self.in_flight += 1
+        self.bulk_in_flight += is_bulk
+        self.calls += 1
+        self.items += len(items)
+        task = self.loop.create_task(self._call(items, is_bulk))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _call(
+        self,
+        items: list,
+        is_bulk: bool
+    ):
+        started = time.perf_counter()
+        try:
+            embeddings = await embedBatch([text for text, _ in items])
+            (EMBEDDING_SECONDS_BULK if is_bulk else EMBEDDING_SECONDS_INTERACTIVE).observe(time.perf_counter() - started)
+            if len(embeddings) != len(items):
+                raise Exception("Size mismatch between texts and embeddings.")
+            for (_, future), embedding in zip(items, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
+        except asyncio.CancelledError:
+            for _, future in items:
+                future.cancel()
+            raise
+
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+
+        finally:
+            self.in_flight -= 1
+            self.bulk_in_flight -= is_bulk
+            self.changed.set()
+
+    async def stop(self):
+        """Cancel the dispatch loop and the calls in flight - callers still waiting get CancelledError"""
+        if self.loop is None:
+            return
+
+        tasks = [self.task, *self.tasks]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+        for queue in self.pending:
+            while queue:
+                _, future = queue.popleft()
+                future.cancel()
+        self.loop = None
+
+    def stats(self) -> dict:
+        return {
+            "api_calls": self.calls,
+            "texts_embedded": self.items,
+            "avg_batch_size": round(self.items / self.calls, 2) if self.calls else 0.0,
+            "in_flight": self.in_flight if self.loop else 0,
+        }
+
+
+embedding_scheduler = EmbeddingScheduler(
+    max_in_flight = config.EMBED_MAX_IN_FLIGHT,
+    batch_window = config.EMBED_BATCH_WINDOW_MS / 1000
+)
+EMBEDDING_REQUESTS_IN_FLIGHT.set_function(lambda: embedding_scheduler.in_flight if embedding_scheduler.loop else 0)
+
+
+async def generateEmbeddings(
+    chunks: List[str],
+    priority: int = PRIORITY_BULK
+) -> List[List[float]]:
+    """Find embeddings for all the text chunks - cached vectors are reused, only misses hit the API"""
+    try:
+        print("== generate embedding called ==")
+        keys = [embedding_key(EMBEDDING_MODEL, EMBEDDING_TASK_TYPE, chunk) for chunk in chunks]
+        cached = await asyncio.to_thread(embedding_cache.get_many, keys)
+
+        # unique texts that are not cached yet
+        missing = {}
+        for key, chunk in zip(keys, chunks):
+            if key not in cached and key not in missing:
+                missing[key] = chunk
+
+        EMBEDDING_TEXTS_CACHED.inc(len(keys) - len(missing))
+        if missing:
+            EMBEDDING_TEXTS_API.inc(len(missing))
+            embeddings = await embedding_scheduler.embed(list(missing.values()), priority)
+            fresh = dict(zip(missing.keys(), embeddings))
+
+            await asyncio.to_thread(embedding_cache.put_many, fresh)
+            cached.update(fresh)
 
-        return embeddings
+        return [cached[key] for key in keys]
     
     except Exception as e:
         print(f"== Error while generating embeddings : {e} ==")
-        raise Exception(f"Error while generating embeddings : {e}")
\ No newline at end of file
+        raise Exception(f"Error while generating embeddings : {e}")
@@ -0,0 +1,240 @@
+from typing import List, Optional, Tuple
+import math
+import re
+
+import numpy as np
+
+CHARS_PER_TOKEN = 4 # rough estimate for English text, no tokenizer round trip per request
+MIN_OVERLAP_CHARS = 20 # shorter suffix / prefix matches are coincidence, not chunk overlap
+MAX_OVERLAP_CHARS = 400
+MIN_PARTIAL_TOKENS = 64 # a block that does not fit is cut only if at least this much of it fits
+DUPLICATE_SIMILARITY = 0.97 # candidates this close to a selected one are dropped outright
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def mmr_select(
+    relevance: np.ndarray,
+    vectors: np.ndarray,
+    k: int,
+    lambda_mult: float
+) -> List[int]:
+    """
+    Maximal Marginal Relevance - greedily pick the candidate maximising
+    lambda * relevance - (1 - lambda) * (max cosine similarity to the already picked ones).
+    Returns the indices of the picked candidates in pick order. Rows of zeros (no vector) are
+    never considered redundant.
+    """
+    count = len(relevance)
+    if count == 0:
+        return []
+
+    norms = np.linalg.norm(vectors, axis = 1, keepdims = True)
+    vectors = np.divide(vectors, norms, out = np.zeros_like(vectors), where = norms > 0)
+
+    max_similarity = np.zeros(count, dtype = np.float32)
+    available = np.ones(count, dtype = bool)
+    picked = []
+    while len(picked) < min(k, count):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        if not np.isfinite(scores[best]):
+            break
+
+        picked.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, vectors @ vectors[best])
+        available &= max_similarity < DUPLICATE_SIMILARITY
+
+    return picked
+
+
+def overlap_length(left: str, right: str) -> int:
+    """Length of the longest suffix of `left` that is a prefix of `right` (chunk overlap)"""
+    for size in range(min(len(left), len(right), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+
+    return 0
+
+
+def merge_adjacent(
+    chunks: List[dict],
+    knowledge_base_ids: Optional[List[str]] = None
+) -> List[dict]:
+    """
+    Merge picked chunks that are neighbours in the same file - same source and owner with consecutive
+    chunk_index, or an overlapping tail / head for chunks stored without an index. A vector shared by
+    identical chunks keeps the index (and source) of the knowledge base that owns it, so chunks only
+    merge with chunks of the same owner, and only owners among `knowledge_base_ids` when the query is
+    limited to some knowledge bases. The overlap is kept once. Chunks are {content, source, owner,
+    chunk_index, pages, rank}, blocks keep the best rank of their chunks and the pages they span.
+    """
+    blocks: List[dict] = []
+    for chunk in sorted(chunks, key = lambda chunk: (chunk["chunk_index"] is None, chunk["chunk_index"] or 0)):
+        block = {
+            "source": chunk["source"],
+            "owner": chunk.get("owner"),
+            "content": chunk["content"],
+            "first_index": chunk["chunk_index"],
+            "last_index": chunk["chunk_index"],
+            "pages": chunk.get("pages"),
+            "rank": chunk["rank"],
+            "chunks": 1
+        }
+
+        # join with a neighbour until none is left - a chunk can bridge two blocks
+        mergeable = knowledge_base_ids is None or block["owner"] is None or block["owner"] in knowledge_base_ids
+        merged = mergeable
+        while merged:
+            merged = False
+            for other in blocks:
+                if other["source"] != block["source"] or other["owner"] != block["owner"]:
+                    continue
+                if follows(other, block):
+                    left, right = other, block
+                elif follows(block, other):
+                    left, right = block, other
+                else:
+                    continue
+
+                overlap = overlap_length(left["content"], right["content"])
+                separator = "" if overlap or left["content"][-1:].isspace() or right["content"][:1].isspace() else " "
+                block = {
+                    "source": block["source"],
+                    "owner": block["owner"],
+                    "content": left["content"] + separator + right["content"][overlap:],
+                    "first_index": left["first_index"],
+                    "last_index": right["last_index"],
+                    "pages": span_pages(left["pages"], right["pages"]),
+                    "rank": min(left["rank"], right["rank"]),
+                    "chunks": left["chunks"] + right["chunks"]
+                }
+                blocks.remove(other)
+                merged = True
+                break
+        blocks.append(block)
+
+    blocks.sort(key = lambda block: block["rank"])
+    return blocks
+
+
+def follows(left: dict, right: dict) -> bool:
+    """Whether block `right` continues block `left` in the file"""
+    if left["last_index"] is not None and right["first_index"] is not None:
+        return right["first_index"] == left["last_index"] + 1
+
+    return overlap_length(left["content"], right["content"]) > 0
+
+
+def span_pages(left: Optional[tuple], right: Optional[tuple]) -> Optional[tuple]:
+    """Page range covering both (first, last) ranges"""
+    if left is None or right is None:
+        return left or right
+    return (min(left[0], right[0]), max(left[1], right[1]))
+
+
+def truncate_to_tokens(text: str, tokens: int) -> str:
+    """Cut the text to about `tokens`, at a sentence end (or word boundary) when there is one nearby"""
+    limit = tokens * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+
+    cut = text[:limit]
+    sentence_end = max((match.end() for match in re.finditer(r"[.!?]\s", cut)), default = 0)
+    if sentence_end > limit // 2:
+        return cut[:sentence_end].rstrip()
+
+    space = cut.rfind(" ")
+    return (cut[:space] if space > limit // 2 else cut).rstrip() + " ..."
+
+
+def pack_context(
+    blocks: List[dict],
+    token_budget: int
+) -> Tuple[str, int]:
+    """Label the blocks with their source and pack them (best first) into the token budget"""
+    parts = []
+    used = 0
+    for block in blocks:
+        pages = block.get("pages")
+        if pages is None:
+            location = ""
+        elif pages[0] == pages[1]:
+            location = f", page {pages[0]}"
+        else:
+            location = f", pages {pages[0]}-{pages[1]}"
+        label = f"[{len(parts) + 1}] Source: {block['source']}{location}\n"
+        remaining = token_budget - used - estimate_tokens(label)
+        if remaining <= 0:
+            break
+
+        content = block["content"]
+        if estimate_tokens(content) > remaining:
+            if remaining < MIN_PARTIAL_TOKENS:
+                # a smaller block further down may still fit
+                continue
+            content = truncate_to_tokens(content, remaining)
+
+        part = label + content.strip() + "\n"
+        parts.append(part)
+        used += estimate_tokens(part)
+
+    return "\n".join(parts), used
+
+
+def assemble_context(
+    matches: List[dict],
+    vectors: Optional[np.ndarray],
+    max_chunks: int,
+    token_budget: int,
+    lambda_mult: float,
+    knowledge_base_ids: Optional[List[str]] = None
+) -> Tuple[str, dict]:
+    """
+    Turn ranked matches (best first, with metadata) into the prompt context: MMR picks up to
+    max_chunks diverse matches, neighbouring chunks of a file are merged and the result is packed
+    into the token budget with source labels. `knowledge_base_ids` are the knowledge bases the query
+    is limited to (None for the whole namespace). Returns the context and its stats.
+    """
+    if not matches:
+        return "", {"candidates": 0, "selected": 0, "blocks": 0, "merged": 0, "tokens": 0, "input_tokens": 0, "vector_ids": []}
+
+    scores = np.array([match.get("score") or 0.0 for match in matches], dtype = np.float32)
+    relevance = scores / scores.max() if scores.max() > 0 else np.ones(len(matches), dtype = np.float32)
+    if vectors is None:
+        picked = list(range(min(max_chunks, len(matches))))
+    else:
+        picked = mmr_select(relevance, vectors, max_chunks, lambda_mult)
+
+    chunks = []
+    for rank, index in enumerate(picked):
+        metadata = matches[index].get("metadata") or {}
+        chunks.append({
+            "content": metadata.get("content", ""),
+            "source": metadata.get("file_reference", "unknown"),
+            "owner": metadata.get("knowledge_base_id"),
+            # metadata numbers come back from Pinecone as floats
+            "chunk_index": int(metadata["chunk_index"]) if metadata.get("chunk_index") is not None else None,
+            "pages": (
+                (int(metadata["page_start"]), int(metadata["page_end"]))
+                if metadata.get("page_start") is not None else None
+            ),
+            "rank": rank
+        })
+
+    blocks = merge_adjacent(chunks, knowledge_base_ids)
+    context, tokens = pack_context(blocks, token_budget)
+
+    return context, {
+        "candidates": len(matches),
+        "selected": len(picked),
+        "blocks": len(blocks),
+        "merged": len(picked) - len(blocks),
+        "tokens": tokens,
+        "input_tokens": sum(estimate_tokens(chunk["content"]) for chunk in chunks),
+        "vector_ids": [matches[index]["id"] for index in picked],
+    }
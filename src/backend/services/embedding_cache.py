@@ -0,0 +1,142 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Iterable
+
+from config import config
+
+
+def embedding_key(model: str, task_type: str, text: str) -> str:
+    """Cache key - hash of (model, task_type, text)"""
+    digest = hashlib.sha256()
+    for part in (model, task_type, text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\x00")
+
+    return digest.hexdigest()
+
+
+class EmbeddingCache:
+    """Two tier embedding cache - in-process LRU in front of a SQLite store"""
+
+    def __init__(
+        self,
+        max_items: int,
+        db_path: str
+    ):
+        self.max_items = max_items
+        self.db_path = db_path
+
+        self._lru: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        """Open the on-disk tier lazily (first use)"""
+        if self._db is None and self.db_path:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok = True)
+
+            self._db = sqlite3.connect(self.db_path, check_same_thread = False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+        return self._db
+
+    def _remember(self, key: str, vector: List[float]):
+        """Insert into the LRU tier, evicting the oldest entries"""
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_items:
+            self._lru.popitem(last = False)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        """Return the cached vectors for the given keys (misses are left out)"""
+        found = {}
+        with self._lock:
+            pending = []
+            for key in keys:
+                if key in found:
+                    continue
+                vector = self._lru.get(key)
+                if vector is not None:
+                    self._lru.move_to_end(key)
+                    found[key] = vector
+                    self.memory_hits += 1
+                else:
+                    pending.append(key)
+
+            db = self._connect()
+            if pending and db is not None:
+                # sqlite has a limit on bound parameters - query in slices
+                for i in range(0, len(pending), 500):
+                    batch = pending[i:i + 500]
+                    rows = db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                        batch
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = array("f")
+                        vector.frombytes(blob)
+                        vector = vector.tolist()
+                        found[key] = vector
+                        self._remember(key, vector)
+                        self.disk_hits += 1
+
+            self.misses += sum(1 for key in pending if key not in found)
+
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        """Store freshly computed vectors in both tiers (float32 on disk)"""
+        if not items:
+            return
+
+        with self._lock:
+            for key, vector in items.items():
+                self._remember(key, vector)
+
+            db = self._connect()
+            if db is not None:
+                db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                    [(key, array("f", vector).tobytes()) for key, vector in items.items()]
+                )
+                db.commit()
+
+    def stats(self) -> dict:
+        """Hit and miss counters"""
+        hits = self.memory_hits + self.disk_hits
+        total = hits + self.misses
+        return {
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "memory_items": len(self._lru),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+embedding_cache = EmbeddingCache(
+    max_items = config.EMBEDDING_CACHE_SIZE,
+    db_path = config.EMBEDDING_CACHE_PATH
+)
@@ -0,0 +1,43 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+import asyncio
+import os
+
+from config import config
+
+process_pool: ProcessPoolExecutor = None
+
+async def start_process_pool():
+    """Start the process pool for the CPU-bound stages (parsing, cleaning, chunking)"""
+    global process_pool
+    try:
+        if config.PROCESS_POOL_WORKERS > 0:
+            process_pool = ProcessPoolExecutor(max_workers = config.PROCESS_POOL_WORKERS)
+
+    except Exception as e:
+        print(f"== Failed to start process pool: {e} ==")
+        raise RuntimeError(f"Failed to start process pool: {e}")
+
+async def stop_process_pool():
+    """Shut the process pool down"""
+    global process_pool
+    if process_pool is not None:
+        process_pool.shutdown(wait = False, cancel_futures = True)
+        process_pool = None
+
+async def run_cpu_bound(func: Callable, *args):
+    """
+    Run a CPU-bound function off the event loop - in the process pool when it is
+    running, in a worker thread otherwise. `func` must be a module level function.
+    """
+    if process_pool is None:
+        return await asyncio.to_thread(func, *args)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(process_pool, func, *args)
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
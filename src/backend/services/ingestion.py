@@ -0,0 +1,744 @@
+from datetime import datetime, timezone
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Optional, Tuple
+import asyncio
+import os
+import time
+import uuid
+
+from config import config
+from services.content_extraction import file_parser, PageText
+from services.content_processing import getChunkStream, generateEmbeddings
+from services.ingestion_journal import IngestionJournal, open_journal
+from services.answer_cache import answer_cache
+from services.lexical_index import lexical_index
+from services.pinecone import vector_key
+from services.metrics import EXTRACTION_SECONDS, CHUNKS_PRODUCED, CHUNKS_DEDUPLICATED, CHUNKS_UNCHANGED, CHUNKS_EMBEDDED, CHUNKS_RESUMED
+from services.upsert_engine import upsert_engine, UpsertSession
+from services.vector_refs import (
+    content_hash, file_content_hash, acquire_vector_refs, acknowledge_vector_refs, pending_vector_refs,
+    release_knowledge_base_vectors
+)
+
+# stage callback - called with the stage name and optional progress counters
+ProgressCallback = Callable[..., Awaitable[None]]
+
+# (first, last) page of an extracted segment, None when the parser does not track pages
+PageRange = Optional[Tuple[int, int]]
+
+SUPPORTED_EXTENSIONS = (".pdf", ".csv", ".docx")
+
+SEGMENT_SIZE = 16 * 1024 # characters of extracted text per stored / forwarded segment (content_size is in bytes)
+EMBED_BATCH_SIZE = 25 # chunks per embedding batch
+
+
+# error class - for the ingestion pipeline related errors
+class IngestionError(Exception):
+    pass
+
+
+def namespace_filter(namespace: Optional[str] = None) -> dict:
+    """Knowledge base records of a namespace - records stored before namespaces are in the default one"""
+    namespace = namespace or config.PINECONE_NAMESPACE
+    if namespace == config.PINECONE_NAMESPACE:
+        return {"namespace": {"$in": [namespace, None]}}
+    return {"namespace": namespace}
+
+
+async def _no_progress(stage = None, **counters):
+    pass
+
+
+async def iter_extracted_content(
+    path: str,
+    file_extension: str
+) -> AsyncIterator[Tuple[str, PageRange]]:
+    """
+    Parse the spooled upload into plain text, yielded segment by segment with its page range -
+    a segment never spans two page ranges
+    """
+    match file_extension:
+        case ".pdf" if config.PDF_PARSER == "basic":
+            parser = "pdf_basic"
+            pieces = file_parser.iter_pdf(path)
+        case ".pdf" if config.PDF_PARSER == "llm_sharded":
+            parser = "pdf_llm_sharded"
+            pieces = file_parser.iter_using_llm_sharded(path)
+        case ".pdf":
+            parser = "pdf_llm"
+            pieces = file_parser.iter_using_llm(path, "pdf")
+        case ".csv":
+            parser = "csv_llm"
+            pieces = file_parser.iter_using_llm(path, "csv")
+        case ".docx":
+            parser = "docx"
+            pieces = file_parser.iter_docx(path)
+        case _:
+            raise IngestionError(
+                f"Unsupported file type '{file_extension}'. Only PDF, CSV, and DOCX are supported."
+            )
+
+    # coalesce the (possibly tiny) pieces into segments of about SEGMENT_SIZE characters
+    segment = []
+    segment_size = 0
+    pages = None
+    # only the time spent waiting on the parser counts as extraction, not the time downstream stages hold a segment
+    extraction_seconds = 0.0
+    while True:
+        started = time.perf_counter()
+        try:
+            piece = await anext(pieces)
+        except StopAsyncIteration:
+            break
+        finally:
+            extraction_seconds += time.perf_counter() - started
+
+        if isinstance(piece, PageText):
+            piece_pages = (piece.page_start, piece.page_end)
+            if piece_pages != pages and segment_size:
+                yield "".join(segment), pages
+                segment = []
+                segment_size = 0
+            pages, piece = piece_pages, piece.text
+
+        segment.append(piece)
+        segment_size += len(piece)
+        if segment_size >= SEGMENT_SIZE:
+            yield "".join(segment), pages
+            segment = []
+            segment_size = 0
+
+    if segment_size:
+        yield "".join(segment), pages
+
+    EXTRACTION_SECONDS.labels(parser).observe(extraction_seconds)
+
+
+class StageFile:
+    """One file feeding an EmbedUpsertStage - its counters, progress callback, journal and failure"""
+
+    def __init__(
+        self,
+        file_name: str,
+        progress: ProgressCallback,
+        journal: Optional[IngestionJournal] = None
+    ):
+        self.file_name = file_name
+        self.progress = progress
+        self.journal = journal
+        self.in_stage = 0 # chunks added and not yet handed to the upsert session (or dropped)
+        self.settled = asyncio.Event()
+        self.settled.set()
+        self.embedded = 0
+        self.upserted = 0
+        self.error: Optional[BaseException] = None
+        self.cancelled = False
+        self.started = time.perf_counter()
+
+
+class EmbedUpsertStage:
+    """
+    Embedding and upsert end of the ingestion pipeline, shared by one or more files. Fresh chunks
+    are packed into full embedding batches whichever file they come from, embedded by `workers`
+    concurrent tasks and upserted through one upsert session, so the files of a batch upload fill
+    the same embed_content and upsert requests. A failed embedding or upsert batch only fails the
+    files it had chunks of. Acknowledged upserts are recorded on the vector references.
+    """
+
+    def __init__(
+        self,
+        db,
+        workers: int,
+        batch_size: int,
+        namespace: Optional[str] = None
+    ):
+        self.db = db
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.namespace = namespace or config.PINECONE_NAMESPACE # every file of the stage is ingested into it
+        self.pending = [] # (file, chunk) waiting for a full batch
+        self.batch_queue: asyncio.Queue = asyncio.Queue(maxsize = config.INGEST_QUEUE_DEPTH)
+        self.upserts: UpsertSession = upsert_engine.session(
+            namespace = self.namespace,
+            on_upserted = self._on_upserted,
+            on_failed = self._on_failed
+        )
+        self.file_of = {} # vector id -> the files that sent it, until Pinecone acknowledged / rejected it
+        self.tasks = []
+        self.acknowledgements = set() # background vector_refs writes of the acknowledged upserts
+
+    async def start(self):
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions = True)
+        self.tasks = []
+        await self.upserts.cancel()
+        await asyncio.gather(*self.acknowledgements, return_exceptions = True)
+
+    def register(
+        self,
+        file_name: str,
+        progress: ProgressCallback,
+        journal: Optional[IngestionJournal] = None
+    ) -> StageFile:
+        return StageFile(file_name, progress, journal)
+
+    async def add(
+        self,
+        file: StageFile,
+        chunks: list
+    ):
+        """
+        Queue (vector_id, chunk, location, embedding, owner) items of a file - waits while the workers are behind.
+        `embedding` is the one journaled by an earlier run of the ingest, or None to compute it, `owner` the
+        knowledge base owning the vector reference.
+        """
+        if file.error is not None:
+            raise file.error
+        if not chunks:
+            return
+
+        file.in_stage += len(chunks)
+        file.settled.clear()
+        self.pending.extend((file, chunk) for chunk in chunks)
+        while len(self.pending) >= self.batch_size:
+            batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+            await self.batch_queue.put(batch)
+
+    async def finish(self, file: StageFile) -> dict:
+        """Wait until every chunk of the file is in Pinecone, returns its upsert stats"""
+        if any(owner is file for owner, _ in self.pending):
+            # the file has no more chunks coming - send the partial batch (with whatever other files added)
+            batch, self.pending = self.pending, []
+            await self.batch_queue.put(batch)
+
+        await file.settled.wait()
+        if file.error is None:
+            await self.upserts.flush()
+        await asyncio.gather(*self.acknowledgements, return_exceptions = True)
+        if file.error is not None:
+            raise file.error
+
+        elapsed = time.perf_counter() - file.started
+        return {
+            "vectors_upserted": file.upserted,
+            "upsert_batches": self.upserts.batches,
+            "upsert_seconds": round(elapsed, 3),
+            "vectors_per_second": round(file.upserted / elapsed, 1) if elapsed > 0 else 0.0
+        }
+
+    async def abort(self, file: StageFile):
+        """
+        Drop the chunks of a failed file that were not sent yet and wait for the ones in flight,
+        so discarding its partial ingest cannot race one of its upserts
+        """
+        file.cancelled = True
+        dropped = sum(1 for owner, _ in self.pending if owner is file)
+        self.pending = [(owner, chunk) for owner, chunk in self.pending if owner is not file]
+        self._settle(file, dropped)
+
+        await file.settled.wait()
+        try:
+            await self.upserts.flush()
+        except Exception:
+            pass
+
+    def _settle(
+        self,
+        file: StageFile,
+        count: int
+    ):
+        file.in_stage -= count
+        if file.in_stage <= 0:
+            file.settled.set()
+
+    def _on_upserted(self, batch: list):
+        # cached answers the new chunks would have changed are dropped once Pinecone has the chunks
+        answer_cache.invalidate_added([
+            (vector["id"], vector["metadata"]["content"], vector["values"]) for vector in batch
+        ])
+        # checkpoint the acknowledged chunks on their references - a retried ingest, or any other one sharing
+        # them, does not upsert them again. Written in the background, a reference left pending is only upserted again
+        task = asyncio.create_task(acknowledge_vector_refs(self.db, [vector["id"] for vector in batch], self.namespace))
+        self.acknowledgements.add(task)
+        task.add_done_callback(self.acknowledgements.discard)
+        for vector in batch:
+            for file in self.file_of.pop(vector["id"], []):
+                file.upserted += 1
+
+    def _on_failed(
+        self,
+        batch: list,
+        error: Exception
+    ):
+        # only the files with vectors in the rejected batch fail, the session goes on for the others
+        for vector in batch:
+            for file in self.file_of.pop(vector["id"], []):
+                if file.error is None:
+                    file.error = error
+
+    async def _worker(self):
+        while True:
+            batch = await self.batch_queue.get()
+            files = list(dict.fromkeys(file for file, _ in batch))
+            live = [(file, chunk) for file, chunk in batch if not file.cancelled and file.error is None]
+            try:
+                if live:
+                    await self._embed_and_upsert(live)
+            except Exception as e:
+                for file in dict.fromkeys(file for file, _ in live):
+                    if file.error is None:
+                        file.error = e
+            finally:
+                for file in files:
+                    self._settle(file, sum(1 for owner, _ in batch if owner is file))
+
+    async def _embed_and_upsert(self, batch: list):
+        files = list(dict.fromkeys(file for file, _ in batch))
+        for file in files:
+            await file.progress("embedding")
+        # chunks embedded by an earlier run of their ingest come with the journaled embedding
+        missing = [(file, item) for file, item in batch if item[3] is None]
+        computed = {}
+        if missing:
+            try:
+                embeddings = await generateEmbeddings([chunk for _, (_, chunk, _, _, _) in missing])
+            except Exception as e:
+                print(f"== Error generating embeddings: {e} ==")
+                raise IngestionError("Error occurred during embedding generation.") from e
+
+            if len(missing) != len(embeddings):
+                raise IngestionError("Size mismatch between chunks and embeddings.")
+
+            CHUNKS_EMBEDDED.inc(len(missing))
+            journaled = {}
+            for (file, (vector_id, _, _, _, _)), embedding in zip(missing, embeddings):
+                computed[vector_id] = embedding
+                if file.journal is not None:
+                    journaled.setdefault(file, []).append((vector_id, embedding))
+            for file, embeddings in journaled.items():
+                await file.journal.record_embeddings(embeddings)
+
+        vectors = []
+        for file, (vector_id, chunk, location, embedding, owner) in batch:
+            embedding = computed.get(vector_id, embedding)
+            file.embedded += 1
+            self.file_of.setdefault(vector_id, []).append(file)
+            vectors.append({
+                "id": vector_id,
+                "values": embedding,
+                "metadata": {
+                    "content": chunk,
+                    "file_reference": file.file_name,
+                    # lets the owner delete the vectors it owns with one filter request
+                    "knowledge_base_id": owner,
+                    **location,
+                },
+            })
+        for file in files:
+            await file.progress("upserting", chunks_embedded = file.embedded)
+
+        await self.upserts.add(vectors)
+        # the chunk text goes into the BM25 index too - a failed ingest releases (and unindexes) it again
+        await asyncio.to_thread(lexical_index.add, [
+            (vector["id"], vector["metadata"]["content"]) for vector in vectors
+        ], self.namespace)
+        for file in files:
+            await file.progress(vectors_upserted = file.upserted)
+
+
+async def discard_partial_ingest(
+    db,
+    knowledge_base_id: str,
+    pinecone_ids: List[str],
+    namespace: Optional[str] = None
+):
+    """Remove whatever a failed ingest already wrote (vector references, vectors and content segments)"""
+    try:
+        await release_knowledge_base_vectors(db, {
+            "namespace": namespace,
+            "pinecone_id_list": pinecone_ids,
+            "ref_counted": True
+        })
+        await db.knowledge_base_content.delete_many({"knowledge_base_id": knowledge_base_id})
+
+    except Exception as e:
+        print(f"== Error while discarding partial ingest {knowledge_base_id}: {e} ==")
+
+
+async def clone_knowledge_base(
+    db,
+    source: dict,
+    file_name: str
+) -> str:
+    """Identical file uploaded again - reuse the extracted content and vectors of the existing knowledge base"""
+    knowledge_base_id = str(uuid.uuid4())
+    pinecone_ids = source.get("pinecone_id_list") or []
+    namespace = source.get("namespace") or config.PINECONE_NAMESPACE
+
+    await acquire_vector_refs(db, pinecone_ids, knowledge_base_id, namespace)
+    try:
+        segments = []
+        async for segment in db.knowledge_base_content.find(
+            {"knowledge_base_id": source["knowledge_base_id"]},
+            {"_id": 0}
+        ).sort("seq", 1):
+            segment["knowledge_base_id"] = knowledge_base_id
+            segments.append(segment)
+            if len(segments) == 100:
+                await db.knowledge_base_content.insert_many(segments)
+                segments = []
+        if segments:
+            await db.knowledge_base_content.insert_many(segments)
+
+        await db.knowledge_base.insert_one({
+            "knowledge_base_id": knowledge_base_id,
+            "knowledge_base_name": file_name,
+            "file_hash": source["file_hash"],
+            "content_size": source.get("content_size", 0),
+            "chunk_count": source.get("chunk_count", len(pinecone_ids)),
+            "pinecone_id_list": pinecone_ids,
+            "ref_counted": True,
+            "namespace": namespace,
+            **({"vector_owners": source["vector_owners"]} if "vector_owners" in source else {}),
+            "created_at": datetime.now(timezone.utc)
+        })
+
+    except Exception:
+        await discard_partial_ingest(db, knowledge_base_id, pinecone_ids, namespace)
+        raise
+
+    return knowledge_base_id
+
+
+async def ingest_file(
+    db,
+    file_name: str,
+    path: str,
+    progress: ProgressCallback = _no_progress,
+    knowledge_base_id: Optional[str] = None,
+    file_hash: Optional[str] = None,
+    stage: Optional[EmbedUpsertStage] = None,
+    namespace: Optional[str] = None
+) -> str:
+    """
+    Run the ingestion pipeline for one file, returns the knowledge base id. `path` is the
+    spooled upload (the caller removes it), `file_hash` its sha256 if it was computed while spooling.
+    `stage` is an embedding / upsert stage shared with the other files of a batch (in the same
+    namespace), the file gets its own otherwise. `namespace` is the tenant / course namespace of
+    a new knowledge base, a new version goes into the namespace of the knowledge base.
+
+    extraction -> chunking -> embedding -> upsert run as concurrent stages connected by
+    bounded queues, so pages are embedded and upserted while later ones are still being
+    extracted and memory stays bounded by the queue depth rather than the file size.
+
+    Files and chunks are content addressed: an identical file skips the pipeline entirely and
+    an identical chunk reuses the existing vector of the namespace (reference counted in vector_refs).
+
+    With `knowledge_base_id` the file is a new version of that knowledge base: chunk hashes are
+    diffed against the stored version, only added chunks are embedded / upserted, only removed
+    ones are released and the record is updated in place.
+
+    Progress is checkpointed in an ingestion journal: a failed or interrupted ingest keeps what it
+    wrote, and uploading the same file again resumes it - the extracted text, the vector references,
+    the embeddings and the acknowledged upserts are not redone.
+    """
+    file_extension = os.path.splitext(file_name)[1].lower()
+    print(f"== file extension is: {file_extension} ==")
+
+    if file_hash is None:
+        file_hash = await asyncio.to_thread(file_content_hash, path)
+
+    namespace = namespace or config.PINECONE_NAMESPACE
+    existing = None
+    previous_ids = set()
+    if knowledge_base_id is not None:
+        existing = await db.knowledge_base.find_one(
+            {"knowledge_base_id": knowledge_base_id},
+            {"_id": 0, "knowledge_base_id": 1, "file_hash": 1, "pinecone_id_list": 1, "ref_counted": 1, "namespace": 1}
+        )
+        if existing is None:
+            raise IngestionError(f"Specified knowledge base not found: {knowledge_base_id}")
+        if existing.get("file_hash") == file_hash:
+            print("== Uploaded version is identical to the stored one, nothing to update ==")
+            await progress(unchanged = True)
+            return knowledge_base_id
+        if existing.get("ref_counted"):
+            previous_ids = set(existing.get("pinecone_id_list") or [])
+        namespace = existing.get("namespace") or config.PINECONE_NAMESPACE
+    else:
+        duplicate = await db.knowledge_base.find_one(
+            {"file_hash": file_hash, "ref_counted": True, **namespace_filter(namespace)},
+            {
+                "_id": 0, "knowledge_base_id": 1, "file_hash": 1, "content_size": 1, "chunk_count": 1,
+                "pinecone_id_list": 1, "namespace": 1, "vector_owners": 1
+            }
+        )
+        if duplicate:
+            print(f"== Identical file already ingested ({duplicate['knowledge_base_id']}), reusing it ==")
+            new_knowledge_base_id = await clone_knowledge_base(db, duplicate, file_name)
+            await progress(duplicate_of = duplicate["knowledge_base_id"])
+            return new_knowledge_base_id
+
+    # ids come from the journal - a resumed ingest keeps writing under the ones of the earlier run
+    journal = await open_journal(db, file_name, file_hash, file_extension, knowledge_base_id, namespace)
+    knowledge_base_id = journal.knowledge_base_id
+    content_id = journal.content_id
+    if journal.resumed:
+        await progress(resumed = True)
+
+    segment_queue: asyncio.Queue = asyncio.Queue(maxsize = config.INGEST_QUEUE_DEPTH)
+    own_stage = stage is None
+    if own_stage:
+        stage = EmbedUpsertStage(db, workers = config.INGEST_EMBED_CONCURRENCY, batch_size = EMBED_BATCH_SIZE, namespace = namespace)
+        await stage.start()
+    elif stage.namespace != namespace:
+        raise IngestionError(f"Shared stage upserts into namespace '{stage.namespace}', not '{namespace}'.")
+    stage_file = stage.register(file_name, progress, journal)
+    totals = {"content_size": 0, "chunks": 0, "deduplicated": 0, "unchanged": 0, "resumed": 0, "embeddings_resumed": 0}
+
+    # unique chunk ids of this file in order, and the ids this run took a reference on
+    pinecone_ids = []
+    seen_ids = set()
+    acquired_ids = []
+
+    # knowledge bases owning the vectors of this file - chat scoped to the knowledge base filters the
+    # query on them (unknown when some vector predates owners, chat then falls back to checking membership)
+    owners = set()
+    owners_known = True
+
+    async def replay_extracted():
+        # the earlier run extracted the whole file - its stored segments are chunked again instead
+        async for document in db.knowledge_base_content.find(
+            {"knowledge_base_id": content_id},
+            {"_id": 0, "size": 1, "text": 1, "page_start": 1, "page_end": 1}
+        ).sort("seq", 1):
+            pages = (document["page_start"], document["page_end"]) if "page_start" in document else None
+            totals["content_size"] += document["size"]
+            await segment_queue.put((document["text"], pages))
+        await segment_queue.put(None)
+
+    async def extract_stage():
+        if journal.extracted:
+            await replay_extracted()
+            return
+        if journal.resumed:
+            await journal.restart_extraction()
+
+        await progress("extracting")
+        seq = 0
+        async for segment, pages in iter_extracted_content(path, file_extension):
+            # byte offsets let the content endpoint serve byte ranges without reading every segment
+            size = len(segment.encode("utf-8"))
+            document = {
+                "knowledge_base_id": content_id,
+                "seq": seq,
+                "offset": totals["content_size"],
+                "size": size,
+                "text": segment
+            }
+            if pages:
+                document["page_start"], document["page_end"] = pages
+            await db.knowledge_base_content.insert_one(document)
+            seq += 1
+            totals["content_size"] += size
+            await segment_queue.put((segment, pages))
+        await journal.mark_extracted(seq, totals["content_size"])
+        await segment_queue.put(None)
+
+    async def chunk_stage():
+        stream = getChunkStream()
+        batch = []
+
+        async def record_owners(
+            shared_ids: List[str],
+            fresh_owners: Iterable[Optional[str]]
+        ):
+            nonlocal owners_known
+            for owner in fresh_owners:
+                owners_known = owners_known and owner is not None
+                owners.add(owner)
+            if shared_ids:
+                shared_owners = await db.vector_refs.distinct(
+                    "owner",
+                    {"_id": {"$in": [vector_key(namespace, vector_id) for vector_id in shared_ids]}}
+                )
+                owners_known = owners_known and None not in shared_owners and len(shared_owners) > 0
+                owners.update(owner for owner in shared_owners if owner is not None)
+
+        async def dispatch():
+            nonlocal batch
+            chunks, batch = batch, []
+
+            # repeats inside the file are dropped, chunks of the previous version are kept as they are,
+            # the rest takes a reference and only never-seen chunks go on to be embedded
+            unique = []
+            kept = []
+            for location, chunk in chunks:
+                vector_id = content_hash(chunk)
+                if vector_id in seen_ids:
+                    continue
+                seen_ids.add(vector_id)
+                pinecone_ids.append(vector_id)
+                if vector_id in previous_ids:
+                    totals["unchanged"] += 1
+                    CHUNKS_UNCHANGED.inc()
+                    kept.append(vector_id)
+                else:
+                    unique.append((vector_id, chunk, location))
+
+            # chunks an earlier run of this ingest took a reference on keep it, the others acquire one -
+            # the ones whose vector is not in Pinecone yet (new, or pending in another ingest) are upserted
+            acquiring = [item for item in unique if item[0] not in journal.chunks]
+            new_ids = await acquire_vector_refs(db, [vector_id for vector_id, _, _ in acquiring], knowledge_base_id, namespace)
+            await journal.record_acquired((vector_id, vector_id in new_ids) for vector_id, _, _ in acquiring)
+            acquired_ids.extend(vector_id for vector_id, _, _ in unique)
+            fresh = [
+                (vector_id, chunk, location, None, new_ids[vector_id])
+                for vector_id, chunk, location in acquiring if vector_id in new_ids
+            ]
+
+            # chunks of the earlier run: the ones still pending are upserted (embedded ones skip the embedding),
+            # fresh ones that are in Pinecone by now are done - whichever ingest got them there
+            held = [item for item in unique if item[0] in journal.chunks]
+            held_pending = await pending_vector_refs(db, [vector_id for vector_id, _, _ in held], namespace)
+            pending = [item for item in held if item[0] in held_pending]
+            done = [item for item in held if item[0] not in held_pending and journal.chunks[item[0]].get("fresh")]
+            embeddings = await journal.get_embeddings([
+                vector_id for vector_id, _, _ in pending if journal.chunks[vector_id].get("embedded")
+            ]) if pending else {}
+            fresh += [
+                (vector_id, chunk, location, embeddings.get(vector_id), held_pending[vector_id])
+                for vector_id, chunk, location in pending
+            ]
+            await record_owners(kept + [
+                vector_id for vector_id, _, _ in unique
+                if vector_id not in new_ids and vector_id not in held_pending
+            ], [owner for _, _, _, _, owner in fresh])
+
+            totals["chunks"] += len(chunks)
+            totals["deduplicated"] += len(chunks) - len(fresh) - len(done)
+            totals["resumed"] += len(done)
+            totals["embeddings_resumed"] += len(embeddings)
+            CHUNKS_PRODUCED.inc(len(chunks))
+            CHUNKS_DEDUPLICATED.inc(len(chunks) - len(fresh) - len(done))
+            CHUNKS_RESUMED.inc(len(done) + len(embeddings))
+            await stage.add(stage_file, fresh)
+            await progress(
+                chunks_produced = totals["chunks"],
+                chunks_deduplicated = totals["deduplicated"],
+                chunks_unchanged = totals["unchanged"],
+                chunks_resumed = totals["resumed"],
+                embeddings_resumed = totals["embeddings_resumed"]
+            )
+
+        position = 0
+
+        async def emit(chunks, pages: PageRange):
+            nonlocal position
+            for chunk in chunks:
+                # the position in the file lets the context assembler merge neighbouring chunks
+                location = {"chunk_index": position}
+                if pages:
+                    location["page_start"], location["page_end"] = pages
+                batch.append((location, chunk))
+                position += 1
+                if len(batch) == EMBED_BATCH_SIZE:
+                    await dispatch()
+
+        pages = None
+        while (item := await segment_queue.get()) is not None:
+            segment, segment_pages = item
+            # chunks do not cross page ranges, so each one carries the pages it came from
+            if segment_pages != pages:
+                await emit(await stream.flush(), pages)
+                pages = segment_pages
+            await emit(await stream.feed(segment), pages)
+        await emit(await stream.flush(), pages)
+
+        if batch:
+            await dispatch()
+        await progress(chunks_total = totals["chunks"])
+
+    completed = False
+    error = None
+    try:
+        print("== Extracting, chunking, embedding and uploading vectors ==")
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(extract_stage())
+                tg.create_task(chunk_stage())
+        except ExceptionGroup as eg:
+            raise eg.exceptions[0]
+
+        stats = await stage.finish(stage_file)
+        print(f"== Upserted {stats['vectors_upserted']} vectors at {stats['vectors_per_second']} vectors/s ==")
+        await progress(**stats)
+
+        # references an earlier run took on chunks this run did not produce - LLM extraction is not
+        # deterministic, so a file extracted again after an interrupted extraction can chunk differently
+        stale = [vector_id for vector_id in journal.chunks if vector_id not in seen_ids]
+        if stale:
+            await release_knowledge_base_vectors(db, {"namespace": namespace, "pinecone_id_list": stale, "ref_counted": True})
+
+        record = {
+            "knowledge_base_name": file_name,
+            "file_hash": file_hash,
+            "content_size": totals["content_size"],
+            "chunk_count": len(pinecone_ids),
+            "pinecone_id_list": pinecone_ids,
+            "ref_counted": True,
+            "namespace": namespace,
+            "vector_owners": sorted(owners) if owners_known else None,
+        }
+
+        if existing is None:
+            # save the data to DB (the extracted content lives in knowledge_base_content)
+            await db.knowledge_base.insert_one({
+                "knowledge_base_id": knowledge_base_id,
+                **record,
+                "created_at": datetime.now(timezone.utc)
+            })
+        else:
+            # swap in the new content and record, then release the chunks the new version dropped
+            await db.knowledge_base_content.delete_many({"knowledge_base_id": knowledge_base_id})
+            await db.knowledge_base_content.update_many(
+                {"knowledge_base_id": content_id},
+                {"$set": {"knowledge_base_id": knowledge_base_id}}
+            )
+            await db.knowledge_base.update_one(
+                {"knowledge_base_id": knowledge_base_id},
+                {"$set": {**record, "updated_at": datetime.now(timezone.utc)}}
+            )
+        await journal.complete()
+        completed = True
+
+        if existing is not None:
+            removed = dict.fromkeys(
+                vector_id for vector_id in (existing.get("pinecone_id_list") or [])
+                if vector_id not in seen_ids
+            )
+            await release_knowledge_base_vectors(db, {
+                "namespace": namespace,
+                "pinecone_id_list": list(removed),
+                "ref_counted": existing.get("ref_counted", False)
+            })
+            await progress(chunks_added = len(acquired_ids), chunks_removed = len(removed))
+            print(f"== Knowledge base updated: {len(acquired_ids)} chunks added, {len(removed)} removed ==")
+
+    except BaseException as e:
+        error = e
+        raise
+
+    finally:
+        if not completed:
+            await stage.abort(stage_file)
+            # what the run wrote stays for a retry - released by discard_expired_journals if none comes
+            await journal.fail(str(error) or type(error).__name__ if error else "Ingest did not complete.")
+        if own_stage:
+            await stage.stop()
+
+    print("== File processing successful! ==")
+    return knowledge_base_id
@@ -0,0 +1,339 @@
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+import asyncio
+import os
+import time
+import uuid
+
+from config import config
+from services.content_processing import EMBEDDING_BATCH_SIZE
+from services.ingestion import ingest_file, EmbedUpsertStage
+from services.ingestion_journal import interrupt_running_journals, discard_expired_journals
+from services.executor import remove_file
+from services.metrics import INGESTION_JOB_SECONDS, INGESTION_JOBS_IN_FLIGHT, INGESTION_JOBS_QUEUED
+from services.uploads import SpooledUpload, clear_spool_dir
+
+# job life cycle: queued -> extracting -> embedding -> upserting -> done | failed
+JOB_STAGES = ("queued", "extracting", "embedding", "upserting")
+JOB_FINAL_STATES = ("done", "failed")
+
+# seconds between sweeps for ingestion journals past their INGEST_JOURNAL_TTL_SECONDS
+JOURNAL_SWEEP_INTERVAL = 3600
+
+
+class IngestionJobQueue:
+    """
+    Bounded pool of workers running the ingestion pipeline, job state persisted in mongodb.
+    A queue entry is a list of jobs - one file, or the files of a batch upload which are
+    ingested together (see _run_batch).
+    """
+
+    def __init__(
+        self,
+        db,
+        workers: int,
+        max_queued: int
+    ):
+        self.db = db
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize = max_queued)
+        self.tasks = []
+        INGESTION_JOBS_QUEUED.set_function(self.queue.qsize)
+
+    async def start(self):
+        """
+        Spawn the workers - jobs left unfinished by a previous process are queued again while their
+        spooled upload is still there (their ingestion journal resumes them), the others are marked
+        failed and the uploads nothing refers to any more are removed
+        """
+        await self.db.ingestion_jobs.create_index("job_id", unique = True)
+        await self.db.ingestion_jobs.create_index([("batch_id", 1), ("batch_index", 1)])
+        await interrupt_running_journals(self.db)
+
+        requeued = []
+        async for job in self.db.ingestion_jobs.find(
+            {"status": {"$nin": list(JOB_FINAL_STATES)}},
+            {
+                "_id": 0, "job_id": 1, "file_name": 1, "file_size": 1, "file_hash": 1, "spool_path": 1,
+                "mode": 1, "knowledge_base_id": 1, "namespace": 1
+            }
+        ).sort("created_at", 1):
+            path = job.get("spool_path")
+            if path is None or not os.path.exists(path) or self.queue.full():
+                await self.db.ingestion_jobs.update_one({"job_id": job["job_id"]}, {"$set": {
+                    "status": "failed",
+                    "error": "Server restarted before the job finished.",
+                    "updated_at": datetime.now(timezone.utc)
+                }})
+                continue
+
+            upload = SpooledUpload(path = path, size = job["file_size"], file_hash = job["file_hash"])
+            knowledge_base_id = job["knowledge_base_id"] if job.get("mode") == "update" else None
+            await self.db.ingestion_jobs.update_one({"job_id": job["job_id"]}, {"$set": {
+                "status": "queued",
+                "requeued_at": datetime.now(timezone.utc),
+                "updated_at": datetime.now(timezone.utc)
+            }})
+            self.queue.put_nowait([(job["job_id"], job["file_name"], upload, knowledge_base_id, job.get("namespace"))])
+            requeued.append(path)
+
+        if requeued:
+            print(f"== Requeued {len(requeued)} ingestion jobs left unfinished by the previous process ==")
+        clear_spool_dir(keep = requeued)
+
+        for i in range(self.workers):
+            self.tasks.append(asyncio.create_task(self._worker(i)))
+        self.tasks.append(asyncio.create_task(self._sweep_journals()))
+
+    async def stop(self):
+        # uploads of the queued and interrupted jobs stay spooled - the next start queues them again
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions = True)
+        self.tasks = []
+
+    async def submit(
+        self,
+        file_name: str,
+        upload: SpooledUpload,
+        knowledge_base_id: Optional[str] = None,
+        namespace: Optional[str] = None
+    ) -> str:
+        """
+        Queue a spooled file for ingestion into `namespace` (or as a new version of `knowledge_base_id`),
+        raises asyncio.QueueFull when the queue is at capacity. Once queued the spooled
+        file belongs to the queue, which removes it when the job ends.
+        """
+        if self.queue.full():
+            raise asyncio.QueueFull()
+
+        job = self._new_job(file_name, upload, knowledge_base_id, namespace)
+        await self.db.ingestion_jobs.insert_one(job)
+        try:
+            self.queue.put_nowait([(job["job_id"], file_name, upload, knowledge_base_id, namespace)])
+        except asyncio.QueueFull:
+            await self.db.ingestion_jobs.delete_one({"job_id": job["job_id"]})
+            raise
+
+        return job["job_id"]
+
+    async def submit_batch(
+        self,
+        files: List[Tuple[str, SpooledUpload]],
+        namespace: Optional[str] = None
+    ) -> Tuple[str, List[str]]:
+        """
+        Queue (file name, spooled file) pairs as one batch into `namespace` - one job per file, all
+        in a single queue entry. Returns the batch id and the job ids in file order, raises
+        asyncio.QueueFull when the queue is at capacity.
+        """
+        if self.queue.full():
+            raise asyncio.QueueFull()
+
+        batch_id = str(uuid.uuid4())
+        jobs = []
+        for batch_index, (file_name, upload) in enumerate(files):
+            job = self._new_job(file_name, upload, None, namespace)
+            job["batch_id"] = batch_id
+            job["batch_index"] = batch_index
+            jobs.append(job)
+
+        await self.db.ingestion_jobs.insert_many(jobs)
+        try:
+            self.queue.put_nowait([
+                (job["job_id"], file_name, upload, None, namespace)
+                for job, (file_name, upload) in zip(jobs, files)
+            ])
+        except asyncio.QueueFull:
+            await self.db.ingestion_jobs.delete_many({"batch_id": batch_id})
+            raise
+
+        return batch_id, [job["job_id"] for job in jobs]
+
+    def _new_job(
+        self,
+        file_name: str,
+        upload: SpooledUpload,
+        knowledge_base_id: Optional[str],
+        namespace: Optional[str]
+    ) -> dict:
+        now = datetime.now(timezone.utc)
+        return {
+            "job_id": str(uuid.uuid4()),
+            "file_name": file_name,
+            "file_size": upload.size,
+            "file_hash": upload.file_hash,
+            "spool_path": upload.path,
+            "status": "queued",
+            "stage_timings": {},
+            "progress": {},
+            "error": None,
+            "mode": "update" if knowledge_base_id else "create",
+            "knowledge_base_id": knowledge_base_id,
+            "namespace": namespace,
+            "created_at": now,
+            "updated_at": now
+        }
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.db.ingestion_jobs.find_one(
+            {"job_id": job_id},
+            {"_id": 0}
+        )
+
+    async def get_batch(self, batch_id: str) -> List[dict]:
+        return await self.db.ingestion_jobs.find(
+            {"batch_id": batch_id},
+            {"_id": 0}
+        ).sort("batch_index", 1).to_list(None)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            jobs = await self.queue.get()
+            try:
+                if len(jobs) == 1:
+                    await self._run(*jobs[0])
+                else:
+                    await self._run_batch(jobs)
+            except Exception as e:
+                print(f"== Ingestion worker {worker_id} failed to record job {jobs[0][0]}: {e} ==")
+            # a job cancelled by the shutdown keeps its upload to be resumed by the next start
+            for _, _, upload, _, _ in jobs:
+                await asyncio.to_thread(remove_file, upload.path)
+            self.queue.task_done()
+
+    async def _sweep_journals(self):
+        """Release what failed ingests that were never retried still hold"""
+        while True:
+            try:
+                await discard_expired_journals(self.db)
+            except Exception as e:
+                print(f"== Ingestion journal sweep failed: {e} ==")
+            await asyncio.sleep(JOURNAL_SWEEP_INTERVAL)
+
+    async def _run_batch(self, jobs: list):
+        """
+        Ingest the files of a batch - up to BATCH_FILE_CONCURRENCY are extracted and chunked at once
+        and their chunks share one embedding / upsert stage, so embed_content and upsert requests are
+        filled across files. Each file keeps its own job status, a failed file does not stop the rest.
+        """
+        # the files of a batch are ingested into one namespace
+        stage = EmbedUpsertStage(
+            self.db,
+            workers = config.INGEST_EMBED_CONCURRENCY,
+            batch_size = EMBEDDING_BATCH_SIZE,
+            namespace = jobs[0][4]
+        )
+        await stage.start()
+        fan_out = asyncio.Semaphore(max(1, config.BATCH_FILE_CONCURRENCY))
+
+        async def run(job):
+            async with fan_out:
+                await self._run(*job, shared_stage = stage)
+
+        try:
+            results = await asyncio.gather(*(run(job) for job in jobs), return_exceptions = True)
+            for (job_id, _, _, _, _), result in zip(jobs, results):
+                if isinstance(result, Exception):
+                    print(f"== Failed to record batch job {job_id}: {result} ==")
+        finally:
+            await stage.stop()
+
+    async def _run(
+        self,
+        job_id: str,
+        file_name: str,
+        upload: SpooledUpload,
+        knowledge_base_id: Optional[str],
+        namespace: Optional[str],
+        shared_stage: Optional[EmbedUpsertStage] = None
+    ):
+        stage = "queued"
+        stage_started = job_started = time.perf_counter()
+        timings = {}
+
+        async def progress(new_stage = None, **counters):
+            nonlocal stage, stage_started
+            update = {"updated_at": datetime.now(timezone.utc)}
+
+            # stages overlap in the pipeline - the status only ever moves forward
+            if new_stage is not None and JOB_STAGES.index(new_stage) > JOB_STAGES.index(stage):
+                now = time.perf_counter()
+                timings[stage] = round(now - stage_started, 3)
+                stage, stage_started = new_stage, now
+                update["status"] = stage
+                update["stage_timings"] = dict(timings)
+
+            for key, value in counters.items():
+                update[f"progress.{key}"] = value
+
+            await self.db.ingestion_jobs.update_one({"job_id": job_id}, {"$set": update})
+
+        INGESTION_JOBS_IN_FLIGHT.inc()
+        try:
+            print(f"== Ingestion job {job_id} started ==")
+            knowledge_base_id = await ingest_file(
+                db = self.db,
+                file_name = file_name,
+                path = upload.path,
+                progress = progress,
+                knowledge_base_id = knowledge_base_id,
+                file_hash = upload.file_hash,
+                stage = shared_stage,
+                namespace = namespace
+            )
+            timings[stage] = round(time.perf_counter() - stage_started, 3)
+            await self.db.ingestion_jobs.update_one({"job_id": job_id}, {"$set": {
+                "status": "done",
+                "stage_timings": timings,
+                "knowledge_base_id": knowledge_base_id,
+                "updated_at": datetime.now(timezone.utc)
+            }})
+            print(f"== Ingestion job {job_id} done ==")
+            INGESTION_JOB_SECONDS.labels("done").observe(time.perf_counter() - job_started)
+
+        except Exception as e:
+            print(f"== Ingestion job {job_id} failed at stage {stage}: {e} ==")
+            timings[stage] = round(time.perf_counter() - stage_started, 3)
+            await self.db.ingestion_jobs.update_one({"job_id": job_id}, {"$set": {
+                "status": "failed",
+                "failed_stage": stage,
+                "stage_timings": timings,
+                "error": str(e),
+                "updated_at": datetime.now(timezone.utc)
+            }})
+            INGESTION_JOB_SECONDS.labels("failed").observe(time.perf_counter() - job_started)
+
+        finally:
+            INGESTION_JOBS_IN_FLIGHT.dec()
+
+
+ingestion_queue: IngestionJobQueue = None
+
+async def start_ingestion_workers(db):
+    """Start the background ingestion workers"""
+    global ingestion_queue
+    try:
+        ingestion_queue = IngestionJobQueue(
+            db = db,
+            workers = config.INGESTION_WORKERS,
+            max_queued = config.INGESTION_QUEUE_SIZE
+        )
+        await ingestion_queue.start()
+
+    except Exception as e:
+        print(f"== Failed to start ingestion workers: {e} ==")
+        raise RuntimeError(f"Failed to start ingestion workers: {e}")
+
+def get_ingestion_queue():
+    """Dependency function to get the ingestion job queue"""
+    if ingestion_queue is None:
+        print("== ingestion workers not started ==")
+        raise RuntimeError("ingestion workers not started")
+
+    return ingestion_queue
+
+async def stop_ingestion_workers():
+    """Stop the background ingestion workers"""
+    if ingestion_queue is not None:
+        await ingestion_queue.stop()
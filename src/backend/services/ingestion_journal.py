@@ -0,0 +1,237 @@
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+import uuid
+
+from bson.binary import Binary
+from pymongo import UpdateOne, ReturnDocument
+import numpy as np
+
+from config import config
+from services.vector_refs import release_knowledge_base_vectors
+
+# A journal checkpoints one ingest so a failed or interrupted run resumes instead of starting over:
+#   ingestion_journal         - one document per ingest: ids, extraction settings, whether the text is complete
+#   ingestion_journal_chunks  - one document per chunk the ingest took a vector reference on, with its
+#                               embedding (float32 bytes) once computed
+# Whether Pinecone acknowledged a chunk is recorded on its vector reference (vector_refs `pending`).
+# The extracted text itself is the knowledge_base_content segments stored under content_id.
+#
+# journal life cycle: running -> deleted on success | failed (kept until expires_at) | interrupted (server restart)
+RESUMABLE_STATES = ("failed", "interrupted")
+
+
+def encode_embedding(embedding: List[float]) -> Binary:
+    return Binary(np.asarray(embedding, dtype = np.float32).tobytes())
+
+
+def decode_embedding(data: bytes) -> List[float]:
+    return np.frombuffer(data, dtype = np.float32).tolist()
+
+
+def extraction_settings(file_extension: str) -> dict:
+    """Settings the extracted text / chunks depend on - a journal made with other ones is not reused"""
+    return {
+        "file_extension": file_extension,
+        "pdf_parser": config.PDF_PARSER if file_extension == ".pdf" else None,
+        "chunker": config.CHUNKER
+    }
+
+
+class IngestionJournal:
+    """Checkpoints of one ingest (see the module comment)"""
+
+    def __init__(
+        self,
+        db,
+        document: dict,
+        resumed: bool
+    ):
+        self.db = db
+        self.journal_id = document["journal_id"]
+        self.knowledge_base_id = document["knowledge_base_id"]
+        self.content_id = document["content_id"]
+        self.extracted = document.get("extracted", False)
+        self.resumed = resumed
+
+        # vector id -> {"fresh", "embedded"} of the chunks journaled by earlier runs
+        self.chunks: Dict[str, dict] = {}
+
+    async def load_chunks(self):
+        """Chunk states of the earlier runs - without the embeddings, which are read per batch"""
+        async for chunk in self.db.ingestion_journal_chunks.find(
+            {"journal_id": self.journal_id},
+            {"_id": 0, "vector_id": 1, "fresh": 1, "embedded": 1}
+        ):
+            self.chunks[chunk["vector_id"]] = chunk
+
+    async def get_embeddings(self, vector_ids: List[str]) -> Dict[str, List[float]]:
+        embeddings = {}
+        async for chunk in self.db.ingestion_journal_chunks.find(
+            {"journal_id": self.journal_id, "vector_id": {"$in": vector_ids}, "embedded": True},
+            {"_id": 0, "vector_id": 1, "embedding": 1}
+        ):
+            embeddings[chunk["vector_id"]] = decode_embedding(chunk["embedding"])
+        return embeddings
+
+    async def record_acquired(self, chunks: Iterable[Tuple[str, bool]]):
+        """(vector id, fresh) of the chunks this run took a reference on - fresh ones are upserted by it"""
+        documents = [
+            {"journal_id": self.journal_id, "vector_id": vector_id, "fresh": fresh, "embedded": False}
+            for vector_id, fresh in chunks
+        ]
+        if documents:
+            await self.db.ingestion_journal_chunks.insert_many(documents, ordered = False)
+
+    async def record_embeddings(self, embeddings: Iterable[Tuple[str, List[float]]]):
+        operations = [
+            UpdateOne(
+                {"journal_id": self.journal_id, "vector_id": vector_id},
+                {"$set": {"embedding": encode_embedding(embedding), "embedded": True}}
+            )
+            for vector_id, embedding in embeddings
+        ]
+        if operations:
+            await self.db.ingestion_journal_chunks.bulk_write(operations, ordered = False)
+
+    async def mark_extracted(
+        self,
+        segments: int,
+        content_size: int
+    ):
+        self.extracted = True
+        await self._update({"extracted": True, "segments": segments, "content_size": content_size})
+
+    async def restart_extraction(self):
+        """The earlier run stopped mid-extraction - its partial text is dropped and extracted again"""
+        await self.db.knowledge_base_content.delete_many({"knowledge_base_id": self.content_id})
+
+    async def complete(self):
+        """The ingest succeeded - the journal is no longer needed"""
+        await self.db.ingestion_journal_chunks.delete_many({"journal_id": self.journal_id})
+        await self.db.ingestion_journal.delete_one({"journal_id": self.journal_id})
+
+    async def fail(self, error: str):
+        """Keep the checkpoints for a retry, until INGEST_JOURNAL_TTL_SECONDS"""
+        try:
+            await self._update({
+                "status": "failed",
+                "error": error,
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds = config.INGEST_JOURNAL_TTL_SECONDS)
+            })
+
+        except Exception as e:
+            print(f"== Error while failing ingestion journal {self.journal_id}: {e} ==")
+
+    async def _update(self, fields: dict):
+        await self.db.ingestion_journal.update_one(
+            {"journal_id": self.journal_id},
+            {"$set": {**fields, "updated_at": datetime.now(timezone.utc)}}
+        )
+
+
+async def open_journal(
+    db,
+    file_name: str,
+    file_hash: str,
+    file_extension: str,
+    target_knowledge_base_id: Optional[str],
+    namespace: str
+) -> IngestionJournal:
+    """
+    Resume the journal a failed / interrupted ingest of the same file (into the same knowledge base
+    and namespace, with the same extraction settings) left, or start a new one
+    """
+    now = datetime.now(timezone.utc)
+    settings = extraction_settings(file_extension)
+    document = await db.ingestion_journal.find_one_and_update(
+        {
+            "file_hash": file_hash,
+            "target_knowledge_base_id": target_knowledge_base_id,
+            "namespace": namespace,
+            "settings": settings,
+            "status": {"$in": list(RESUMABLE_STATES)}
+        },
+        {"$set": {"status": "running", "file_name": file_name, "updated_at": now}, "$unset": {"expires_at": ""}},
+        sort = [("updated_at", -1)],
+        return_document = ReturnDocument.AFTER
+    )
+    if document is not None:
+        journal = IngestionJournal(db, document, resumed = True)
+        await journal.load_chunks()
+        print(f"== Resuming ingest from journal {journal.journal_id} ({len(journal.chunks)} chunks journaled) ==")
+        return journal
+
+    knowledge_base_id = target_knowledge_base_id or str(uuid.uuid4())
+    document = {
+        "journal_id": str(uuid.uuid4()),
+        "file_name": file_name,
+        "file_hash": file_hash,
+        "target_knowledge_base_id": target_knowledge_base_id,
+        "namespace": namespace,
+        "settings": settings,
+        "knowledge_base_id": knowledge_base_id,
+        # new content is written under its own id and swapped in once the ingest succeeded
+        "content_id": str(uuid.uuid4()) if target_knowledge_base_id else knowledge_base_id,
+        "extracted": False,
+        "status": "running",
+        "created_at": now,
+        "updated_at": now
+    }
+    await db.ingestion_journal.insert_one(document)
+    return IngestionJournal(db, document, resumed = False)
+
+
+async def interrupt_running_journals(db):
+    """At startup - ingests that were running in the previous process can be resumed"""
+    await db.ingestion_journal.update_many(
+        {"status": "running"},
+        {"$set": {
+            "status": "interrupted",
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds = config.INGEST_JOURNAL_TTL_SECONDS)
+        }}
+    )
+
+
+async def discard_expired_journals(db) -> int:
+    """Release what expired journals hold - vector references (and vectors), content segments - and drop them"""
+    discarded = 0
+    async for journal in db.ingestion_journal.find(
+        {"status": {"$in": list(RESUMABLE_STATES)}, "expires_at": {"$lte": datetime.now(timezone.utc)}},
+        {"_id": 0, "journal_id": 1, "knowledge_base_id": 1, "namespace": 1, "content_id": 1}
+    ):
+        try:
+            vector_ids = [
+                chunk["vector_id"] async for chunk in db.ingestion_journal_chunks.find(
+                    {"journal_id": journal["journal_id"]},
+                    {"_id": 0, "vector_id": 1}
+                )
+            ]
+            await release_knowledge_base_vectors(db, {
+                "knowledge_base_id": journal["knowledge_base_id"],
+                "namespace": journal.get("namespace"),
+                "pinecone_id_list": vector_ids,
+                "ref_counted": True
+            })
+            await db.knowledge_base_content.delete_many({"knowledge_base_id": journal["content_id"]})
+            await db.ingestion_journal_chunks.delete_many({"journal_id": journal["journal_id"]})
+            await db.ingestion_journal.delete_one({"journal_id": journal["journal_id"]})
+            discarded += 1
+
+        except Exception as e:
+            print(f"== Error while discarding expired ingestion journal {journal['journal_id']}: {e} ==")
+
+    if discarded:
+        print(f"== Discarded {discarded} expired ingestion journals ==")
+    return discarded
+
+
+async def discard_namespace_journals(
+    db,
+    namespace: str
+):
+    """The namespace was dropped - its journals (and the content they extracted) have nothing left to resume"""
+    selector = {"namespace": namespace, "status": {"$in": list(RESUMABLE_STATES)}}
+    async for journal in db.ingestion_journal.find(selector, {"_id": 0, "journal_id": 1, "content_id": 1}):
+        await db.knowledge_base_content.delete_many({"knowledge_base_id": journal["content_id"]})
+        await db.ingestion_journal_chunks.delete_many({"journal_id": journal["journal_id"]})
+    await db.ingestion_journal.delete_many(selector)
@@ -0,0 +1,291 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config import config
+
+# words, plus compound tokens such as "CS-101", "H2SO4", "21BCE1234" or "v1.2" kept whole
+TOKEN = re.compile(r"\w+(?:[-./]\w+)*")
+SEPARATOR = re.compile(r"[-./]")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased tokens - a compound token is indexed whole, joined ("cs101") and by its parts"""
+    tokens = []
+    for match in TOKEN.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        parts = SEPARATOR.split(token)
+        if len(parts) > 1:
+            tokens.append("".join(parts))
+            tokens.extend(part for part in parts if part)
+
+    return tokens
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over the chunk texts, keyed by (namespace, vector id) (chunks are content
+    addressed, so a chunk shared by several knowledge bases of a namespace is indexed once). Searches are
+    limited to one namespace, the term statistics are shared by all of them.
+
+    Postings are array-backed: every term has an array of document ordinals and a parallel array of
+    term frequencies, appended to as chunks are ingested. Removed chunks are tombstoned and the
+    postings are compacted once the tombstones outnumber the live chunks. The chunk texts are kept
+    in SQLite and the postings are rebuilt from it on startup.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._db = None
+        self._reset()
+
+    def _reset(self):
+        self.term_ids: Dict[str, int] = {}
+        self.postings_docs: List[array] = [] # term id -> document ordinals ('I')
+        self.postings_tfs: List[array] = [] # term id -> term frequencies ('H')
+        self.doc_freq = array("I") # term id -> number of live documents containing it
+
+        self.doc_ids: List[str] = [] # ordinal -> vector id
+        self.doc_namespaces = array("H") # ordinal -> namespace code
+        self.namespace_codes: Dict[str, int] = {}
+        self.doc_ordinals: Dict[Tuple[str, str], int] = {} # (namespace, vector id) -> ordinal
+        self.doc_terms: List[array] = [] # ordinal -> distinct term ids ('I')
+        self.doc_lengths = array("I")
+        self.deleted = bytearray()
+
+        self.live_docs = 0
+        self.total_length = 0
+
+    def _connect(self):
+        if self._db is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok = True)
+
+            self._db = sqlite3.connect(self.db_path, check_same_thread = False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS namespaced_chunks "
+                "(namespace TEXT NOT NULL, id TEXT NOT NULL, content TEXT NOT NULL, PRIMARY KEY (namespace, id))"
+            )
+            # chunk stores from before namespaces only hold chunks of the default namespace
+            legacy = self._db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'chunks'").fetchone()
+            if legacy:
+                self._db.execute(
+                    "INSERT OR IGNORE INTO namespaced_chunks (namespace, id, content) SELECT ?, id, content FROM chunks",
+                    (config.PINECONE_NAMESPACE,)
+                )
+                self._db.execute("DROP TABLE chunks")
+            self._db.commit()
+
+        return self._db
+
+    def load(self):
+        """Open the chunk store and rebuild the postings from it"""
+        with self._lock:
+            self._reset()
+            for namespace, vector_id, content in self._connect().execute("SELECT namespace, id, content FROM namespaced_chunks"):
+                self._index(namespace, vector_id, content)
+
+        print(f"== Lexical index loaded: {self.live_docs} chunks, {len(self.term_ids)} terms ==")
+
+    def _index(self, namespace: str, vector_id: str, content: str):
+        counts: Dict[int, int] = {}
+        tokens = tokenize(content)
+        for token in tokens:
+            term_id = self.term_ids.get(token)
+            if term_id is None:
+                term_id = self.term_ids[token] = len(self.postings_docs)
+                self.postings_docs.append(array("I"))
+                self.postings_tfs.append(array("H"))
+                self.doc_freq.append(0)
+            counts[term_id] = counts.get(term_id, 0) + 1
+
+        ordinal = len(self.doc_ids)
+        for term_id, count in counts.items():
+            self.postings_docs[term_id].append(ordinal)
+            self.postings_tfs[term_id].append(min(count, 0xFFFF))
+            self.doc_freq[term_id] += 1
+
+        self.doc_ids.append(vector_id)
+        self.doc_namespaces.append(self.namespace_codes.setdefault(namespace, len(self.namespace_codes)))
+        self.doc_ordinals[(namespace, vector_id)] = ordinal
+        self.doc_terms.append(array("I", counts))
+        self.doc_lengths.append(len(tokens))
+        self.deleted.append(0)
+        self.live_docs += 1
+        self.total_length += len(tokens)
+
+    def add(
+        self,
+        chunks: Iterable[Tuple[str, str]],
+        namespace: Optional[str] = None
+    ):
+        """Index (vector id, chunk text) pairs of the namespace - ids already in the index are skipped"""
+        namespace = namespace or config.PINECONE_NAMESPACE
+        with self._lock:
+            db = self._connect()
+            fresh = []
+            for vector_id, content in chunks:
+                if (namespace, vector_id) in self.doc_ordinals:
+                    continue
+                self._index(namespace, vector_id, content)
+                fresh.append((namespace, vector_id, content))
+
+            if fresh:
+                db.executemany("INSERT OR REPLACE INTO namespaced_chunks (namespace, id, content) VALUES (?, ?, ?)", fresh)
+                db.commit()
+
+    def remove(
+        self,
+        vector_ids: Iterable[str],
+        namespace: Optional[str] = None
+    ):
+        """Drop chunks of the namespace from the index - unknown ids are ignored"""
+        namespace = namespace or config.PINECONE_NAMESPACE
+        with self._lock:
+            removed = []
+            for vector_id in vector_ids:
+                ordinal = self.doc_ordinals.pop((namespace, vector_id), None)
+                if ordinal is None:
+                    continue
+                self.deleted[ordinal] = 1
+                for term_id in self.doc_terms[ordinal]:
+                    self.doc_freq[term_id] -= 1
+                self.doc_terms[ordinal] = array("I")
+                self.live_docs -= 1
+                self.total_length -= self.doc_lengths[ordinal]
+                removed.append(vector_id)
+
+            if removed:
+                db = self._connect()
+                for i in range(0, len(removed), 500):
+                    batch = removed[i:i + 500]
+                    db.execute(
+                        f"DELETE FROM namespaced_chunks WHERE namespace = ? AND id IN ({','.join('?' * len(batch))})",
+                        [namespace, *batch]
+                    )
+                db.commit()
+
+            tombstones = len(self.doc_ids) - self.live_docs
+            if tombstones > 1000 and tombstones > self.live_docs:
+                self._compact()
+
+    def remove_namespace(self, namespace: str):
+        """Drop every chunk of a namespace"""
+        with self._lock:
+            code = self.namespace_codes.get(namespace)
+            if code is None:
+                return
+            vector_ids = [vector_id for (_, vector_id), ordinal in self.doc_ordinals.items() if self.doc_namespaces[ordinal] == code]
+        self.remove(vector_ids, namespace)
+
+    def _compact(self):
+        """Rewrite the postings without the tombstoned documents"""
+        live = np.frombuffer(self.deleted, dtype = np.uint8) == 0
+        remap = (np.cumsum(live) - 1).astype(np.uint32)
+
+        for term_id in range(len(self.postings_docs)):
+            docs = np.frombuffer(self.postings_docs[term_id], dtype = np.uint32)
+            tfs = np.frombuffer(self.postings_tfs[term_id], dtype = np.uint16)
+            keep = live[docs]
+            compacted_docs = array("I", remap[docs[keep]].tobytes())
+            compacted_tfs = array("H", tfs[keep].tobytes())
+            del docs, tfs
+            self.postings_docs[term_id] = compacted_docs
+            self.postings_tfs[term_id] = compacted_tfs
+
+        keep = live.tolist()
+        del live
+        self.doc_ids = [vector_id for vector_id, alive in zip(self.doc_ids, keep) if alive]
+        self.doc_terms = [terms for terms, alive in zip(self.doc_terms, keep) if alive]
+        self.doc_namespaces = array("H", (code for code, alive in zip(self.doc_namespaces, keep) if alive))
+        self.doc_lengths = array("I", (length for length, alive in zip(self.doc_lengths, keep) if alive))
+        namespaces = {code: namespace for namespace, code in self.namespace_codes.items()}
+        self.doc_ordinals = {
+            (namespaces[code], vector_id): ordinal
+            for ordinal, (code, vector_id) in enumerate(zip(self.doc_namespaces, self.doc_ids))
+        }
+        self.deleted = bytearray(len(self.doc_ids))
+
+    def search(
+        self,
+        query: str,
+        top_k: int,
+        namespace: Optional[str] = None
+    ) -> List[dict]:
+        """BM25 ranked chunks of the namespace for the query - [{id, score, metadata: {content}}], best first"""
+        namespace = namespace or config.PINECONE_NAMESPACE
+        with self._lock:
+            code = self.namespace_codes.get(namespace)
+            if not self.live_docs or code is None:
+                return []
+
+            term_ids = {self.term_ids[token] for token in tokenize(query) if token in self.term_ids}
+            if not term_ids:
+                return []
+
+            doc_lengths = np.frombuffer(self.doc_lengths, dtype = np.uint32).astype(np.float32)
+            average_length = self.total_length / self.live_docs
+            scores = np.zeros(len(self.doc_ids), dtype = np.float32)
+
+            for term_id in term_ids:
+                doc_freq = self.doc_freq[term_id]
+                if doc_freq <= 0:
+                    continue
+                idf = math.log(1 + (self.live_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+                docs = np.frombuffer(self.postings_docs[term_id], dtype = np.uint32)
+                tfs = np.frombuffer(self.postings_tfs[term_id], dtype = np.uint16).astype(np.float32)
+                norm = K1 * (1 - B + B * doc_lengths[docs] / average_length)
+                scores[docs] += idf * tfs * (K1 + 1) / (tfs + norm)
+                del docs
+
+            scores[np.frombuffer(self.deleted, dtype = np.uint8) == 1] = 0
+            if len(self.namespace_codes) > 1:
+                scores[np.frombuffer(self.doc_namespaces, dtype = np.uint16) != code] = 0
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > top_k:
+                candidates = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+            candidates = candidates[np.argsort(-scores[candidates], kind = "stable")]
+
+            ids = [self.doc_ids[ordinal] for ordinal in candidates]
+            placeholders = ",".join("?" * len(ids))
+            contents = dict(self._connect().execute(
+                f"SELECT id, content FROM namespaced_chunks WHERE namespace = ? AND id IN ({placeholders})", [namespace, *ids]
+            ).fetchall()) if ids else {}
+
+            return [
+                {"id": vector_id, "score": float(scores[ordinal]), "metadata": {"content": contents.get(vector_id, "")}}
+                for vector_id, ordinal in zip(ids, candidates)
+            ]
+
+    def stats(self) -> dict:
+        return {
+            "chunks": self.live_docs,
+            "tombstones": len(self.doc_ids) - self.live_docs,
+            "terms": len(self.term_ids),
+            "namespaces": len(self.namespace_codes),
+            "postings": sum(len(docs) for docs in self.postings_docs),
+        }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+lexical_index = LexicalIndex(db_path = config.LEXICAL_INDEX_PATH)
@@ -0,0 +1,60 @@
+from collections import deque
+import asyncio
+import time
+
+
+class LoopLagMonitor:
+    """
+    Measures event loop lag - how late a periodic sleep wakes up.
+    A responsive loop stays in the low milliseconds, blocking work on the loop shows up as spikes.
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.1,
+        window: int = 600
+    ):
+        self.interval = interval
+        self.samples = deque(maxlen = window)
+        self.max_lag = 0.0
+        self.task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions = True)
+            self.task = None
+
+    def stats(self) -> dict:
+        """Lag statistics (milliseconds) over the recent window"""
+        samples = sorted(self.samples)
+        if not samples:
+            return {"samples": 0}
+
+        def percentile(p: float) -> float:
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 2)
+
+        return {
+            "samples": len(samples),
+            "interval_ms": self.interval * 1000,
+            "mean_ms": round(sum(samples) / len(samples) * 1000, 2),
+            "p50_ms": percentile(0.50),
+            "p99_ms": percentile(0.99),
+            "window_max_ms": round(samples[-1] * 1000, 2),
+            "max_ms": round(self.max_lag * 1000, 2),
+        }
+
+
+loop_lag_monitor = LoopLagMonitor()
@@ -0,0 +1,183 @@
+from typing import AsyncIterator, TypeVar
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Prometheus metrics of the API and of every pipeline stage, published on /metrics.
+# Keep the hot path cheap: label children are bound once here, metrics are recorded per request /
+# batch / API call (never per token) and the exposition text is only rendered when scraped.
+
+T = TypeVar("T")
+
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+REQUEST_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+# ---- HTTP ----
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "rag_http_request_seconds",
+    "HTTP request duration, until the last byte of the (possibly streamed) response",
+    ["method", "route", "status"],
+    buckets = REQUEST_BUCKETS
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge("rag_http_requests_in_flight", "HTTP requests being served")
+CHAT_STREAMS_IN_FLIGHT = Gauge("rag_chat_streams_in_flight", "/chat answers being generated / streamed")
+
+# ---- ingestion ----
+
+EXTRACTION_SECONDS = Histogram(
+    "rag_extraction_seconds",
+    "Text extraction time of one file (time spent waiting on the parser)",
+    ["parser"],
+    buckets = SLOW_BUCKETS
+)
+EXTRACTION_SHARD_SECONDS = Histogram(
+    "rag_extraction_shard_seconds",
+    "Gemini extraction time of one PDF page range shard, retries included",
+    buckets = SLOW_BUCKETS
+)
+EXTRACTION_SHARD_RETRIES = Counter("rag_extraction_shard_retries_total", "PDF page range shards retried after a failed extraction")
+CHUNKING_SECONDS = Histogram("rag_chunking_seconds", "Duration of one chunking (split) call", buckets = FAST_BUCKETS)
+EMBEDDING_SECONDS = Histogram(
+    "rag_embedding_seconds",
+    "Latency of one embed_content API call",
+    ["priority"],
+    buckets = REQUEST_BUCKETS
+)
+UPSERT_SECONDS = Histogram(
+    "rag_upsert_seconds",
+    "Upsert latency of one vector batch, retries included",
+    buckets = REQUEST_BUCKETS
+)
+UPSERT_RETRIES = Counter("rag_upsert_retries_total", "Upsert batches retried after throttling / transient errors")
+INGESTION_JOB_SECONDS = Histogram(
+    "rag_ingestion_job_seconds",
+    "Duration of an ingestion job",
+    ["status"],
+    buckets = SLOW_BUCKETS
+)
+INGESTION_JOBS_IN_FLIGHT = Gauge("rag_ingestion_jobs_in_flight", "Ingestion jobs being processed")
+INGESTION_JOBS_QUEUED = Gauge("rag_ingestion_jobs_queued", "Ingestion jobs waiting for a worker")
+EMBEDDING_REQUESTS_IN_FLIGHT = Gauge("rag_embedding_requests_in_flight", "embed_content API calls in flight")
+UPSERT_REQUESTS_IN_FLIGHT = Gauge("rag_upsert_requests_in_flight", "Upsert batches in flight")
+
+# ---- chat ----
+
+QUERY_EMBEDDING_SECONDS = Histogram(
+    "rag_query_embedding_seconds",
+    "Query embedding time in /chat (cache lookup and micro-batching window included)",
+    buckets = REQUEST_BUCKETS
+)
+RETRIEVAL_SECONDS = Histogram(
+    "rag_retrieval_seconds",
+    "Retrieval time per step - dense (Pinecone), lexical (BM25), fetch (vectors for MMR), assembly, total",
+    ["step"],
+    buckets = FAST_BUCKETS
+)
+LLM_TTFT_SECONDS = Histogram(
+    "rag_llm_ttft_seconds",
+    "Time from the Gemini request to its first streamed token",
+    ["purpose"],
+    buckets = REQUEST_BUCKETS
+)
+LLM_STREAM_SECONDS = Histogram(
+    "rag_llm_stream_seconds",
+    "Total Gemini stream time, from the request to the last token",
+    ["purpose"],
+    buckets = SLOW_BUCKETS
+)
+
+# ---- counters ----
+
+LLM_TOKENS = Counter("rag_llm_tokens_total", "Gemini tokens", ["purpose", "kind"])
+CHUNKS = Counter("rag_chunks_total", "Chunks handled by the ingestion pipeline", ["outcome"])
+VECTORS = Counter("rag_vectors_total", "Vectors written to / read from / deleted in the vector index", ["operation"])
+EMBEDDING_TEXTS = Counter("rag_embedding_texts_total", "Texts embedded, by where the vector came from", ["source"])
+
+# bound label children - the hot path skips the label lookup
+EMBEDDING_SECONDS_INTERACTIVE = EMBEDDING_SECONDS.labels("interactive")
+EMBEDDING_SECONDS_BULK = EMBEDDING_SECONDS.labels("bulk")
+RETRIEVAL_DENSE_SECONDS = RETRIEVAL_SECONDS.labels("dense")
+RETRIEVAL_LEXICAL_SECONDS = RETRIEVAL_SECONDS.labels("lexical")
+RETRIEVAL_FETCH_SECONDS = RETRIEVAL_SECONDS.labels("fetch")
+RETRIEVAL_ASSEMBLY_SECONDS = RETRIEVAL_SECONDS.labels("assembly")
+RETRIEVAL_TOTAL_SECONDS = RETRIEVAL_SECONDS.labels("total")
+CHUNKS_PRODUCED = CHUNKS.labels("produced")
+CHUNKS_DEDUPLICATED = CHUNKS.labels("deduplicated")
+CHUNKS_UNCHANGED = CHUNKS.labels("unchanged")
+CHUNKS_EMBEDDED = CHUNKS.labels("embedded")
+CHUNKS_RESUMED = CHUNKS.labels("resumed")
+VECTORS_UPSERTED = VECTORS.labels("upserted")
+VECTORS_FETCHED = VECTORS.labels("fetched")
+VECTORS_DELETED = VECTORS.labels("deleted")
+VECTORS_COLLECTED = VECTORS.labels("collected")
+EMBEDDING_TEXTS_CACHED = EMBEDDING_TEXTS.labels("cache")
+EMBEDDING_TEXTS_API = EMBEDDING_TEXTS.labels("api")
+
+
+def record_llm_usage(purpose: str, usage_metadata):
+    """Count the prompt / output tokens Gemini reported for a request"""
+    if usage_metadata is None:
+        return
+    if usage_metadata.prompt_token_count:
+        LLM_TOKENS.labels(purpose, "input").inc(usage_metadata.prompt_token_count)
+    if usage_metadata.candidates_token_count:
+        LLM_TOKENS.labels(purpose, "output").inc(usage_metadata.candidates_token_count)
+
+
+async def timed_stream(
+    stream: AsyncIterator[T],
+    purpose: str,
+    started: float
+) -> AsyncIterator[T]:
+    """Pass a Gemini stream through, recording its time to first chunk and total stream time"""
+    first = True
+    async for item in stream:
+        if first:
+            LLM_TTFT_SECONDS.labels(purpose).observe(time.perf_counter() - started)
+            first = False
+        yield item
+    LLM_STREAM_SECONDS.labels(purpose).observe(time.perf_counter() - started)
+
+
+def render_metrics() -> tuple:
+    """Exposition text and its content type"""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no per-request task or body buffering like BaseHTTPMiddleware) - in-flight
+    gauge and duration per route template, so path parameters never become label values.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                str(status)
+            ).observe(time.perf_counter() - started)
@@ -15,6 +15,32 @@ async def connect_to_mongodb():
         print(f"== Failed to connect to mongodb: {e} ==")
         raise Exception(f"Failed to connect to mongodb: {e}")
     
+async def create_mongodb_indexes():
+    """Creates the indexes used by the listing, content, dedup, ingestion journal and chat session queries (no-op when they exist)"""
+    try:
+        db = get_mongodb()
+        await db.knowledge_base.create_index("knowledge_base_id", unique = True)
+        await db.knowledge_base.create_index("created_at")
+        await db.knowledge_base.create_index([("created_at", -1), ("knowledge_base_id", -1)])
+        await db.knowledge_base.create_index("file_hash")
+        await db.knowledge_base_content.create_index([("knowledge_base_id", 1), ("seq", 1)])
+        await db.knowledge_base_content.create_index([("knowledge_base_id", 1), ("offset", 1)])
+        await db.ingestion_journal.create_index("journal_id", unique = True)
+        await db.ingestion_journal.create_index([("file_hash", 1), ("status", 1)])
+        await db.ingestion_journal.create_index("expires_at")
+        await db.ingestion_journal_chunks.create_index([("journal_id", 1), ("vector_id", 1)], unique = True)
+        await db.chat_sessions.create_index("session_id", unique = True)
+        await db.chat_sessions.create_index("updated_at", expireAfterSeconds = config.CHAT_SESSION_TTL_SECONDS)
+        await db.chat_messages.create_index([("session_id", 1), ("seq", 1)], unique = True)
+        # messages expire with their session, not by their own age (see services/chat_sessions.py)
+        if "created_at_1" in await db.chat_messages.index_information():
+            await db.chat_messages.drop_index("created_at_1")
+        await db.chat_messages.create_index("session_updated_at", expireAfterSeconds = config.CHAT_SESSION_TTL_SECONDS)
+
+    except Exception as e:
+        print(f"== Failed to create mongodb indexes: {e} ==")
+        raise Exception(f"Failed to create mongodb indexes: {e}")
+    
 def get_mongodb():
     """Dependency function to get the mongodb client instance"""
     if mongodb_instance is None:
@@ -1,22 +1,77 @@
+from typing import AsyncIterator, List, Optional
+import asyncio
+import re
+
 from pinecone import Pinecone
 
 from config import config
+from services.metrics import VECTORS_FETCHED, VECTORS_DELETED
+from services.vector_index import LocalVectorIndex
+
+# Pinecone takes at most this many ids per delete request
+DELETE_BATCH_SIZE = 1000
+
+# tenants / courses get a namespace each - retrieval in one never scans the vectors of the others
+NAMESPACE_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
 
 pinecone_client: Pinecone = None
 pinecone_index = None
 
 async def connect_to_pinecone():
-    """Establishes the Pinecone connection"""
+    """Establishes the vector index connection (hosted Pinecone or the local index)"""
     global pinecone_client, pinecone_index
 
     try:
-        pinecone_client = Pinecone(api_key = config.PINECONE_API_KEY)
-        pinecone_index = pinecone_client.IndexAsyncio(host = config.PINECONE_HOST)
+        match config.VECTOR_BACKEND:
+            case "pinecone":
+                pinecone_client = Pinecone(api_key = config.PINECONE_API_KEY)
+                pinecone_index = pinecone_client.IndexAsyncio(host = config.PINECONE_HOST)
+            case "local":
+                pinecone_index = LocalVectorIndex(
+                    path = config.LOCAL_INDEX_PATH,
+                    dimension = config.LOCAL_INDEX_DIMENSION,
+                    ivf_lists = config.LOCAL_INDEX_IVF_LISTS,
+                    ivf_probes = config.LOCAL_INDEX_IVF_PROBES
+                )
+            case _:
+                raise ValueError(f"Unknown vector backend '{config.VECTOR_BACKEND}'")
     
     except Exception as e:
         print(f"== Failed to connect to Pinecone: {e} ==")
         raise RuntimeError(f"Failed to connect to Pinecone: {e}")
 
+async def close_pinecone_connection():
+    """Closes the vector index connection"""
+    global pinecone_index
+    try:
+        if pinecone_index is not None:
+            await pinecone_index.close()
+            pinecone_index = None
+
+    except Exception as e:
+        print(f"== Failed to close Pinecone connection: {e} ==")
+        raise RuntimeError(f"Failed to close Pinecone connection: {e}")
+
+def resolve_namespace(namespace: Optional[str] = None) -> str:
+    """The namespace of a tenant / course - PINECONE_NAMESPACE when none is given, raises ValueError for invalid names"""
+    if not namespace:
+        return config.PINECONE_NAMESPACE
+    if not NAMESPACE_PATTERN.match(namespace):
+        raise ValueError(f"Invalid namespace '{namespace}' - use up to 64 letters, digits, '-' or '_'.")
+    return namespace
+
+def vector_key(
+    namespace: Optional[str],
+    vector_id: str
+) -> str:
+    """
+    Key of a vector across namespaces (vector_refs ids) - vector ids are content
+    hashes, so the same chunk in two namespaces is two vectors. Keys in the default namespace are
+    the bare vector id, which is what everything stored before namespaces uses.
+    """
+    namespace = namespace or config.PINECONE_NAMESPACE
+    return vector_id if namespace == config.PINECONE_NAMESPACE else f"{namespace}:{vector_id}"
+
 def get_pinecone():
     """Dependency function to get the Pinecone client instance"""
     if pinecone_index is None:
@@ -25,12 +80,14 @@ def get_pinecone():
     
     return pinecone_index
 
-async def query_records(
+async def query_matches(
     vector: list,
     top_k: int,
-    namespace: str = "diploma_studies_project"
-):
-    """Fetch context from Pinecone DB"""
+    namespace: Optional[str] = None,
+    include_values: bool = False,
+    filter: Optional[dict] = None
+) -> list:
+    """Fetch the nearest chunks from Pinecone DB - [{id, score, metadata, values?}], best first"""
     try:
         print(f"== Pinecone query record called ==")
 
@@ -39,58 +96,138 @@ async def query_records(
             raise RuntimeError("Pinecone connection not initiated")
         
         result = await pinecone_index.query(
-            namespace = namespace,
+            namespace = namespace or config.PINECONE_NAMESPACE,
             vector = vector,
             top_k = top_k,
-            include_metadata = True
+            filter = filter,
+            include_metadata = True,
+            include_values = include_values
         )
 
-        embedding_context = ""
+        matches = []
         for match in result['matches']:
-            embedding_context = embedding_context + match['metadata']['content']
+            matches.append({"id": match['id'], "score": match['score'], "metadata": match['metadata']})
+            if include_values:
+                matches[-1]["values"] = match['values']
 
-        return embedding_context
+        return matches
 
     except Exception as e:
         print(f"== An error while fetching context from pinecone: {e} ==")
         raise Exception(f"An error while fetching context from pinecone: {e}")
 
-async def upsert_records(
-    vector: list,
-    namespace: str = "diploma_studies_project"   
-) -> bool:
+async def fetch_records(
+    pinecone_ids: list,
+    namespace: Optional[str] = None
+) -> dict:
+    """Fetch stored vectors by id with their metadata - {id: {values, metadata}}, missing ids are left out"""
     try:
-        print(f"== Pinecone upsert called ==")
-        
         if pinecone_index is None:
             print(f"== Pinecone connection not initiated ==")
             raise RuntimeError("Pinecone connection not initiated")
 
-        await pinecone_index.upsert(
-            vectors = vector,
-            namespace = namespace
-        )
+        records = {}
+        # fetch takes the ids in the url - keep the requests small
+        for i in range(0, len(pinecone_ids), 100):
+            result = await pinecone_index.fetch(
+                ids = pinecone_ids[i:i + 100],
+                namespace = namespace or config.PINECONE_NAMESPACE
+            )
+            for vector_id, vector in result['vectors'].items():
+                records[vector_id] = {"values": vector['values'], "metadata": vector.get('metadata') or {}}
+        VECTORS_FETCHED.inc(len(records))
 
-        return True
+        return records
 
     except Exception as e:
-        print(f"== An error occured while upserting vectors to pineconeDB: {e} ==")
-        return False
-    
+        print(f"== An error while fetching vectors from pinecone: {e} ==")
+        raise Exception(f"An error while fetching vectors from pinecone: {e}")
+
 async def delete_pinecone_vectors(
-    pinecone_ids,
-    namespace: str = "diploma_studies_project"
+    pinecone_ids: List[str],
+    namespace: Optional[str] = None
 ):
+    """Delete vectors by id - DELETE_BATCH_SIZE ids per request, VECTOR_DELETE_CONCURRENCY requests at once"""
     try:
         print("==Pinecone delete called==")
         if pinecone_index is None:
             raise Exception("Pinecone connection not initiated") 
-        
+
+        semaphore = asyncio.Semaphore(max(1, config.VECTOR_DELETE_CONCURRENCY))
+
+        async def delete_batch(batch: List[str]):
+            async with semaphore:
+                await pinecone_index.delete(
+                    ids = batch,
+                    namespace = namespace or config.PINECONE_NAMESPACE
+                )
+                VECTORS_DELETED.inc(len(batch))
+
+        # a failed batch leaves its vectors behind - the vector garbage collector purges them later
+        await asyncio.gather(*(
+            delete_batch(pinecone_ids[i:i + DELETE_BATCH_SIZE])
+            for i in range(0, len(pinecone_ids), DELETE_BATCH_SIZE)
+        ))
+    
+    except Exception as e:
+        print(f"== Error while deleting the vectors: {e} ==")
+        raise Exception(f"Error while deleting the vectors: {e}")
+
+async def delete_pinecone_vectors_by_filter(
+    filter: dict,
+    namespace: Optional[str] = None
+):
+    """Delete every vector whose metadata matches `filter` in one request"""
+    try:
+        print(f"== Pinecone delete by filter called: {filter} ==")
+        if pinecone_index is None:
+            raise Exception("Pinecone connection not initiated")
+
         await pinecone_index.delete(
-            ids = pinecone_ids,
-            namespace = namespace
+            filter = filter,
+            namespace = namespace or config.PINECONE_NAMESPACE
         )
-    
+
     except Exception as e:
         print(f"== Error while deleting the vectors: {e} ==")
-        raise Exception(f"Error while deleting the vectors: {e}")
\ No newline at end of file
+        raise Exception(f"Error while deleting the vectors: {e}")
+
+async def iter_pinecone_ids(
+    namespace: Optional[str] = None,
+    page_size: int = 100
+) -> AsyncIterator[List[str]]:
+    """Every vector id of the namespace, one page at a time"""
+    if pinecone_index is None:
+        print(f"== Pinecone connection not initiated ==")
+        raise RuntimeError("Pinecone connection not initiated")
+
+    async for ids in pinecone_index.list(namespace = namespace or config.PINECONE_NAMESPACE, limit = page_size):
+        yield ids
+
+async def delete_namespace(namespace: str):
+    """Drop every vector of a namespace in one request"""
+    try:
+        print(f"== Pinecone namespace drop called: {namespace} ==")
+        if pinecone_index is None:
+            raise Exception("Pinecone connection not initiated")
+
+        await pinecone_index.delete(
+            delete_all = True,
+            namespace = namespace
+        )
+
+    except Exception as e:
+        print(f"== Error while dropping the namespace: {e} ==")
+        raise Exception(f"Error while dropping the namespace: {e}")
+
+async def list_namespaces() -> dict:
+    """{namespace: vector count} of the index"""
+    if pinecone_index is None:
+        print(f"== Pinecone connection not initiated ==")
+        raise RuntimeError("Pinecone connection not initiated")
+
+    stats = await pinecone_index.describe_index_stats()
+    return {
+        namespace: summary["vector_count"]
+        for namespace, summary in stats["namespaces"].items()
+    }
@@ -0,0 +1,281 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import time
+
+import numpy as np
+
+from config import config
+from services.content_processing import generateEmbeddings, PRIORITY_INTERACTIVE
+from services.context_assembly import assemble_context
+from services.lexical_index import lexical_index
+from services.metrics import (
+    RETRIEVAL_DENSE_SECONDS, RETRIEVAL_LEXICAL_SECONDS, RETRIEVAL_FETCH_SECONDS, RETRIEVAL_ASSEMBLY_SECONDS,
+    RETRIEVAL_TOTAL_SECONDS
+)
+from services.pinecone import query_matches, fetch_records, resolve_namespace
+
+# candidates fetched per wanted match when the results have to be checked for knowledge base membership
+SCOPE_OVERFETCH = 4
+
+
+@dataclass
+class RetrievalScope:
+    """
+    What a query searches - one namespace, optionally only some of its knowledge bases. The dense
+    query is filtered on the owners of their vectors; when the owners are unknown or include other
+    knowledge bases (chunks shared across knowledge bases) the matches are also checked against the
+    knowledge bases' chunk lists.
+    """
+    namespace: str
+    knowledge_base_ids: Optional[List[str]] = None # None = the whole namespace
+    owners: Optional[List[str]] = None # None = some vectors predate owner tagging
+    db: object = field(default = None, repr = False)
+
+    @property
+    def limited(self) -> bool:
+        return self.knowledge_base_ids is not None
+
+    @property
+    def exact(self) -> bool:
+        """The owner filter alone returns only chunks of the selected knowledge bases"""
+        return self.owners is not None and set(self.owners) <= set(self.knowledge_base_ids)
+
+    def cache_key(self) -> str:
+        """Answers depend on the scope - part of the answer cache fingerprint"""
+        if not self.limited:
+            return self.namespace
+        return f"{self.namespace}|{','.join(sorted(self.knowledge_base_ids))}"
+
+    async def members(self, matches: List[dict]) -> List[dict]:
+        """The matches that are chunks of the selected knowledge bases, in order"""
+        ids = list(dict.fromkeys(match["id"] for match in matches))
+        if not ids:
+            return []
+        member_ids: Set[str] = set()
+        async for knowledge_base in self.db.knowledge_base.aggregate([
+            {"$match": {"knowledge_base_id": {"$in": self.knowledge_base_ids}}},
+            {"$project": {"_id": 0, "hits": {"$setIntersection": [{"$ifNull": ["$pinecone_id_list", []]}, ids]}}}
+        ]):
+            member_ids.update(knowledge_base["hits"])
+        return [match for match in matches if match["id"] in member_ids]
+
+
+async def resolve_scope(
+    db,
+    namespace: Optional[str] = None,
+    knowledge_base_ids: Optional[List[str]] = None
+) -> RetrievalScope:
+    """
+    Scope of a chat request - raises ValueError for an invalid namespace, unknown knowledge bases or
+    knowledge bases of another namespace. Without a namespace the knowledge bases' one is used.
+    """
+    if not knowledge_base_ids:
+        return RetrievalScope(namespace = resolve_namespace(namespace))
+
+    knowledge_base_ids = list(dict.fromkeys(knowledge_base_ids))
+    knowledge_bases = await db.knowledge_base.find(
+        {"knowledge_base_id": {"$in": knowledge_base_ids}},
+        {"_id": 0, "knowledge_base_id": 1, "namespace": 1, "vector_owners": 1}
+    ).to_list(length = None)
+    missing = set(knowledge_base_ids) - {knowledge_base["knowledge_base_id"] for knowledge_base in knowledge_bases}
+    if missing:
+        raise ValueError(f"Knowledge bases not found: {', '.join(sorted(missing))}")
+
+    namespaces = {knowledge_base.get("namespace") or config.PINECONE_NAMESPACE for knowledge_base in knowledge_bases}
+    if len(namespaces) > 1:
+        raise ValueError("The knowledge bases belong to different namespaces.")
+    knowledge_base_namespace = namespaces.pop()
+    if namespace and resolve_namespace(namespace) != knowledge_base_namespace:
+        raise ValueError(f"The knowledge bases are not in namespace '{namespace}'.")
+
+    owners = set()
+    for knowledge_base in knowledge_bases:
+        if knowledge_base.get("vector_owners") is None:
+            owners = None
+            break
+        owners.update(knowledge_base["vector_owners"])
+
+    return RetrievalScope(
+        namespace = knowledge_base_namespace,
+        knowledge_base_ids = knowledge_base_ids,
+        owners = sorted(owners) if owners is not None else None,
+        db = db
+    )
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[dict]],
+    top_k: int,
+    k: int = 60
+) -> List[dict]:
+    """
+    Fuse ranked match lists - every list contributes 1 / (k + rank) per match, so only the ranks
+    matter and the (incomparable) cosine and BM25 scores never have to be normalised.
+    """
+    scores: Dict[str, float] = {}
+    matches: Dict[str, dict] = {}
+    for ranking in rankings:
+        for rank, match in enumerate(ranking, start = 1):
+            scores[match["id"]] = scores.get(match["id"], 0.0) + 1 / (k + rank)
+            # keep the match that carries the vector values, if any list has them
+            if match["id"] not in matches or "values" in match and "values" not in matches[match["id"]]:
+                matches[match["id"]] = match
+
+    fused = sorted(scores, key = scores.get, reverse = True)[:top_k]
+    return [{**matches[vector_id], "score": scores[vector_id]} for vector_id in fused]
+
+
+async def dense_search(
+    query: str,
+    top_k: int,
+    include_values: bool = False,
+    vector: Optional[list] = None,
+    scope: Optional[RetrievalScope] = None
+) -> List[dict]:
+    if vector is None:
+        embedding = await generateEmbeddings([query], priority = PRIORITY_INTERACTIVE)
+        vector = embedding[0]
+
+    filter = None
+    depth = top_k
+    if scope is not None and scope.limited:
+        if scope.owners is not None:
+            filter = {"knowledge_base_id": {"$in": scope.owners}}
+        if not scope.exact:
+            depth = top_k * SCOPE_OVERFETCH
+
+    with RETRIEVAL_DENSE_SECONDS.time():
+        matches = await query_matches(
+            vector = vector,
+            top_k = depth,
+            namespace = scope.namespace if scope is not None else None,
+            include_values = include_values,
+            filter = filter
+        )
+        if scope is not None and scope.limited and not scope.exact:
+            matches = (await scope.members(matches))[:top_k]
+        return matches
+
+
+async def lexical_search(
+    query: str,
+    top_k: int,
+    scope: Optional[RetrievalScope] = None
+) -> List[dict]:
+    with RETRIEVAL_LEXICAL_SECONDS.time():
+        if scope is None:
+            return await asyncio.to_thread(lexical_index.search, query, top_k)
+
+        # the lexical index knows namespaces, not knowledge bases
+        depth = top_k * SCOPE_OVERFETCH if scope.limited else top_k
+        matches = await asyncio.to_thread(lexical_index.search, query, depth, scope.namespace)
+        if scope.limited:
+            matches = (await scope.members(matches))[:top_k]
+        return matches
+
+
+async def retrieve(
+    query: str,
+    top_k: int,
+    mode: str = config.RETRIEVAL_MODE,
+    include_values: bool = False,
+    vector: Optional[list] = None,
+    scope: Optional[RetrievalScope] = None
+) -> List[dict]:
+    """
+    Fetch the chunks for a query - "dense" (Pinecone only) or "hybrid": the dense and the BM25 lexical
+    search run concurrently, each returns RETRIEVAL_CANDIDATES matches and the lists are fused with RRF.
+    `vector` is the query embedding, when the caller already has it. `scope` limits the search to a
+    namespace / knowledge bases, the default namespace is searched without one.
+    """
+    if mode == "dense":
+        return await dense_search(query, top_k, include_values, vector, scope)
+
+    # the fused list can hold up to twice the depth of each retriever
+    candidates = max(config.RETRIEVAL_CANDIDATES, (top_k + 1) // 2)
+    dense, lexical = await asyncio.gather(
+        dense_search(query, candidates, include_values, vector, scope),
+        lexical_search(query, candidates, scope),
+        return_exceptions = True
+    )
+
+    # one retriever failing degrades to the other one
+    if isinstance(dense, BaseException) and isinstance(lexical, BaseException):
+        raise dense
+    if isinstance(lexical, BaseException):
+        print(f"== Lexical search failed, using dense results only: {lexical} ==")
+        lexical = []
+    if isinstance(dense, BaseException):
+        print(f"== Dense search failed, using lexical results only: {dense} ==")
+        dense = []
+
+    return reciprocal_rank_fusion([dense, lexical], top_k, k = config.RRF_K)
+
+
+async def build_context(
+    query: str,
+    vector: Optional[list] = None,
+    scope: Optional[RetrievalScope] = None
+) -> Tuple[str, dict]:
+    """
+    Retrieve CONTEXT_CANDIDATES matches with their vectors and assemble the prompt context from them
+    (MMR de-duplication, merged neighbours, CONTEXT_TOKEN_BUDGET). Returns the context and its stats -
+    including the ids of the chunks used and, given the query embedding, their lowest cosine similarity.
+    """
+    started = time.perf_counter()
+    matches = await retrieve(
+        query = query,
+        top_k = config.CONTEXT_CANDIDATES,
+        include_values = True,
+        vector = vector,
+        scope = scope
+    )
+
+    # lexical only matches come with the chunk text alone - fetch their values so MMR can compare every
+    # candidate, and their metadata so the context labels them with their source file and pages
+    missing = [match["id"] for match in matches if not match.get("values")]
+    if missing:
+        try:
+            with RETRIEVAL_FETCH_SECONDS.time():
+                fetched = await fetch_records(missing, scope.namespace if scope is not None else None)
+            for match in matches:
+                if match["id"] in fetched:
+                    match["values"] = fetched[match["id"]]["values"]
+                    match["metadata"] = {**fetched[match["id"]]["metadata"], **(match.get("metadata") or {})}
+        except Exception as e:
+            print(f"== Could not fetch vectors for MMR, treating them as distinct: {e} ==")
+
+    vectors = None
+    dimension = max((len(match.get("values") or []) for match in matches), default = 0)
+    if dimension:
+        vectors = np.zeros((len(matches), dimension), dtype = np.float32)
+        for row, match in enumerate(matches):
+            if match.get("values"):
+                vectors[row] = match["values"]
+
+    with RETRIEVAL_ASSEMBLY_SECONDS.time():
+        context, stats = assemble_context(
+            matches = matches,
+            vectors = vectors,
+            max_chunks = config.CONTEXT_MAX_CHUNKS,
+            token_budget = config.CONTEXT_TOKEN_BUDGET,
+            lambda_mult = config.MMR_LAMBDA,
+            knowledge_base_ids = scope.knowledge_base_ids if scope is not None else None
+        )
+
+    stats["min_similarity"] = -1.0
+    if vector is not None and vectors is not None and stats["vector_ids"]:
+        used = set(stats["vector_ids"])
+        rows = vectors[[row for row, match in enumerate(matches) if match["id"] in used]]
+        norms = np.linalg.norm(rows, axis = 1) * np.linalg.norm(vector)
+        similarities = np.divide(
+            rows @ np.asarray(vector, dtype = np.float32), norms,
+            out = np.zeros(len(rows), dtype = np.float32),
+            where = norms > 0
+        )
+        stats["min_similarity"] = float(similarities.min())
+
+    RETRIEVAL_TOTAL_SECONDS.observe(time.perf_counter() - started)
+    return context, stats
+
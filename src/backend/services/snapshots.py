@@ -0,0 +1,498 @@
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+import asyncio
+import json
+import os
+import shutil
+import struct
+import tempfile
+import uuid
+
+import numpy as np
+
+from config import config
+from services.ingestion import discard_partial_ingest, namespace_filter
+from services.lexical_index import lexical_index
+from services.pinecone import fetch_records, resolve_namespace, vector_key
+from services.upsert_engine import upsert_engine
+from services.vector_refs import acquire_vector_refs, acknowledge_vector_refs
+
+# A snapshot is one file holding knowledge bases with their extracted text, chunks and embeddings, so they
+# can be moved to another index / namespace or restored without paying for the embeddings again:
+#
+#   b"RAGSNAP1" | header length (uint64) | JSON header | columns, each starting on a 64 byte boundary
+#
+# The header holds the knowledge base records and the dtype, shape and offset (from the end of the
+# header, aligned) of every column. Columns are plain little endian arrays, np.memmap-ed in place when
+# read. A text column is a utf-8 blob ("<name>.data") plus uint64 offsets ("<name>.offsets", rows + 1).
+#
+#   one row per vector:     ids, texts (chunk content), metadata (JSON, the rest of the vector metadata),
+#                           embeddings (float16, or int8 with float32 per-row `scales`)
+#   knowledge_base_rows:    the vector row of every chunk of every knowledge base, in chunk order
+#   one row per segment:    segments (extracted text), segment_metadata (JSON: seq, offset, size, pages)
+#
+# Each knowledge base record holds its [start, count] range of knowledge_base_rows and of the segments.
+SNAPSHOT_MAGIC = b"RAGSNAP1"
+SNAPSHOT_VERSION = 1
+ALIGNMENT = 64
+ENCODINGS = ("float16", "int8")
+TEXT_COLUMNS = ("ids", "texts", "metadata", "segments", "segment_metadata")
+
+# vectors fetched per window while exporting - in requests of 100 ids sent concurrently
+EXPORT_WINDOW = 1000
+# vectors read from the snapshot and handed to the upsert session at a time while importing
+IMPORT_BATCH = 1000
+
+# knowledge base fields carried over - chunk lists, references and ownership are rebuilt by the import
+RECORD_FIELDS = ("knowledge_base_id", "knowledge_base_name", "file_hash", "content_size", "created_at", "updated_at")
+
+
+def align(position: int) -> int:
+    return -(-position // ALIGNMENT) * ALIGNMENT
+
+
+def quantize(
+    embeddings: np.ndarray,
+    encoding: str
+):
+    """float32 rows -> (encoded rows, float32 per-row scales for int8 else None)"""
+    if encoding == "float16":
+        return embeddings.astype(np.float16), None
+
+    # symmetric int8 - every row is scaled by its largest absolute component
+    scales = np.abs(embeddings).max(axis = 1) / 127
+    scales[scales == 0] = 1
+    encoded = np.clip(np.rint(embeddings / scales[:, None]), -127, 127).astype(np.int8)
+    return encoded, scales.astype(np.float32)
+
+
+def dequantize(
+    rows: np.ndarray,
+    scales: Optional[np.ndarray] = None
+) -> np.ndarray:
+    values = np.asarray(rows, dtype = np.float32)
+    if scales is None:
+        return values
+    return values * np.asarray(scales, dtype = np.float32)[:, None]
+
+
+class SnapshotWriter:
+    """Builds a snapshot column by column - each column is spooled to its own temp file, memory stays flat"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.spool_dir = tempfile.mkdtemp(prefix = ".snapshot_", dir = os.path.dirname(os.path.abspath(path)))
+        self.columns: Dict[str, dict] = {}
+        self.text_offsets: Dict[str, array] = {}
+
+    def append(
+        self,
+        name: str,
+        rows: np.ndarray
+    ):
+        rows = np.ascontiguousarray(rows)
+        column = self.columns.get(name)
+        if column is None:
+            column = self.columns[name] = {
+                "file": open(os.path.join(self.spool_dir, name), "wb"),
+                "dtype": rows.dtype.newbyteorder("<").str,
+                "shape": [0, *rows.shape[1:]]
+            }
+        column["file"].write(rows.astype(column["dtype"], copy = False).tobytes())
+        column["shape"][0] += len(rows)
+
+    def append_text(
+        self,
+        name: str,
+        texts: Iterable[str]
+    ):
+        offsets = self.text_offsets.setdefault(name, array("Q", [0]))
+        data = []
+        for text in texts:
+            encoded = text.encode("utf-8")
+            data.append(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+        self.append(f"{name}.data", np.frombuffer(b"".join(data), dtype = np.uint8))
+
+    def finish(self, header: dict) -> int:
+        """Write the snapshot file (atomically), returns its size in bytes"""
+        for name, offsets in self.text_offsets.items():
+            self.append(f"{name}.offsets", np.frombuffer(offsets, dtype = np.uint64))
+
+        layout = {}
+        position = 0
+        for name, column in self.columns.items():
+            column["file"].close()
+            position = align(position)
+            layout[name] = {"dtype": column["dtype"], "shape": column["shape"], "offset": position}
+            position += os.path.getsize(column["file"].name)
+
+        encoded_header = json.dumps({**header, "columns": layout}).encode("utf-8")
+        partial_path = f"{self.path}.partial"
+        with open(partial_path, "wb") as out:
+            out.write(SNAPSHOT_MAGIC)
+            out.write(struct.pack("<Q", len(encoded_header)))
+            out.write(encoded_header)
+            data_start = align(out.tell())
+            for name, column in self.columns.items():
+                out.write(b"\0" * (data_start + layout[name]["offset"] - out.tell()))
+                with open(column["file"].name, "rb") as f:
+                    shutil.copyfileobj(f, out, 1024 * 1024)
+            size = out.tell()
+
+        os.replace(partial_path, self.path)
+        shutil.rmtree(self.spool_dir, ignore_errors = True)
+        return size
+
+    def abort(self):
+        for column in self.columns.values():
+            column["file"].close()
+        shutil.rmtree(self.spool_dir, ignore_errors = True)
+
+
+class Snapshot:
+    """A snapshot file opened for reading - columns are memory mapped, nothing is loaded up front"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError(f"Not a knowledge base snapshot: {path}")
+            (header_length,) = struct.unpack("<Q", f.read(8))
+            self.header = json.loads(f.read(header_length))
+
+        if self.header.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version: {self.header.get('version')}")
+        self.path = path
+        self.data_start = align(len(SNAPSHOT_MAGIC) + 8 + header_length)
+        self.mapped: Dict[str, np.ndarray] = {}
+
+    @property
+    def knowledge_bases(self) -> List[dict]:
+        return self.header["knowledge_bases"]
+
+    def column(self, name: str) -> np.ndarray:
+        if name not in self.mapped:
+            spec = self.header["columns"][name]
+            shape = tuple(spec["shape"])
+            if 0 in shape:
+                # an empty file region cannot be mapped
+                self.mapped[name] = np.zeros(shape, dtype = spec["dtype"])
+            else:
+                self.mapped[name] = np.memmap(
+                    self.path,
+                    dtype = spec["dtype"],
+                    mode = "r",
+                    offset = self.data_start + spec["offset"],
+                    shape = shape
+                )
+        return self.mapped[name]
+
+    def texts(
+        self,
+        name: str,
+        rows: Iterable[int]
+    ) -> List[str]:
+        data = self.column(f"{name}.data")
+        offsets = self.column(f"{name}.offsets")
+        return [bytes(data[offsets[row]:offsets[row + 1]]).decode("utf-8") for row in rows]
+
+    def embeddings(self, rows: np.ndarray) -> np.ndarray:
+        """float32 embeddings of the rows"""
+        scales = self.column("scales")[rows] if self.header["encoding"] == "int8" else None
+        return dequantize(self.column("embeddings")[rows], scales)
+
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+async def export_snapshot(
+    db,
+    path: str,
+    namespace: Optional[str] = None,
+    knowledge_base_ids: Optional[List[str]] = None,
+    encoding: str = config.SNAPSHOT_ENCODING
+) -> dict:
+    """
+    Write the knowledge bases of a namespace (or the given ones) to a snapshot file - the vectors are
+    read back from Pinecone with their metadata, the extracted text from knowledge_base_content
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown snapshot encoding '{encoding}', use one of: {', '.join(ENCODINGS)}")
+
+    if knowledge_base_ids:
+        selector = {"knowledge_base_id": {"$in": knowledge_base_ids}}
+    else:
+        selector = namespace_filter(resolve_namespace(namespace))
+    knowledge_bases = await db.knowledge_base.find(
+        selector,
+        {"_id": 0, "content": 0}
+    ).sort("created_at", 1).to_list(length = None)
+
+    if knowledge_base_ids:
+        missing = set(knowledge_base_ids) - {knowledge_base["knowledge_base_id"] for knowledge_base in knowledge_bases}
+        if missing:
+            raise ValueError(f"Knowledge bases not found: {', '.join(sorted(missing))}")
+    namespaces = {knowledge_base.get("namespace") or config.PINECONE_NAMESPACE for knowledge_base in knowledge_bases}
+    if len(namespaces) > 1:
+        raise ValueError("The knowledge bases belong to different namespaces - export them one namespace at a time.")
+    source_namespace = namespaces.pop() if namespaces else resolve_namespace(namespace)
+
+    writer = SnapshotWriter(path)
+    try:
+        for name in TEXT_COLUMNS:
+            writer.append_text(name, [])
+
+        # chunks shared by several knowledge bases are stored once
+        vector_ids = list(dict.fromkeys(
+            vector_id for knowledge_base in knowledge_bases for vector_id in knowledge_base.get("pinecone_id_list") or []
+        ))
+        rows: Dict[str, int] = {}
+        dimension = 0
+        for i in range(0, len(vector_ids), EXPORT_WINDOW):
+            window = vector_ids[i:i + EXPORT_WINDOW]
+            records = {}
+            for fetched in await asyncio.gather(*[
+                fetch_records(window[j:j + 100], source_namespace) for j in range(0, len(window), 100)
+            ]):
+                records.update(fetched)
+
+            # ids the index no longer has are left out (and counted as missing)
+            found = [vector_id for vector_id in window if vector_id in records]
+            if not found:
+                continue
+            embeddings = np.asarray([records[vector_id]["values"] for vector_id in found], dtype = np.float32)
+            dimension = embeddings.shape[1]
+            encoded, scales = quantize(embeddings, encoding)
+            writer.append("embeddings", encoded)
+            if scales is not None:
+                writer.append("scales", scales)
+            writer.append_text("ids", found)
+            writer.append_text("texts", [records[vector_id]["metadata"].get("content", "") for vector_id in found])
+            writer.append_text("metadata", [
+                json.dumps({
+                    key: value for key, value in records[vector_id]["metadata"].items()
+                    if key not in ("content", "knowledge_base_id")
+                })
+                for vector_id in found
+            ])
+            for vector_id in found:
+                rows[vector_id] = len(rows)
+
+        if "embeddings" not in writer.columns:
+            writer.append("embeddings", np.zeros((0, 0), dtype = np.float16 if encoding == "float16" else np.int8))
+            if encoding == "int8":
+                writer.append("scales", np.zeros(0, dtype = np.float32))
+
+        records = []
+        knowledge_base_rows = array("I")
+        segment_count = 0
+        for knowledge_base in knowledge_bases:
+            chunk_rows = [rows[vector_id] for vector_id in knowledge_base.get("pinecone_id_list") or [] if vector_id in rows]
+            chunks_start = len(knowledge_base_rows)
+            knowledge_base_rows.extend(chunk_rows)
+
+            segments_start = segment_count
+            texts, metadata = [], []
+            async for segment in db.knowledge_base_content.find(
+                {"knowledge_base_id": knowledge_base["knowledge_base_id"]},
+                {"_id": 0, "knowledge_base_id": 0}
+            ).sort("seq", 1):
+                texts.append(segment.pop("text"))
+                metadata.append(json.dumps(segment))
+                if len(texts) == 100:
+                    writer.append_text("segments", texts)
+                    writer.append_text("segment_metadata", metadata)
+                    segment_count += len(texts)
+                    texts, metadata = [], []
+
+            if segment_count == segments_start and not texts:
+                # knowledge bases stored before content segments carry the content in the record
+                legacy = await db.knowledge_base.find_one(
+                    {"knowledge_base_id": knowledge_base["knowledge_base_id"]},
+                    {"_id": 0, "content": 1}
+                )
+                if legacy and legacy.get("content"):
+                    texts.append(legacy["content"])
+                    metadata.append(json.dumps({"seq": 0, "offset": 0, "size": len(legacy["content"].encode("utf-8"))}))
+
+            writer.append_text("segments", texts)
+            writer.append_text("segment_metadata", metadata)
+            segment_count += len(texts)
+
+            records.append({
+                **{field: _isoformat(knowledge_base[field]) for field in RECORD_FIELDS if field in knowledge_base},
+                "chunks": [chunks_start, len(chunk_rows)],
+                "segments": [segments_start, segment_count - segments_start],
+                "missing_chunks": len(knowledge_base.get("pinecone_id_list") or []) - len(chunk_rows)
+            })
+
+        writer.append("knowledge_base_rows", np.frombuffer(knowledge_base_rows, dtype = np.uint32))
+        size = writer.finish({
+            "version": SNAPSHOT_VERSION,
+            "encoding": encoding,
+            "dimension": dimension,
+            "count": len(rows),
+            "namespace": source_namespace,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "knowledge_bases": records
+        })
+
+    except BaseException:
+        writer.abort()
+        raise
+
+    stats = {
+        "knowledge_bases": len(records),
+        "vectors": len(rows),
+        "missing_vectors": len(vector_ids) - len(rows),
+        "encoding": encoding,
+        "dimension": dimension,
+        "bytes": size
+    }
+    print(f"== Snapshot exported to {path}: {stats} ==")
+    return stats
+
+
+def _parse_datetime(value) -> datetime:
+    return datetime.fromisoformat(value) if isinstance(value, str) else datetime.now(timezone.utc)
+
+
+async def import_snapshot(
+    db,
+    path: str,
+    namespace: Optional[str] = None
+) -> dict:
+    """
+    Load a snapshot into `namespace` (default the one it was exported from) - vectors are upserted from
+    the stored embeddings, no embedding calls. Knowledge bases already in the namespace (the exported one
+    or an earlier import of it, with the same file) are skipped, an id taken by another knowledge base
+    gets a new one - imported records keep the exported id as `snapshot_source_id`. Chunks the namespace
+    already has are referenced, not upserted again. The knowledge base records are written once every
+    upsert was acknowledged - a failed import leaves nothing behind.
+    """
+    snapshot = Snapshot(path)
+    namespace = resolve_namespace(namespace or snapshot.header["namespace"])
+    knowledge_base_rows = snapshot.column("knowledge_base_rows")
+
+    upserts = upsert_engine.session(namespace = namespace)
+    pending = [] # (knowledge base record, its vector ids)
+    skipped = []
+    shared = 0
+    upserted = set() # vector ids this import sends - acknowledged on the references once all of them are in
+    try:
+        for record in snapshot.knowledge_bases:
+            source_id = record["knowledge_base_id"]
+            imported = await db.knowledge_base.find_one(
+                {
+                    "$or": [{"knowledge_base_id": source_id}, {"snapshot_source_id": source_id}],
+                    "file_hash": record.get("file_hash"),
+                    **namespace_filter(namespace)
+                },
+                {"_id": 1}
+            )
+            if imported is not None:
+                skipped.append(source_id)
+                continue
+            taken = await db.knowledge_base.find_one({"knowledge_base_id": source_id}, {"_id": 1})
+            knowledge_base_id = source_id if taken is None else str(uuid.uuid4())
+
+            start, count = record["chunks"]
+            rows = np.asarray(knowledge_base_rows[start:start + count], dtype = np.int64)
+            vector_ids = snapshot.texts("ids", rows)
+            fresh = {
+                vector_id: owner
+                for vector_id, owner in (await acquire_vector_refs(db, vector_ids, knowledge_base_id, namespace)).items()
+                if vector_id not in upserted
+            }
+            upserted.update(fresh)
+            pending.append((knowledge_base_id, record, vector_ids))
+
+            # owners of the chunks - the reference owners of the fresh ones, whoever created the rest
+            owners = set(fresh.values())
+            owners_known = None not in owners
+            reused = [vector_id for vector_id in vector_ids if vector_id not in fresh]
+            shared += len(reused)
+            for i in range(0, len(reused), IMPORT_BATCH):
+                reused_owners = await db.vector_refs.distinct(
+                    "owner",
+                    {"_id": {"$in": [vector_key(namespace, vector_id) for vector_id in reused[i:i + IMPORT_BATCH]]}}
+                )
+                owners_known = owners_known and None not in reused_owners and len(reused_owners) > 0
+                owners.update(owner for owner in reused_owners if owner is not None)
+            record["vector_owners"] = sorted(owners) if owners_known else None
+
+            # read the fresh rows in file order and stream them into the shared upsert session
+            fresh_rows = np.sort(rows[[vector_id in fresh for vector_id in vector_ids]]) if fresh else rows[:0]
+            for i in range(0, len(fresh_rows), IMPORT_BATCH):
+                batch = fresh_rows[i:i + IMPORT_BATCH]
+                embeddings = snapshot.embeddings(batch)
+                vectors = [
+                    {
+                        "id": vector_id,
+                        "values": values,
+                        "metadata": {
+                            "content": content,
+                            **json.loads(metadata),
+                            "knowledge_base_id": fresh[vector_id]
+                        }
+                    }
+                    for vector_id, content, metadata, values in zip(
+                        snapshot.texts("ids", batch),
+                        snapshot.texts("texts", batch),
+                        snapshot.texts("metadata", batch),
+                        embeddings.tolist()
+                    )
+                ]
+                await upserts.add(vectors)
+                await asyncio.to_thread(lexical_index.add, [
+                    (vector["id"], vector["metadata"]["content"]) for vector in vectors
+                ], namespace)
+
+            segments_start, segments_count = record["segments"]
+            segment_rows = range(segments_start, segments_start + segments_count)
+            for i in range(0, segments_count, 100):
+                await db.knowledge_base_content.insert_many([
+                    {"knowledge_base_id": knowledge_base_id, **json.loads(metadata), "text": text}
+                    for text, metadata in zip(
+                        snapshot.texts("segments", segment_rows[i:i + 100]),
+                        snapshot.texts("segment_metadata", segment_rows[i:i + 100])
+                    )
+                ])
+
+        upsert_stats = await upserts.flush()
+        await acknowledge_vector_refs(db, upserted, namespace)
+
+        for knowledge_base_id, record, vector_ids in pending:
+            await db.knowledge_base.insert_one({
+                "knowledge_base_id": knowledge_base_id,
+                "snapshot_source_id": record["knowledge_base_id"],
+                "knowledge_base_name": record.get("knowledge_base_name"),
+                "file_hash": record.get("file_hash"),
+                "content_size": record.get("content_size", 0),
+                "chunk_count": len(vector_ids),
+                "pinecone_id_list": vector_ids,
+                "ref_counted": True,
+                "namespace": namespace,
+                "vector_owners": record["vector_owners"],
+                "created_at": _parse_datetime(record.get("created_at")),
+                **({"updated_at": _parse_datetime(record["updated_at"])} if record.get("updated_at") else {})
+            })
+
+    except BaseException:
+        await upserts.cancel()
+        for knowledge_base_id, _, vector_ids in pending:
+            await db.knowledge_base.delete_one({"knowledge_base_id": knowledge_base_id})
+            await discard_partial_ingest(db, knowledge_base_id, vector_ids, namespace)
+        raise
+
+    stats = {
+        "knowledge_bases": len(pending),
+        "skipped": skipped,
+        "vectors_shared": shared,
+        "namespace": namespace,
+        **upsert_stats
+    }
+    print(f"== Snapshot {path} imported: {stats} ==")
+    return stats
@@ -0,0 +1,114 @@
+from typing import AsyncIterator, Optional
+import json
+import math
+import time
+
+import anyio
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from services.context_assembly import CHARS_PER_TOKEN
+
+# /chat stream formats, picked by the Accept header - plain text stays the default for old clients
+STREAM_FORMATS = {
+    "application/x-ndjson": "ndjson",
+    "text/event-stream": "sse",
+}
+
+
+def stream_format(accept: Optional[str]) -> str:
+    for media_type in (accept or "").split(","):
+        media_type = media_type.split(";")[0].strip().lower()
+        if media_type in STREAM_FORMATS:
+            return STREAM_FORMATS[media_type]
+
+    return "text"
+
+
+class DisconnectAwareStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that always listens for the client disconnect. Starlette only notices it at the
+    next failed write on ASGI 2.4 servers - here the stream is cancelled as soon as the client is gone,
+    which also cancels whatever it is awaiting upstream (the Gemini stream).
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        async with anyio.create_task_group() as task_group:
+
+            async def stream():
+                try:
+                    await self.stream_response(send)
+                except OSError:
+                    pass
+                task_group.cancel_scope.cancel()
+
+            task_group.start_soon(stream)
+            await self.listen_for_disconnect(receive)
+            task_group.cancel_scope.cancel()
+
+        if self.background is not None:
+            await self.background()
+
+
+async def close_upstream(stream):
+    """Close an upstream async stream - shielded, the caller is usually being cancelled (client disconnect)"""
+    with anyio.CancelScope(shield = True):
+        await stream.aclose()
+
+
+async def stream_text(
+    pieces: AsyncIterator[str],
+    stats: dict
+) -> AsyncIterator[str]:
+    """Plain text stream - the answer, then the error message if generation failed"""
+    async for piece in pieces:
+        yield piece
+
+    if stats.get("error"):
+        yield f"There was an error while generating response: {stats['error']}"
+
+
+def encode_event(event: dict, format: str) -> str:
+    if format == "sse":
+        return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+    return json.dumps(event) + "\n"
+
+
+async def stream_events(
+    pieces: AsyncIterator[str],
+    format: str,
+    stats: dict,
+    started: float
+) -> AsyncIterator[str]:
+    """
+    Wrap the answer pieces into NDJSON / SSE events - a "token" event per piece and a final "metadata"
+    event with time to first token and tokens per second. Every piece is written as soon as it arrives;
+    the next one is only pulled once the previous write went out, so a slow client slows the upstream
+    read instead of piling up pieces in memory.
+    """
+    first_token = None
+    text_length = 0
+    async for piece in pieces:
+        if first_token is None:
+            first_token = time.perf_counter()
+        text_length += len(piece)
+        yield encode_event({"type": "token", "text": piece}, format)
+
+    finished = time.perf_counter()
+    # Gemini reports the output token count with the last chunk, estimate it otherwise
+    output_tokens = stats.get("output_tokens") or math.ceil(text_length / CHARS_PER_TOKEN)
+    generation_seconds = finished - first_token if first_token is not None else 0.0
+
+    if stats.get("error"):
+        yield encode_event({"type": "error", "message": stats["error"]}, format)
+
+    yield encode_event({
+        "type": "metadata",
+        "cached": stats.get("cached", False),
+        "ttft_ms": round((first_token - started) * 1000, 1) if first_token is not None else None,
+        "duration_ms": round((finished - started) * 1000, 1),
+        "output_tokens": output_tokens,
+        "tokens_per_second": round(output_tokens / generation_seconds, 1) if generation_seconds > 0 else None,
+        "context_tokens": stats.get("context_tokens"),
+    }, format)
@@ -0,0 +1,169 @@
+from dataclasses import dataclass
+from typing import Iterable
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+
+from config import config
+from services.executor import remove_file
+
+# the upload is copied to disk in pieces of this size - memory per upload stays flat whatever the file size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# multipart boundaries and part headers around the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+# routes taking many files in one body - limited by MAX_BATCH_UPLOAD_MB instead of MAX_UPLOAD_MB
+BATCH_UPLOAD_PATHS = ("/fileProcessing/batch",)
+
+
+# error class - for uploads over the size limit
+class UploadTooLarge(Exception):
+    pass
+
+
+@dataclass
+class SpooledUpload:
+    """An uploaded file spooled to disk - parsers read it by path, the ingestion worker removes it"""
+    path: str
+    size: int
+    file_hash: str # sha256 of the bytes, computed while spooling
+
+
+def max_upload_bytes() -> int:
+    return int(config.MAX_UPLOAD_MB * 1024 * 1024)
+
+
+def max_batch_upload_bytes() -> int:
+    return int(config.MAX_BATCH_UPLOAD_MB * 1024 * 1024)
+
+
+def _open_spool_file(suffix: str):
+    os.makedirs(config.UPLOAD_SPOOL_DIR, exist_ok = True)
+    return tempfile.NamedTemporaryFile(dir = config.UPLOAD_SPOOL_DIR, suffix = suffix, delete = False)
+
+
+async def spool_upload(
+    upload,
+    suffix: str = "",
+    max_bytes: int = None
+) -> SpooledUpload:
+    """
+    Copy an UploadFile to a temp file under UPLOAD_SPOOL_DIR one UPLOAD_CHUNK_SIZE piece at a time,
+    hashing it on the way, raises UploadTooLarge as soon as `max_bytes` is crossed
+
+    The copy is needed: Starlette keeps a part under 1 MB in memory and rolls larger ones over to an
+    unnamed TemporaryFile that cannot be linked or moved, and either is gone once the request closes. The
+    queued ingest runs after the response and is resumed from UPLOAD_SPOOL_DIR after a restart.
+    """
+    max_bytes = max_upload_bytes() if max_bytes is None else max_bytes
+    spool_file = await asyncio.to_thread(_open_spool_file, suffix)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            piece = await upload.read(UPLOAD_CHUNK_SIZE)
+            if not piece:
+                break
+            size += len(piece)
+            if size > max_bytes:
+                raise UploadTooLarge(f"File too large. Max allowed is {max_bytes / (1024 * 1024):g} MB.")
+            digest.update(piece)
+            await asyncio.to_thread(spool_file.write, piece)
+
+        await asyncio.to_thread(spool_file.close)
+
+    except BaseException:
+        await asyncio.to_thread(spool_file.close)
+        remove_file(spool_file.name)
+        raise
+
+    return SpooledUpload(path = spool_file.name, size = size, file_hash = digest.hexdigest())
+
+
+def clear_spool_dir(keep: Iterable[str] = ()):
+    """Remove files spooled by a previous process, except `keep` - the uploads of the jobs queued again"""
+    if not os.path.isdir(config.UPLOAD_SPOOL_DIR):
+        return
+    keep = {os.path.abspath(path) for path in keep}
+    for name in os.listdir(config.UPLOAD_SPOOL_DIR):
+        path = os.path.join(config.UPLOAD_SPOOL_DIR, name)
+        if os.path.abspath(path) not in keep:
+            remove_file(path)
+
+
+class UploadLimitMiddleware:
+    """
+    Pure ASGI middleware rejecting oversized multipart bodies with 413 while they are received -
+    by Content-Length before reading anything, otherwise as soon as the running byte count
+    crosses the limit - instead of after the whole body was parsed to disk.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+
+        is_batch = scope["path"] in BATCH_UPLOAD_PATHS
+        limit = (max_batch_upload_bytes() if is_batch else max_upload_bytes()) + MULTIPART_OVERHEAD
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await self.reject(send, is_batch)
+            return
+
+        received = 0
+        rejected = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request" and not rejected:
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # answer now and make the app see a disconnect, so it stops parsing the body
+                    rejected = True
+                    await self.reject(send, is_batch)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message: Message):
+            if not rejected:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise
+
+    async def reject(
+        self,
+        send: Send,
+        is_batch: bool
+    ):
+        if is_batch:
+            message = f"Upload too large. Max allowed is {config.MAX_BATCH_UPLOAD_MB:g} MB per batch."
+        else:
+            message = f"File too large. Max allowed is {config.MAX_UPLOAD_MB:g} MB."
+        body = json.dumps({"success": False, "message": message}).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode("latin-1")),
+                (b"connection", b"close")
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,237 @@
+from typing import Callable, List, Optional
+import asyncio
+import json
+import random
+import time
+
+from config import config
+from services.metrics import UPSERT_SECONDS, UPSERT_RETRIES, UPSERT_REQUESTS_IN_FLIGHT, VECTORS_UPSERTED
+from services.pinecone import get_pinecone
+
+# Pinecone request limits for upserts
+MAX_REQUEST_BYTES = 2 * 1024 * 1024
+MAX_BATCH_VECTORS = 1000
+
+
+class TokenBucket:
+    """Async token bucket - `rate` tokens per second, bursts of up to `capacity`"""
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float
+    ):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1):
+        if self.rate <= 0:
+            return
+
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Throttling (429) and transient server errors are retried, anything else fails the batch"""
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+
+    message = str(error).lower()
+    return any(marker in message for marker in ("429", "too many requests", "rate limit", "resource_exhausted", "timeout"))
+
+
+def estimate_vector_bytes(vector: dict) -> int:
+    """Approximate JSON size of a vector in the upsert request body"""
+    return (
+        len(vector["values"]) * 12
+        + len(json.dumps(vector.get("metadata") or {}))
+        + len(vector["id"])
+        + 64
+    )
+
+
+class UpsertEngine:
+    """
+    Shared upsert engine - vectors are packed into batches by payload size, sent with a capped
+    number of in-flight requests through a token bucket, and throttled batches are retried with
+    jittered exponential backoff.
+    """
+
+    def __init__(
+        self,
+        max_batch_bytes: int,
+        max_in_flight: int,
+        requests_per_second: float,
+        max_retries: int,
+        base_backoff: float = 0.25
+    ):
+        self.max_batch_bytes = min(max_batch_bytes, MAX_REQUEST_BYTES)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+
+        self.bucket = TokenBucket(rate = requests_per_second, capacity = max(requests_per_second, 1))
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def send(
+        self,
+        vectors: list,
+        namespace: str
+    ):
+        """Upsert one batch, retrying throttling / transient errors"""
+        attempt = 0
+        started = time.perf_counter()
+        while True:
+            await self.bucket.acquire()
+            try:
+                with UPSERT_REQUESTS_IN_FLIGHT.track_inprogress():
+                    await get_pinecone().upsert(
+                        vectors = vectors,
+                        namespace = namespace
+                    )
+                UPSERT_SECONDS.observe(time.perf_counter() - started)
+                VECTORS_UPSERTED.inc(len(vectors))
+                return
+
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries or not is_retryable_error(e):
+                    print(f"== Upsert batch of {len(vectors)} vectors failed: {e} ==")
+                    raise
+
+                UPSERT_RETRIES.inc()
+                # full jitter backoff
+                delay = random.uniform(0, self.base_backoff * (2 ** attempt))
+                print(f"== Upsert throttled ({e}), retry {attempt} in {delay:.2f}s ==")
+                await asyncio.sleep(delay)
+
+    def session(
+        self,
+        namespace: Optional[str] = None,
+        on_upserted: Optional[Callable[[list], None]] = None,
+        on_failed: Optional[Callable[[list, Exception], None]] = None
+    ) -> "UpsertSession":
+        return UpsertSession(self, namespace or config.PINECONE_NAMESPACE, on_upserted, on_failed)
+
+
+class UpsertSession:
+    """
+    Upserts for one ingest - accumulates vectors into size-bounded batches and tracks throughput.
+    `on_upserted` is called with every batch Pinecone acknowledged. Without `on_failed` the first failed
+    batch fails the session (add / flush raise it), with it each failed batch is handed to the callback
+    and the session carries on - for sessions shared by several ingests.
+    """
+
+    def __init__(
+        self,
+        engine: UpsertEngine,
+        namespace: str,
+        on_upserted: Optional[Callable[[list], None]] = None,
+        on_failed: Optional[Callable[[list, Exception], None]] = None
+    ):
+        self.engine = engine
+        self.namespace = namespace
+        self.on_upserted = on_upserted
+        self.on_failed = on_failed
+
+        self.batch: List[dict] = []
+        self.batch_bytes = 0
+        self.tasks = set()
+        self.error: Optional[Exception] = None
+
+        self.submitted_ids: List[str] = []
+        self.upserted = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+
+    async def add(self, vectors: list):
+        """Queue vectors - full batches are dispatched (waits while max_in_flight batches are pending)"""
+        self._raise_error()
+
+        for vector in vectors:
+            size = estimate_vector_bytes(vector)
+            if self.batch and (
+                self.batch_bytes + size > self.engine.max_batch_bytes
+                or len(self.batch) >= MAX_BATCH_VECTORS
+            ):
+                await self._dispatch()
+            self.batch.append(vector)
+            self.batch_bytes += size
+
+    async def flush(self) -> dict:
+        """Send the remaining vectors, wait for every batch and return the throughput stats"""
+        if self.batch:
+            await self._dispatch()
+        if self.tasks:
+            await asyncio.wait(self.tasks)
+        self._raise_error()
+
+        return self.stats()
+
+    async def cancel(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.tasks:
+            await asyncio.wait(self.tasks)
+
+    def stats(self) -> dict:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "vectors_upserted": self.upserted,
+            "upsert_batches": self.batches,
+            "upsert_seconds": round(elapsed, 3),
+            "vectors_per_second": round(self.upserted / elapsed, 1) if elapsed > 0 else 0.0
+        }
+
+    async def _dispatch(self):
+        batch, self.batch, self.batch_bytes = self.batch, [], 0
+        self.submitted_ids.extend(vector["id"] for vector in batch)
+
+        # backpressure - hold the producer while the engine is at its in-flight limit
+        await self.engine.semaphore.acquire()
+        if self.error is not None:
+            self.engine.semaphore.release()
+            raise self.error
+        task = asyncio.create_task(self._send(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _send(self, batch: list):
+        try:
+            await self.engine.send(batch, self.namespace)
+            self.upserted += len(batch)
+            self.batches += 1
+            if self.on_upserted is not None:
+                self.on_upserted(batch)
+        except Exception as e:
+            if self.on_failed is not None:
+                self.on_failed(batch, e)
+            elif self.error is None:
+                self.error = e
+        finally:
+            self.engine.semaphore.release()
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+
+upsert_engine = UpsertEngine(
+    max_batch_bytes = config.UPSERT_MAX_BATCH_BYTES,
+    max_in_flight = config.UPSERT_MAX_IN_FLIGHT,
+    requests_per_second = config.UPSERT_REQUESTS_PER_SECOND,
+    max_retries = config.UPSERT_MAX_RETRIES
+)
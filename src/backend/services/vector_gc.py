@@ -0,0 +1,126 @@
+from typing import List, Set
+import asyncio
+import time
+
+from config import config
+from services.answer_cache import answer_cache
+from services.lexical_index import lexical_index
+from services.metrics import VECTORS_COLLECTED
+from services.pinecone import DELETE_BATCH_SIZE, delete_pinecone_vectors, iter_pinecone_ids, list_namespaces, vector_key
+
+
+class VectorGarbageCollector:
+    """
+    Reconciles the vector index against Mongo and purges orphans - vectors no knowledge base, ingest
+    or ingestion journal references any more (left by a failed delete request or a crashed process).
+
+    A vector is referenced when it has a vector_refs document (ref counted knowledge bases, running
+    and journaled ingests) or is in the id list of a knowledge base ingested before reference counting.
+    An ingest takes the reference before it upserts, but a vector is only purged after it was found
+    unreferenced by two consecutive sweeps and once more right before the delete request, so an
+    ingest starting between two sweeps cannot lose the vector it is about to write.
+    """
+
+    def __init__(self):
+        self.db = None
+        self.task = None
+        self.suspects: Set[str] = set() # vector keys unreferenced in the last sweep, purged if they still are in the next
+        self.sweeps = 0
+        self.scanned = 0
+        self.purged = 0
+        self.last_sweep_seconds = None
+
+    def start(self, db):
+        if self.task is None and config.VECTOR_GC_INTERVAL_SECONDS > 0:
+            self.db = db
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions = True)
+            self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"== Vector garbage collection failed: {e} ==")
+            await asyncio.sleep(config.VECTOR_GC_INTERVAL_SECONDS)
+
+    async def sweep(self) -> dict:
+        """One pass over every namespace of the index - returns how many vectors were scanned, found orphaned and purged"""
+        started = time.perf_counter()
+        scanned = 0
+        purged = 0
+        orphaned_keys = set()
+        confirmed_keys = set()
+        for namespace in await list_namespaces():
+            orphaned = []
+            async for ids in iter_pinecone_ids(namespace):
+                scanned += len(ids)
+                orphaned.extend(await self._unreferenced(namespace, ids))
+            keys = {vector_id: vector_key(namespace, vector_id) for vector_id in orphaned}
+            orphaned_keys.update(keys.values())
+
+            # purge in DELETE_BATCH_SIZE batches, checking the references once more right before each request
+            confirmed = [vector_id for vector_id in orphaned if keys[vector_id] in self.suspects]
+            confirmed_keys.update(keys[vector_id] for vector_id in confirmed)
+            for i in range(0, len(confirmed), DELETE_BATCH_SIZE):
+                batch = await self._unreferenced(namespace, confirmed[i:i + DELETE_BATCH_SIZE])
+                if batch:
+                    await delete_pinecone_vectors(pinecone_ids = batch, namespace = namespace)
+                    await asyncio.to_thread(lexical_index.remove, batch, namespace)
+                    answer_cache.invalidate_removed(batch)
+                    VECTORS_COLLECTED.inc(len(batch))
+                    purged += len(batch)
+        self.suspects = orphaned_keys - confirmed_keys
+
+        self.sweeps += 1
+        self.scanned += scanned
+        self.purged += purged
+        self.last_sweep_seconds = round(time.perf_counter() - started, 3)
+        stats = {"scanned": scanned, "orphaned": len(orphaned_keys), "purged": purged}
+        print(f"== Vector garbage collection: {stats} ==")
+        return stats
+
+    async def _unreferenced(
+        self,
+        namespace: str,
+        vector_ids: List[str]
+    ) -> List[str]:
+        """The ids of the namespace neither vector_refs nor a pre reference counting knowledge base refers to"""
+        keys = {vector_key(namespace, vector_id): vector_id for vector_id in vector_ids}
+        referenced = {
+            keys[ref["_id"]] async for ref in self.db.vector_refs.find(
+                {"_id": {"$in": list(keys)}},
+                {"_id": 1}
+            )
+        }
+        candidates = [vector_id for vector_id in vector_ids if vector_id not in referenced]
+        if not candidates or namespace != config.PINECONE_NAMESPACE:
+            # only the default namespace has knowledge bases from before reference counting
+            return candidates
+
+        async for knowledge_base in self.db.knowledge_base.find(
+            {"ref_counted": {"$ne": True}, "pinecone_id_list": {"$in": candidates}},
+            {"_id": 0, "pinecone_id_list": 1}
+        ):
+            referenced.update(knowledge_base["pinecone_id_list"])
+
+        return [vector_id for vector_id in candidates if vector_id not in referenced]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.task is not None,
+            "interval_seconds": config.VECTOR_GC_INTERVAL_SECONDS,
+            "sweeps": self.sweeps,
+            "scanned": self.scanned,
+            "purged": self.purged,
+            "suspects": len(self.suspects),
+            "last_sweep_seconds": self.last_sweep_seconds
+        }
+
+
+vector_gc = VectorGarbageCollector()
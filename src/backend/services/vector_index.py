@@ -0,0 +1,537 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, List, Optional
+
+import numpy as np
+
+
+class VectorIndex(ABC):
+    """
+    Async vector index interface - the subset of Pinecone's IndexAsyncio used by the app.
+    Pinecone's index satisfies it as is, so services/pinecone.py can hold either backend.
+    """
+
+    @abstractmethod
+    async def query(
+        self,
+        vector: list,
+        top_k: int,
+        namespace: str = "",
+        filter: Optional[dict] = None,
+        include_metadata: bool = False,
+        include_values: bool = False
+    ) -> dict:
+        pass
+
+    @abstractmethod
+    async def upsert(
+        self,
+        vectors: list,
+        namespace: str = ""
+    ) -> dict:
+        pass
+
+    @abstractmethod
+    async def delete(
+        self,
+        ids: Optional[list] = None,
+        delete_all: bool = False,
+        namespace: str = "",
+        filter: Optional[dict] = None
+    ) -> dict:
+        pass
+
+    @abstractmethod
+    async def fetch(
+        self,
+        ids: list,
+        namespace: str = ""
+    ) -> dict:
+        pass
+
+    @abstractmethod
+    def list(
+        self,
+        prefix: Optional[str] = None,
+        limit: int = 100,
+        namespace: str = ""
+    ) -> AsyncIterator[List[str]]:
+        """Vector ids of the namespace, up to `limit` per page (async generator)"""
+        pass
+
+    @abstractmethod
+    async def describe_index_stats(self) -> dict:
+        """{dimension, namespaces: {namespace: {vector_count}}, total_vector_count}"""
+        pass
+
+    async def close(self):
+        pass
+
+
+def matches_filter(metadata: dict, filter: Optional[dict]) -> bool:
+    """Evaluate a Pinecone style metadata filter ($eq, $ne, $in, $nin, $and, $or)"""
+    if not filter:
+        return True
+
+    for key, condition in filter.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+            continue
+
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+
+        for operator, expected in condition.items():
+            match operator:
+                case "$eq":
+                    ok = value == expected
+                case "$ne":
+                    ok = value != expected
+                case "$in":
+                    ok = value in expected
+                case "$nin":
+                    ok = value not in expected
+                case _:
+                    raise ValueError(f"Unsupported filter operator: {operator}")
+            if not ok:
+                return False
+
+    return True
+
+
+class _Namespace:
+    """
+    One namespace of the local index.
+    Vectors live in a memory-mapped float32 matrix (unit normalized, so cosine is a dot product),
+    ids / metadata / tombstones in a small SQLite table next to it.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dimension: int,
+        ivf_lists: int,
+        ivf_probes: int
+    ):
+        self.path = path
+        self.dimension = dimension
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = ivf_probes
+        self.lock = threading.RLock()
+
+        os.makedirs(path, exist_ok = True)
+        self.vectors_path = os.path.join(path, "vectors.f32")
+
+        self.db = sqlite3.connect(os.path.join(path, "rows.sqlite3"), check_same_thread = False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, id TEXT NOT NULL, metadata TEXT, deleted INTEGER NOT NULL DEFAULT 0)"
+        )
+        self.db.commit()
+
+        # row -> id / metadata, id -> row (live rows only)
+        self.ids: List[Optional[str]] = []
+        self.metadata: List[dict] = []
+        self.rows: Dict[str, int] = {}
+
+        for row, vector_id, metadata, deleted in self.db.execute(
+            "SELECT row, id, metadata, deleted FROM rows ORDER BY row"
+        ):
+            self.ids.append(vector_id)
+            self.metadata.append(json.loads(metadata) if metadata else {})
+            if not deleted:
+                self.rows[vector_id] = row
+
+        self.count = len(self.ids)
+        self.alive = np.zeros(max(self.count, 1024), dtype = bool)
+        for row in self.rows.values():
+            self.alive[row] = True
+
+        self.capacity = 0
+        self.matrix = None
+        self._open_matrix(max(self.count, 1024))
+
+        # IVF partitions - rebuilt lazily, not persisted
+        self.centroids = None
+        self.assignments = None
+        self.trained_on = 0
+
+    def _open_matrix(self, capacity: int):
+        """(Re)map the float32 matrix file, growing it to the given capacity"""
+        if self.matrix is not None:
+            self.matrix.flush()
+            del self.matrix
+
+        needed = capacity * self.dimension * 4
+        with open(self.vectors_path, "ab") as f:
+            if f.tell() < needed:
+                f.truncate(needed)
+
+        self.capacity = capacity
+        self.matrix = np.memmap(
+            self.vectors_path,
+            dtype = np.float32,
+            mode = "r+",
+            shape = (capacity, self.dimension)
+        )
+
+        if len(self.alive) < capacity:
+            alive = np.zeros(capacity, dtype = bool)
+            alive[:len(self.alive)] = self.alive
+            self.alive = alive
+
+    def upsert(self, vectors: list) -> int:
+        with self.lock:
+            records = []
+            for vector in vectors:
+                values = np.asarray(vector["values"], dtype = np.float32)
+                if values.shape != (self.dimension,):
+                    raise ValueError(
+                        f"Vector dimension {values.shape[0]} does not match index dimension {self.dimension}"
+                    )
+                norm = np.linalg.norm(values)
+                if norm > 0:
+                    values = values / norm
+
+                vector_id = vector["id"]
+                metadata = vector.get("metadata") or {}
+                row = self.rows.get(vector_id)
+                if row is None:
+                    row = self.count
+                    self.count += 1
+                    if row >= self.capacity:
+                        self._open_matrix(self.capacity * 2)
+                    self.ids.append(vector_id)
+                    self.metadata.append(metadata)
+                else:
+                    self.metadata[row] = metadata
+
+                self.matrix[row] = values
+                self.alive[row] = True
+                self.rows[vector_id] = row
+                records.append((row, vector_id, json.dumps(metadata)))
+
+                if self.assignments is not None:
+                    self._assign(row)
+
+            self.matrix.flush()
+            self.db.executemany(
+                "INSERT OR REPLACE INTO rows (row, id, metadata, deleted) VALUES (?, ?, ?, 0)",
+                records
+            )
+            self.db.commit()
+
+            return len(records)
+
+    def delete(
+        self,
+        ids: Optional[list],
+        filter: Optional[dict]
+    ) -> int:
+        with self.lock:
+            if ids is not None:
+                rows = [self.rows[vector_id] for vector_id in ids if vector_id in self.rows]
+            else:
+                rows = [
+                    row for row in self.rows.values()
+                    if matches_filter(self.metadata[row], filter)
+                ]
+
+            # tombstone the rows, storage is reclaimed by compact()
+            for row in rows:
+                self.alive[row] = False
+                del self.rows[self.ids[row]]
+
+            self.db.executemany(
+                "UPDATE rows SET deleted = 1 WHERE row = ?",
+                [(row,) for row in rows]
+            )
+            self.db.commit()
+
+            if self.count > 1024 and len(self.rows) < self.count // 2:
+                self.compact()
+
+            return len(rows)
+
+    def compact(self):
+        """Drop tombstoned rows - rewrites the matrix and the row table"""
+        with self.lock:
+            live = np.flatnonzero(self.alive[:self.count])
+            kept = np.array(self.matrix[live])
+
+            self.ids = [self.ids[row] for row in live]
+            self.metadata = [self.metadata[row] for row in live]
+            self.rows = {vector_id: row for row, vector_id in enumerate(self.ids)}
+            self.count = len(self.ids)
+
+            self.matrix[:self.count] = kept
+            self.matrix.flush()
+            self.alive[:] = False
+            self.alive[:self.count] = True
+
+            self.db.execute("DELETE FROM rows")
+            self.db.executemany(
+                "INSERT INTO rows (row, id, metadata, deleted) VALUES (?, ?, ?, 0)",
+                [(row, vector_id, json.dumps(self.metadata[row])) for row, vector_id in enumerate(self.ids)]
+            )
+            self.db.commit()
+
+            self.centroids = None
+            self.assignments = None
+
+    # ---- IVF (partitioned) search ----
+
+    def _train(self):
+        """k-means over the live rows, then assign every row to its nearest centroid"""
+        live = np.flatnonzero(self.alive[:self.count])
+        rng = np.random.default_rng(0)
+        sample = live if len(live) <= self.ivf_lists * 64 else rng.choice(live, self.ivf_lists * 64, replace = False)
+        data = np.asarray(self.matrix[np.sort(sample)])
+
+        centroids = data[rng.choice(len(data), self.ivf_lists, replace = False)]
+        for _ in range(10):
+            labels = np.argmax(data @ centroids.T, axis = 1)
+            for k in range(self.ivf_lists):
+                members = data[labels == k]
+                if len(members):
+                    centroid = members.mean(axis = 0)
+                    norm = np.linalg.norm(centroid)
+                    centroids[k] = centroid / norm if norm > 0 else centroid
+
+        self.centroids = centroids
+        self.assignments = np.full(self.capacity, -1, dtype = np.int32)
+        for start in range(0, self.count, 65536):
+            end = min(start + 65536, self.count)
+            self.assignments[start:end] = np.argmax(self.matrix[start:end] @ centroids.T, axis = 1)
+        self.trained_on = len(live)
+
+    def _assign(self, row: int):
+        if len(self.assignments) < self.capacity:
+            assignments = np.full(self.capacity, -1, dtype = np.int32)
+            assignments[:len(self.assignments)] = self.assignments
+            self.assignments = assignments
+        self.assignments[row] = int(np.argmax(self.centroids @ self.matrix[row]))
+
+    def _candidate_rows(self, query: np.ndarray) -> np.ndarray:
+        """Live rows to score - the probed IVF partitions, or every row for exact search"""
+        live_count = len(self.rows)
+        if self.ivf_lists <= 0 or live_count < self.ivf_lists * 39:
+            return np.flatnonzero(self.alive[:self.count])
+
+        # (re)train once the corpus has doubled since the last training
+        if self.centroids is None or live_count > 2 * self.trained_on:
+            self._train()
+
+        probes = min(self.ivf_probes, self.ivf_lists)
+        lists = np.argpartition(-(self.centroids @ query), probes - 1)[:probes]
+        return np.flatnonzero(
+            np.isin(self.assignments[:self.count], lists) & self.alive[:self.count]
+        )
+
+    def query(
+        self,
+        vector: list,
+        top_k: int,
+        filter: Optional[dict],
+        include_values: bool,
+        include_metadata: bool
+    ) -> List[dict]:
+        with self.lock:
+            if not self.rows:
+                return []
+
+            query = np.asarray(vector, dtype = np.float32)
+            norm = np.linalg.norm(query)
+            if norm > 0:
+                query = query / norm
+
+            candidates = self._candidate_rows(query)
+            if filter:
+                candidates = np.array(
+                    [row for row in candidates if matches_filter(self.metadata[row], filter)],
+                    dtype = np.int64
+                )
+            if len(candidates) == 0:
+                return []
+
+            scores = self.matrix[candidates] @ query
+            k = min(top_k, len(candidates))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+
+            matches = []
+            for i in best:
+                row = int(candidates[i])
+                match = {
+                    "id": self.ids[row],
+                    "score": float(scores[i])
+                }
+                if include_values:
+                    match["values"] = self.matrix[row].tolist()
+                if include_metadata:
+                    match["metadata"] = self.metadata[row]
+                matches.append(match)
+
+            return matches
+
+    def fetch(self, ids: list) -> Dict[str, dict]:
+        with self.lock:
+            vectors = {}
+            for vector_id in ids:
+                row = self.rows.get(vector_id)
+                if row is not None:
+                    vectors[vector_id] = {
+                        "id": vector_id,
+                        "values": self.matrix[row].tolist(),
+                        "metadata": self.metadata[row]
+                    }
+            return vectors
+
+    def list_ids(self, prefix: Optional[str]) -> List[str]:
+        with self.lock:
+            return sorted(vector_id for vector_id in self.rows if not prefix or vector_id.startswith(prefix))
+
+    def close(self):
+        with self.lock:
+            if self.matrix is not None:
+                self.matrix.flush()
+            self.db.close()
+
+
+class LocalVectorIndex(VectorIndex):
+    """In-process vector index persisted under a local directory (one sub-directory per namespace)"""
+
+    def __init__(
+        self,
+        path: str,
+        dimension: int,
+        ivf_lists: int = 0,
+        ivf_probes: int = 8
+    ):
+        self.path = path
+        self.dimension = dimension
+        self.ivf_lists = ivf_lists
+        self.ivf_probes = ivf_probes
+
+        self._namespaces: Dict[str, _Namespace] = {}
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok = True)
+
+    def _namespace(self, namespace: str) -> _Namespace:
+        with self._lock:
+            if namespace not in self._namespaces:
+                self._namespaces[namespace] = _Namespace(
+                    path = os.path.join(self.path, namespace or "__default__"),
+                    dimension = self.dimension,
+                    ivf_lists = self.ivf_lists,
+                    ivf_probes = self.ivf_probes
+                )
+            return self._namespaces[namespace]
+
+    async def query(
+        self,
+        vector: list,
+        top_k: int,
+        namespace: str = "",
+        filter: Optional[dict] = None,
+        include_metadata: bool = False,
+        include_values: bool = False
+    ) -> dict:
+        ns = self._namespace(namespace)
+        matches = await asyncio.to_thread(
+            ns.query, vector, top_k, filter, include_values, include_metadata
+        )
+        return {
+            "matches": matches,
+            "namespace": namespace
+        }
+
+    async def upsert(
+        self,
+        vectors: list,
+        namespace: str = ""
+    ) -> dict:
+        ns = self._namespace(namespace)
+        upserted_count = await asyncio.to_thread(ns.upsert, vectors)
+        return {"upserted_count": upserted_count}
+
+    async def delete(
+        self,
+        ids: Optional[list] = None,
+        delete_all: bool = False,
+        namespace: str = "",
+        filter: Optional[dict] = None
+    ) -> dict:
+        if delete_all:
+            await asyncio.to_thread(self._drop_namespace, namespace)
+            return {}
+        if ids is None and filter is None:
+            # Pinecone rejects a delete without ids, filter or delete_all - it must not empty the namespace
+            raise ValueError("Delete needs ids, a filter or delete_all")
+
+        ns = self._namespace(namespace)
+        await asyncio.to_thread(ns.delete, ids, filter)
+        return {}
+
+    async def fetch(
+        self,
+        ids: list,
+        namespace: str = ""
+    ) -> dict:
+        ns = self._namespace(namespace)
+        vectors = await asyncio.to_thread(ns.fetch, ids)
+        return {
+            "vectors": vectors,
+            "namespace": namespace
+        }
+
+    async def list(
+        self,
+        prefix: Optional[str] = None,
+        limit: int = 100,
+        namespace: str = ""
+    ) -> AsyncIterator[List[str]]:
+        ns = self._namespace(namespace)
+        ids = await asyncio.to_thread(ns.list_ids, prefix)
+        for i in range(0, len(ids), limit):
+            yield ids[i:i + limit]
+
+    def _drop_namespace(self, namespace: str):
+        with self._lock:
+            ns = self._namespaces.pop(namespace, None)
+            if ns is not None:
+                ns.close()
+            shutil.rmtree(os.path.join(self.path, namespace or "__default__"), ignore_errors = True)
+
+    async def describe_index_stats(self) -> dict:
+        names = [
+            "" if name == "__default__" else name
+            for name in os.listdir(self.path)
+            if os.path.isdir(os.path.join(self.path, name))
+        ]
+        namespaces = {
+            name: {"vector_count": len(self._namespace(name).rows)}
+            for name in names
+        }
+        return {
+            "dimension": self.dimension,
+            "namespaces": namespaces,
+            "total_vector_count": sum(ns["vector_count"] for ns in namespaces.values())
+        }
+
+    async def close(self):
+        with self._lock:
+            for ns in self._namespaces.values():
+                ns.close()
+            self._namespaces = {}
@@ -0,0 +1,181 @@
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Union
+import asyncio
+import hashlib
+
+from pymongo import UpdateOne
+
+from config import config
+from services.answer_cache import answer_cache
+from services.lexical_index import lexical_index
+from services.pinecone import delete_pinecone_vectors, delete_pinecone_vectors_by_filter, vector_key
+
+# vector ids are content addressed - identical chunks share one vector across the knowledge bases of a namespace,
+# the vector_refs collection counts how many knowledge bases reference each of them and records the owner -
+# the knowledge base whose ingest created the vector, also stored as `knowledge_base_id` in its metadata.
+# vector_refs documents are keyed by vector_key(namespace, vector id) and record their `namespace`.
+# A reference is `pending` from its creation until Pinecone acknowledged the upsert of its vector - until then
+# every ingest that needs the chunk embeds and upserts it (refs from before the flag count as acknowledged).
+
+
+def content_hash(data: Union[bytes, str]) -> str:
+    """sha256 hex digest of the file bytes / chunk text"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_content_hash(path: str) -> str:
+    """sha256 hex digest of a file on disk, read in pieces (same digest as content_hash of its bytes)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for piece in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(piece)
+    return digest.hexdigest()
+
+
+async def acquire_vector_refs(
+    db,
+    vector_ids: Iterable[str],
+    owner: Optional[str] = None,
+    namespace: Optional[str] = None
+) -> Dict[str, Optional[str]]:
+    """
+    Add one reference to every id of the namespace, returns {vector id: owner} of the ids whose vector
+    is not in Pinecone yet (need embedding + upsert) - the ones not referenced before are owned by the
+    `owner` knowledge base, the still pending ones keep the owner that created them
+    """
+    vector_ids = list(vector_ids)
+    if not vector_ids:
+        return {}
+
+    namespace = namespace or config.PINECONE_NAMESPACE
+    keys = {vector_key(namespace, vector_id): vector_id for vector_id in vector_ids}
+    now = datetime.now(timezone.utc)
+    result = await db.vector_refs.bulk_write([
+        UpdateOne(
+            {"_id": vector_key(namespace, vector_id)},
+            {
+                "$inc": {"ref_count": 1},
+                "$setOnInsert": {"owner": owner, "namespace": namespace, "pending": True, "created_at": now}
+            },
+            upsert = True
+        )
+        for vector_id in vector_ids
+    ], ordered = False)
+
+    created = {keys[key]: owner for key in result.upserted_ids.values()}
+    # referenced before, but the ingest that created them did not get them into Pinecone (yet)
+    shared = [vector_id for vector_id in keys.values() if vector_id not in created]
+    return {**created, **await pending_vector_refs(db, shared, namespace)}
+
+
+async def pending_vector_refs(
+    db,
+    vector_ids: Iterable[str],
+    namespace: Optional[str] = None
+) -> Dict[str, Optional[str]]:
+    """{vector id: owner} of the referenced ids of the namespace whose upsert was not acknowledged yet"""
+    keys = {vector_key(namespace, vector_id): vector_id for vector_id in vector_ids}
+    if not keys:
+        return {}
+
+    return {
+        keys[ref["_id"]]: ref.get("owner") async for ref in db.vector_refs.find(
+            {"_id": {"$in": list(keys)}, "pending": True},
+            {"_id": 1, "owner": 1}
+        )
+    }
+
+
+async def acknowledge_vector_refs(
+    db,
+    vector_ids: Iterable[str],
+    namespace: Optional[str] = None
+):
+    """Pinecone acknowledged the upsert of the vectors - ingests sharing them no longer upsert them"""
+    keys = [vector_key(namespace, vector_id) for vector_id in vector_ids]
+    if keys:
+        await db.vector_refs.update_many({"_id": {"$in": keys}, "pending": True}, {"$unset": {"pending": ""}})
+
+
+async def release_vector_refs(
+    db,
+    vector_ids: Iterable[str],
+    namespace: Optional[str] = None
+) -> List[dict]:
+    """
+    Drop one reference from every id of the namespace, returns the refs ({_id: vector key, vector_id, owner})
+    no longer referenced (they are removed)
+    """
+    vector_ids = list(vector_ids)
+    if not vector_ids:
+        return []
+
+    keys = {vector_key(namespace, vector_id): vector_id for vector_id in vector_ids}
+    await db.vector_refs.bulk_write([
+        UpdateOne({"_id": vector_key(namespace, vector_id)}, {"$inc": {"ref_count": -1}})
+        for vector_id in vector_ids
+    ], ordered = False)
+
+    candidates = await db.vector_refs.find(
+        {"_id": {"$in": list(keys)}, "ref_count": {"$lte": 0}},
+        {"_id": 1}
+    ).to_list(length = None)
+
+    # delete one by one (atomically) - a concurrent upload may have re-referenced an id meanwhile
+    orphaned = []
+    for i in range(0, len(candidates), 100):
+        results = await asyncio.gather(*[
+            db.vector_refs.find_one_and_delete({"_id": candidate["_id"], "ref_count": {"$lte": 0}})
+            for candidate in candidates[i:i + 100]
+        ])
+        orphaned.extend({**doc, "vector_id": keys[doc["_id"]]} for doc in results if doc is not None)
+
+    return orphaned
+
+
+async def release_knowledge_base_vectors(
+    db,
+    knowledge_base: dict
+):
+    """
+    Release the vectors of a knowledge base - only vectors no other knowledge base uses are deleted.
+    Once none of the vectors the knowledge base owns is referenced any more they are deleted with
+    one metadata filter request, the rest (and owned vectors while some are shared) by id.
+    """
+    pinecone_ids = knowledge_base.get("pinecone_id_list") or []
+    owner = knowledge_base.get("knowledge_base_id")
+    namespace = knowledge_base.get("namespace")
+
+    # knowledge bases ingested before reference counting own their (uuid) vectors outright
+    if not knowledge_base.get("ref_counted"):
+        orphaned_ids, by_id = pinecone_ids, pinecone_ids
+    else:
+        orphaned = [(doc["vector_id"], doc.get("owner")) for doc in await release_vector_refs(db, pinecone_ids, namespace)]
+        orphaned_ids = [vector_id for vector_id, _ in orphaned]
+        by_id = orphaned_ids
+        owned = [vector_id for vector_id, vector_owner in orphaned if owner is not None and vector_owner == owner]
+        if owned and await db.vector_refs.count_documents({"owner": owner}, limit = 1) == 0:
+            await delete_pinecone_vectors_by_filter({"knowledge_base_id": {"$eq": owner}}, namespace = namespace)
+            by_id = [vector_id for vector_id, vector_owner in orphaned if vector_owner != owner]
+
+    if by_id:
+        await delete_pinecone_vectors(pinecone_ids = by_id, namespace = namespace)
+    if orphaned_ids:
+        await asyncio.to_thread(lexical_index.remove, orphaned_ids, namespace)
+        answer_cache.invalidate_removed(orphaned_ids)
+
+
+async def drop_namespace_refs(
+    db,
+    namespace: str
+) -> int:
+    """Remove every reference of a namespace whose vectors were dropped all at once, returns how many"""
+    if namespace == config.PINECONE_NAMESPACE:
+        # references from before namespaces have no namespace field, they all belong to the default one
+        selector = {"namespace": {"$in": [namespace, None]}}
+    else:
+        selector = {"namespace": namespace}
+    result = await db.vector_refs.delete_many(selector)
+    return result.deleted_count
@@ -0,0 +1,68 @@
+"""
+Knowledge base snapshots - export knowledge bases with their chunks and embeddings to one compact file,
+import them into another index / namespace (or back after an accident) without any embedding calls.
+
+Usage (from src/backend, with the environment of the server):
+    python snapshot.py export <file> [--namespace NS | --knowledge-base-ids ID,ID] [--encoding float16|int8]
+    python snapshot.py import <file> [--namespace NS]
+
+import also writes the chunks to the BM25 chunk store (LEXICAL_INDEX_PATH) - a running server only loads
+it at startup, so import while it is stopped or restart it afterwards.
+"""
+import argparse
+import asyncio
+import json
+
+from config import config
+from services.mongodb import connect_to_mongodb, get_mongodb, close_mongodb_connection
+from services.pinecone import connect_to_pinecone, close_pinecone_connection
+from services.lexical_index import lexical_index
+from services.snapshots import ENCODINGS, export_snapshot, import_snapshot
+
+
+async def run(args) -> dict:
+    await connect_to_mongodb()
+    await connect_to_pinecone()
+    try:
+        if args.command == "export":
+            return await export_snapshot(
+                get_mongodb(),
+                args.file,
+                namespace = args.namespace,
+                knowledge_base_ids = args.knowledge_base_ids,
+                encoding = args.encoding
+            )
+
+        await asyncio.to_thread(lexical_index.load)
+        return await import_snapshot(get_mongodb(), args.file, namespace = args.namespace)
+
+    finally:
+        await close_pinecone_connection()
+        await close_mongodb_connection()
+        lexical_index.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Export / import knowledge base snapshots")
+    commands = parser.add_subparsers(dest = "command", required = True)
+
+    export_parser = commands.add_parser("export", help = "write knowledge bases and their embeddings to a snapshot")
+    export_parser.add_argument("file")
+    export_parser.add_argument("--namespace", help = f"namespace to export (default {config.PINECONE_NAMESPACE})")
+    export_parser.add_argument(
+        "--knowledge-base-ids",
+        type = lambda value: [item.strip() for item in value.split(",") if item.strip()],
+        help = "only these knowledge bases (comma separated)"
+    )
+    export_parser.add_argument("--encoding", choices = ENCODINGS, default = config.SNAPSHOT_ENCODING)
+
+    import_parser = commands.add_parser("import", help = "load a snapshot into the vector index")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--namespace", help = "target namespace (default the one the snapshot was exported from)")
+
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent = 2))
+
+
+if __name__ == "__main__":
+    main()
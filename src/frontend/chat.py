@@ -1,3 +1,5 @@
+import json
+
 import requests
 import streamlit as st
 
@@ -8,6 +10,33 @@ st.set_page_config(page_title="Welcome to Chatbot", page_icon="💬")
 st.title("Welcome to :blue[Diploma Help] ChatBot!")
 
 CHAT_ENDPOINT = "http://localhost:8000/chat"
+SESSION_ENDPOINT = "http://localhost:8000/chat_sessions"
+KNOWLEDGE_BASE_ENDPOINT = "http://localhost:8000/knowledge_base"
+
+
+# ---------------------------
+# Search Scope - a namespace, optionally only some of its knowledge bases
+# ---------------------------
+def fetch_knowledge_base_names(namespace):
+    try:
+        res = requests.get(KNOWLEDGE_BASE_ENDPOINT, params={"namespace": namespace, "limit": 100}, timeout=10)
+        if res.status_code == 200:
+            return {item["knowledge_base_id"]: item["knowledge_base_name"] for item in res.json()["knowledge_base_list"]}
+    except requests.exceptions.RequestException:
+        pass
+    return {}
+
+
+with st.sidebar:
+    st.subheader("Search scope")
+    namespace = st.text_input("Namespace", placeholder="default").strip() or None
+    knowledge_base_names = fetch_knowledge_base_names(namespace)
+    selected_knowledge_bases = st.multiselect(
+        "Limit to knowledge bases",
+        options=list(knowledge_base_names),
+        format_func=lambda kb_id: knowledge_base_names[kb_id],
+        placeholder="All knowledge bases"
+    )
 
 
 # ---------------------------
@@ -16,6 +45,45 @@ CHAT_ENDPOINT = "http://localhost:8000/chat"
 if "messageHistory" not in st.session_state:
     st.session_state.messageHistory = []
 
+# the conversation itself is kept by the backend - only the session id is sent with each query
+if "chatSessionId" not in st.session_state:
+    st.session_state.chatSessionId = None
+
+
+def new_chat_session():
+    res = requests.post(SESSION_ENDPOINT, timeout=10)
+    res.raise_for_status()
+    return res.json()["session_id"]
+
+
+def post_query(query):
+    return requests.post(
+        CHAT_ENDPOINT,
+        json={
+            "session_id": st.session_state.chatSessionId,
+            "query": query,
+            "namespace": namespace,
+            "knowledge_base_ids": selected_knowledge_bases or None
+        },
+        headers={"Accept": "application/x-ndjson"},
+        stream=True,
+        timeout=90
+    )
+
+
+def send_query(query):
+    if st.session_state.chatSessionId is None:
+        st.session_state.chatSessionId = new_chat_session()
+
+    response = post_query(query)
+
+    # session expired on the backend - start a new one
+    if response.status_code == 404:
+        st.session_state.chatSessionId = new_chat_session()
+        response = post_query(query)
+
+    return response
+
 
 # ---------------------------
 # Display Chat History
@@ -41,28 +109,29 @@ if query:
         placeholder = st.empty()
 
         try:
-            if len(st.session_state.messageHistory) >= 2:
-                message_history = st.session_state.messageHistory[-2:]
-            else: message_history = []
             with st.spinner("Thinking..."):
-                response_stream = requests.post(
-                    CHAT_ENDPOINT,
-                    json={
-                        "query": query,
-                        "message_history": message_history
-                    },
-                    stream=True,
-                    timeout=90
-                )
-
-            # Stream the response text
+                response_stream = send_query(query)
+
+            # Stream the response - one JSON event per line
             result_text = ""
 
-            for chunk in response_stream.iter_content(chunk_size=None):
-                if chunk:
-                    decoded = chunk.decode("utf-8", errors="ignore")
-                    result_text += decoded
+            for line in response_stream.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                event = json.loads(line)
+
+                if event["type"] == "token":
+                    result_text += event["text"]
                     placeholder.markdown(result_text)
+                elif event["type"] == "error":
+                    st.error(f"There was an error while generating response: {event['message']}")
+                elif event["type"] == "metadata" and event["ttft_ms"] is not None:
+                    caption = f"First token in {event['ttft_ms']:.0f} ms"
+                    if event["tokens_per_second"]:
+                        caption += f" · {event['tokens_per_second']:.0f} tokens/s"
+                    if event["cached"]:
+                        caption += " · cached answer"
+                    st.caption(caption)
 
         except requests.exceptions.RequestException as e:
             result_text = "❌ Backend is unavailable. Please try again later."
@@ -1,48 +1,191 @@
 import streamlit as st
 import requests
+import time
 
 # --- Page Configuration ---
 st.set_page_config(page_title="Upload Files", page_icon="💬")
 st.title("Add Knowledge to the ChatBot! - :blue[Upload Files]")
 
+# --- Namespace (tenant / course) the files are added to - empty for the default one ---
+namespace = st.text_input("Namespace", placeholder="default").strip() or None
+
 # --- File Upload ---
-fileUpload = st.file_uploader(
-    "Choose a file",
+fileUploads = st.file_uploader(
+    "Choose files",
     type=["pdf", "csv", "docx"],
-    accept_multiple_files=False
+    accept_multiple_files=True
 )
 
+# --- Upload limit (keep in sync with MAX_UPLOAD_MB of the backend) ---
+MAX_UPLOAD_MB = 200
+
 # --- Backend Endpoint ---
 fileProcessingEndpoint = "http://localhost:8000/fileProcessing"
+batchProcessingEndpoint = "http://localhost:8000/fileProcessing/batch"
+jobsEndpoint = "http://localhost:8000/jobs"
+batchesEndpoint = "http://localhost:8000/batches"
+
+# --- Stage labels shown while the job runs ---
+stage_labels = {
+    "queued": "Waiting in queue...",
+    "extracting": "Extracting content...",
+    "embedding": "Generating embeddings...",
+    "upserting": "Uploading vectors...",
+}
+
+
+def poll_job(job_id):
+    """Poll the ingestion job until it is done or failed"""
+    with st.status("Processing file...", expanded=True) as status:
+        progress_bar = st.progress(0.0)
+        while True:
+            try:
+                res = requests.get(f"{jobsEndpoint}/{job_id}", timeout=10)
+                job = res.json().get("job", {})
+            except Exception as e:
+                status.update(label=f"⚠️ Lost connection to server: {e}", state="error")
+                return
+
+            job_status = job.get("status")
+            progress = job.get("progress", {})
+
+            if job_status == "done":
+                progress_bar.progress(1.0)
+                status.update(label="✅ File added into the knowledge base!", state="complete")
+                if progress.get("duplicate_of"):
+                    st.caption("Identical file was already uploaded - its content was reused.")
+                elif progress.get("chunks_deduplicated"):
+                    st.caption(f"{progress['chunks_deduplicated']} chunks were already in the knowledge base and reused.")
+                if progress.get("resumed"):
+                    st.caption(f"Resumed an earlier attempt - {progress.get('chunks_resumed', 0)} chunks and {progress.get('embeddings_resumed', 0)} embeddings were not redone.")
+                if progress.get("vectors_per_second") is not None:
+                    st.caption(f"Uploaded {progress.get('vectors_upserted', 0)} vectors at {progress['vectors_per_second']} vectors/s")
+                st.json(job.get("stage_timings", {}))
+                return
+            if job_status == "failed":
+                status.update(label=f"❌ Processing failed! {job.get('error')}", state="error")
+                return
+
+            # chunks are produced while earlier ones are uploaded - the total grows until chunking ends
+            total = progress.get("chunks_total") or progress.get("chunks_produced") or 0
+            if total:
+                done = progress.get("vectors_upserted", 0) + progress.get("chunks_deduplicated", 0) + progress.get("chunks_resumed", 0)
+                progress_bar.progress(
+                    min(done / total, 1.0),
+                    text=f"{done} / {total} chunks stored"
+                )
+            status.update(label=stage_labels.get(job_status, "Processing file..."))
+            time.sleep(1)
+
+def poll_batch(batch_id, rejected):
+    """Poll the batch until every file is done or failed - one status line per file"""
+    with st.status("Processing files...", expanded=True) as status:
+        progress_bar = st.progress(0.0)
+        table = st.empty()
+        while True:
+            try:
+                res = requests.get(f"{batchesEndpoint}/{batch_id}", timeout=10)
+                jobs = res.json().get("jobs", [])
+            except Exception as e:
+                status.update(label=f"⚠️ Lost connection to server: {e}", state="error")
+                return
+
+            rows = []
+            finished = 0
+            for job in jobs:
+                job_status = job.get("status")
+                progress = job.get("progress", {})
+                if job_status == "done":
+                    detail = "✅ Added"
+                    if progress.get("duplicate_of"):
+                        detail += " (identical file already uploaded)"
+                    finished += 1
+                elif job_status == "failed":
+                    detail = f"❌ {job.get('error')}"
+                    finished += 1
+                else:
+                    detail = stage_labels.get(job_status, "Processing file...")
+                    total = progress.get("chunks_total") or progress.get("chunks_produced") or 0
+                    if total:
+                        done = progress.get("vectors_upserted", 0) + progress.get("chunks_deduplicated", 0) + progress.get("chunks_resumed", 0)
+                        detail += f" {min(done, total)} / {total} chunks"
+                rows.append({"File": job.get("file_name"), "Status": detail})
+            for file_name, error in rejected:
+                rows.append({"File": file_name, "Status": f"⛔ Rejected: {error}"})
+
+            table.table(rows)
+            if jobs:
+                progress_bar.progress(finished / len(jobs), text=f"{finished} / {len(jobs)} files finished")
+            if jobs and finished == len(jobs):
+                failed = sum(1 for job in jobs if job.get("status") == "failed")
+                if failed:
+                    status.update(label=f"⚠️ {len(jobs) - failed} files added, {failed} failed", state="error")
+                else:
+                    status.update(label=f"✅ {len(jobs)} files added into the knowledge base!", state="complete")
+                return
+            time.sleep(1)
+
+
+# --- MIME types of the supported files ---
+file_type_map = {
+    "pdf": "application/pdf",
+    "csv": "text/csv",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+}
+
+
+def mime_type_of(fileUpload):
+    file_ext = fileUpload.name.split(".")[-1].lower()
+    return file_type_map.get(file_ext, "application/octet-stream")
+
 
 # --- File Handling ---
-if fileUpload is not None:
-    # Check file size (limit = 3MB)
-    file_size_mb = len(fileUpload.getvalue()) / (1024 * 1024)
-    if file_size_mb > 3:
-        st.error("❌ File too large! Please upload a file under 3 MB.")
-    else:
-        # Detect MIME type
-        file_type_map = {
-            "pdf": "application/pdf",
-            "csv": "text/csv",
-            "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        }
-        file_ext = fileUpload.name.split(".")[-1].lower()
-        mime_type = file_type_map.get(file_ext, "application/octet-stream")
-
-        # Prepare file for backend
-        files = {
-            "file": (fileUpload.name, fileUpload.getvalue(), mime_type)
-        }
-
-        # Upload to backend
-        with st.spinner("Uploading and processing..."):
+if fileUploads:
+    # Check file sizes without copying the content
+    too_large = [f for f in fileUploads if f.size / (1024 * 1024) > MAX_UPLOAD_MB]
+    for f in too_large:
+        st.error(f"❌ {f.name} is too large! Please upload files under {MAX_UPLOAD_MB} MB.")
+    accepted = [f for f in fileUploads if f not in too_large]
+
+    # Upload to backend once per selection - reruns keep polling the same job / batch
+    selection_id = (namespace,) + tuple(f.file_id for f in accepted)
+    if accepted and st.session_state.get("uploaded_selection") != selection_id:
+        with st.spinner(f"Uploading {len(accepted)} file(s)..."):
             try:
-                response = requests.post(fileProcessingEndpoint, files=files)
-                if response.status_code == 200:
-                    st.success("✅ File added into the knowledge base!")
+                # the file objects are streamed, not copied with getvalue()
+                for f in accepted:
+                    f.seek(0)
+
+                if len(accepted) == 1:
+                    fileUpload = accepted[0]
+                    response = requests.post(
+                        fileProcessingEndpoint,
+                        files={"file": (fileUpload.name, fileUpload, mime_type_of(fileUpload))},
+                        data={"namespace": namespace} if namespace else None
+                    )
+                else:
+                    response = requests.post(
+                        batchProcessingEndpoint,
+                        files=[("files", (f.name, f, mime_type_of(f))) for f in accepted],
+                        data={"namespace": namespace} if namespace else None
+                    )
+
+                if response.status_code in (200, 202):
+                    result = response.json()
+                    st.session_state.uploaded_selection = selection_id
+                    st.session_state.job_id = result.get("job_id")
+                    st.session_state.batch_id = result.get("batch_id")
+                    st.session_state.rejected_files = [
+                        (f["file_name"], f.get("error")) for f in result.get("files", [])
+                        if f.get("status") == "rejected"
+                    ]
                 else:
                     st.error(f"❌ Upload failed! {response.text}")
             except Exception as e:
                 st.error(f"⚠️ Error connecting to server: {e}")
+
+    if accepted and st.session_state.get("uploaded_selection") == selection_id:
+        if st.session_state.get("batch_id"):
+            poll_batch(st.session_state.batch_id, st.session_state.rejected_files)
+        else:
+            poll_job(st.session_state.job_id)
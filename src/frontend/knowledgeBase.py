@@ -1,5 +1,6 @@
 import streamlit as st
 import requests
+import time
 
 # --- Page Configuration ---
 st.set_page_config(page_title="Knowledge Base", page_icon="💬")
@@ -8,18 +9,51 @@ st.title("View Knowledge Base (Uploaded Files) of :blue[Diploma AI]")
 BASE_URL = "http://localhost:8000"
 
 
+PAGE_SIZE = 20
+CONTENT_PREVIEW_BYTES = 64 * 1024
+
+
 # -----------------------------
-# Fetch knowledge base list
+# Fetch one page of the knowledge base list (summaries only)
 # -----------------------------
-def fetch_knowledge_base():
+def fetch_knowledge_base(cursor=None):
     try:
-        res = requests.get(f"{BASE_URL}/knowledge_base")
+        params = {"limit": PAGE_SIZE}
+        if cursor:
+            params["cursor"] = cursor
+        res = requests.get(f"{BASE_URL}/knowledge_base", params=params)
         if res.status_code == 200:
-            return res.json().get("knowledge_base_list", [])
-        return []
+            data = res.json()
+            return data.get("knowledge_base_list", []), data.get("next_cursor")
+        return [], None
     except Exception:
         st.error("❌ Error fetching knowledge base.")
-        return []
+        return [], None
+
+
+# -----------------------------
+# Fetch a byte range of the extracted content
+# -----------------------------
+def fetch_content(item_id, start, length):
+    try:
+        res = requests.get(
+            f"{BASE_URL}/knowledge_base/{item_id}/content",
+            headers={"Range": f"bytes={start}-{start + length - 1}"}
+        )
+        if res.status_code in (200, 206):
+            return res.content
+        return b""
+    except Exception:
+        st.error("❌ Error fetching content.")
+        return b""
+
+
+def format_size(size):
+    for unit in ["B", "KB", "MB"]:
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
 
 
 # -----------------------------
@@ -35,12 +69,47 @@ def delete_knowledge_item(item_id):
         return False, str(e)
 
 
+# -----------------------------
+# Upload a new version of a knowledge base entry
+# -----------------------------
+def update_knowledge_item(item_id, upload):
+    try:
+        res = requests.put(
+            f"{BASE_URL}/knowledge_base/{item_id}",
+            files={"file": (upload.name, upload.getvalue(), upload.type or "application/octet-stream")}
+        )
+        if res.status_code != 202:
+            return False, res.json().get("message") or res.text
+
+        # wait for the background job - only the changed chunks are re-embedded
+        job_id = res.json().get("job_id")
+        while True:
+            job = requests.get(f"{BASE_URL}/jobs/{job_id}", timeout=10).json().get("job", {})
+            if job.get("status") == "done":
+                progress = job.get("progress", {})
+                if progress.get("unchanged"):
+                    return True, "No changes - the uploaded version is identical."
+                return True, f"Updated: {progress.get('chunks_added', 0)} chunks added, {progress.get('chunks_removed', 0)} removed."
+            if job.get("status") == "failed":
+                return False, job.get("error")
+            time.sleep(1)
+    except Exception as e:
+        return False, str(e)
+
+
 # -----------------------------
 # Main UI
 # -----------------------------
-knowledge_list = fetch_knowledge_base()
+# cursors of the pages visited so far - index 0 is the first page
+if "kb_cursors" not in st.session_state:
+    st.session_state.kb_cursors = [None]
+# content loaded so far per knowledge base (bytes), only for cards that were opened
+if "kb_content" not in st.session_state:
+    st.session_state.kb_content = {}
 
-if not knowledge_list:
+knowledge_list, next_cursor = fetch_knowledge_base(st.session_state.kb_cursors[-1])
+
+if not knowledge_list and len(st.session_state.kb_cursors) == 1:
     st.info("No knowledge base uploaded yet.")
 else:
     st.subheader("📚 Uploaded Knowledge Base")
@@ -52,7 +121,7 @@ else:
     for item in knowledge_list:
         kb_id = item["knowledge_base_id"]
         kb_name = item["knowledge_base_name"]
-        kb_content = item["content"]
+        kb_size = item.get("content_size", 0)
         created_at = item.get("created_at", "")
 
         with st.container(border=True):
@@ -61,7 +130,9 @@ else:
             # Left block: Title + timestamp
             with cols[0]:
                 st.markdown(f"### {kb_name}")
-                st.caption(f"Created at: {created_at}")
+                st.caption(
+                    f"Created at: {created_at} · {format_size(kb_size)} · {item.get('chunk_count', 0)} chunks"
+                )
 
             # Right block: Delete button
             with cols[1]:
@@ -79,6 +150,7 @@ else:
                         if success:
                             st.success(msg)
                             st.session_state.confirm_delete = None
+                            st.session_state.kb_content.pop(kb_id, None)
                             st.rerun()
                         else:
                             st.error(msg)
@@ -87,13 +159,54 @@ else:
                     if st.button("❌ Cancel", key=f"confirm_no_{kb_id}"):
                         st.session_state.confirm_delete = None
 
-            # Content expander
-            with st.expander("📄 View Content"):
+            # New version upload
+            with st.expander("⬆️ Upload New Version"):
+                new_version = st.file_uploader(
+                    "Choose the updated file",
+                    type=["pdf", "csv", "docx"],
+                    key=f"update_file_{kb_id}"
+                )
+                if new_version is not None and st.button("Update", key=f"update_btn_{kb_id}"):
+                    with st.spinner("Updating..."):
+                        success, msg = update_knowledge_item(kb_id, new_version)
+                    if success:
+                        st.session_state.kb_content.pop(kb_id, None)
+                        st.success(msg)
+                    else:
+                        st.error(msg)
+
+            # Content - fetched only when the card is opened, in CONTENT_PREVIEW_BYTES pieces
+            if st.toggle("📄 View Content", key=f"view_content_{kb_id}"):
+                if kb_id not in st.session_state.kb_content:
+                    st.session_state.kb_content[kb_id] = fetch_content(kb_id, 0, CONTENT_PREVIEW_BYTES)
+                loaded = st.session_state.kb_content[kb_id]
+
                 st.text_area(
                     label="Extracted Content",
-                    value=kb_content,
+                    value=loaded.decode("utf-8", errors="ignore"),
                     height=200,
-                    disabled=True
+                    disabled=True,
+                    key=f"content_{kb_id}"
                 )
+                if len(loaded) < kb_size:
+                    st.caption(f"Showing {format_size(len(loaded))} of {format_size(kb_size)}")
+                    if st.button("Load more", key=f"more_{kb_id}"):
+                        st.session_state.kb_content[kb_id] = loaded + fetch_content(
+                            kb_id, len(loaded), CONTENT_PREVIEW_BYTES
+                        )
+                        st.rerun()
 
             st.divider()
+
+    # Pagination
+    prev_col, page_col, next_col = st.columns([1, 2, 1])
+    with prev_col:
+        if len(st.session_state.kb_cursors) > 1 and st.button("⬅️ Previous"):
+            st.session_state.kb_cursors.pop()
+            st.rerun()
+    with page_col:
+        st.caption(f"Page {len(st.session_state.kb_cursors)}")
+    with next_col:
+        if next_cursor and st.button("Next ➡️"):
+            st.session_state.kb_cursors.append(next_cursor)
+            st.rerun()